@@ -1,5 +1,5 @@
 import streamlit as st
-import requests
+from modules.frontend_methods import api_request
 import logging
 
 # Title and information
@@ -15,8 +15,9 @@ if st.button("Submit"):
     if username_input and password_input:
 
         # Sending the new user's credentials to FastAPI
-        response = requests.post(
-            "http://127.0.0.1:8000/users/auth/",
+        response = api_request(
+            "POST",
+            "/users/auth/",
             json={
                 "username": username_input,
                 "password": password_input
@@ -28,9 +29,24 @@ if st.button("Submit"):
             st.write(f"{result['response_message']}")
 
             if result['response_message'] == "User authenticated.":
+                # Keeping the session token, sent with every request to FastAPI
+                st.session_state.access_token = result["access_token"]
+                st.session_state.username = username_input
+
                 # Rerouting to the patients list
                 st.switch_page("pages/patient_list.py")
 
         else:
             logging.error(f"Error: {response.status_code}, {response.text}")
             st.write(f"Error: {response.status_code}, {response.text}")
+
+if st.session_state.get("access_token"):
+    st.write(f"Logged in as {st.session_state.get('username')}")
+
+    if st.button("Log out"):
+        # Revoking the session token
+        api_request("POST", "/users/logout/")
+
+        del st.session_state.access_token
+        st.session_state.pop("username", None)
+        st.rerun()
@@ -0,0 +1,129 @@
+"""
+Load test of the database routes: a sync route (threadpool worker + sync session) versus an async route
+(async session on the event loop), both reading one patient, at 50 and 500 concurrent clients
+
+The API is served by uvicorn in a subprocess, on a copy of the database.
+
+Usage (from the repository root, with FERNET_KEY set):
+    python -m benchmarks.bench_async_routes [requests per run]
+"""
+from fastapi import Depends, FastAPI, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+import asyncio
+import httpx
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+PORT = 8766
+
+def create_bench_app():
+    """
+    Builds the benchmarked application (imported by uvicorn in the subprocess)
+    """
+    from models import app_user  # noqa: F401 (registers the users, related to the roles)
+    from models.patient import get_patient, get_patient_async
+    from modules.database import get_async_db, get_db
+
+    bench_app = FastAPI()
+
+    @bench_app.get("/sync/{id_patient}/")
+    def get_patient_sync_route(id_patient: int, db: Session = Depends(get_db)):
+        patient = get_patient(db, id_patient)
+        if not patient:
+            raise HTTPException(status_code=404, detail="Patient not found")
+
+        return {"id_patient": patient.id_patient, "last_name": patient.last_name, "age": patient.age}
+
+    @bench_app.get("/async/{id_patient}/")
+    async def get_patient_async_route(id_patient: int, db: AsyncSession = Depends(get_async_db)):
+        patient = await get_patient_async(db, id_patient)
+        if not patient:
+            raise HTTPException(status_code=404, detail="Patient not found")
+
+        return {"id_patient": patient.id_patient, "last_name": patient.last_name, "age": patient.age}
+
+    return bench_app
+
+async def load(path: str, concurrency: int, requests: int):
+    """
+    Sends requests to a route from concurrent clients
+
+    Return:
+        - the number of requests per second
+        - the 95th percentile latency (in milliseconds)
+        - the number of failed requests
+    """
+    latencies = []
+    failures = 0
+    remaining = iter(range(requests))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal failures
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    # A missing patient (404) is still a database round trip
+                    response = await client.get(f"{path}{random.randint(1, 1338)}/")
+                    if response.status_code not in (200, 404):
+                        response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                except Exception:
+                    failures += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        duration = time.perf_counter() - start
+
+    latencies.sort()
+
+    return len(latencies) / duration, latencies[int(len(latencies) * 0.95)] * 1000 if latencies else None, failures
+
+def wait_for_server(server):
+    """
+    Waits until the API answers
+    """
+    for _ in range(600):
+        if server.poll() is not None:
+            raise RuntimeError("The API did not start")
+        try:
+            httpx.get(f"http://127.0.0.1:{PORT}/sync/1/", timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+
+    raise RuntimeError("The API did not start in time")
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, "bench.db")
+        shutil.copy("data/db_insurance.db", database_path)
+
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{database_path}"}
+        env.pop("ASYNC_DATABASE_URL", None)
+        server = subprocess.Popen(
+            [sys.executable, "-W", "ignore", "-m", "uvicorn", "--factory", "benchmarks.bench_async_routes:create_bench_app",
+             "--port", str(PORT), "--log-level", "warning", "--no-access-log"],
+            env=env
+        )
+
+        try:
+            wait_for_server(server)
+
+            print(f"{'route':<8} {'clients':>8} {'requests/s':>11} {'p95':>10} {'failed':>7}")
+            for concurrency in (50, 500):
+                for path in ("/sync/", "/async/"):
+                    rate, p95, failures = asyncio.run(load(path, concurrency, requests))
+                    print(f"{path.strip('/'):<8} {concurrency:>8} {rate:>11.0f} {p95:>8.1f}ms {failures:>7}")
+        finally:
+            server.terminate()
+            server.wait()
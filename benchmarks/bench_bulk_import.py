@@ -0,0 +1,105 @@
+"""
+Benchmark of the patient imports: one create_patient per row (one session and one commit per patient,
+as when posting them one by one to /patients/add_patient/) versus the bulk import (chunks encrypted
+in one batch and inserted with one executemany INSERT per commit)
+
+Usage (from the repository root, with FERNET_KEY set):
+    python -m benchmarks.bench_bulk_import [rows] [chunk size]
+"""
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from models import app_user  # noqa: F401 (registers the users, related to the roles)
+from models.base import Base
+from models.patient import PatientCreate, create_patient
+from models.region import Region
+from models.sex import Sex
+from models.smoker import Smoker
+from modules.bulk_import import IMPORT_CHUNK_SIZE, import_patient_file
+from modules.lookup_cache import lookup_cache
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+def make_row(i):
+    """
+    Builds the data of an imported patient
+    """
+    return {
+        "last_name": f"Last{i}",
+        "first_name": f"First{i}",
+        "age": 18 + i % 47,
+        "bmi": 20.0 + i % 15,
+        "patient_email": f"patient{i}@example.com",
+        "children": i % 4,
+        "charges": 1000.0 + i,
+        "region": ["southwest", "southeast", "northwest", "northeast"][i % 4],
+        "smoker": ["yes", "no"][i % 2],
+        "sex": ["female", "male"][i % 2]
+    }
+
+def run_single(session_factory, rows):
+    """
+    Inserts the patients one by one
+
+    Return:
+        - the number of rows per second
+    """
+    start = time.perf_counter()
+    for i in range(rows):
+        row = make_row(i)
+        db = session_factory()
+        try:
+            create_patient(db, PatientCreate(**{**row, "region": str(i % 4), "smoker": str(i % 2), "sex": str(i % 2)}))
+        finally:
+            db.close()
+
+    return rows / (time.perf_counter() - start)
+
+def run_bulk(session_factory, rows, chunk_size):
+    """
+    Imports the patients from an NDJSON file
+
+    Return:
+        - the number of rows per second
+    """
+    data = io.BytesIO("".join(json.dumps(make_row(i)) + "\n" for i in range(rows)).encode())
+
+    db = session_factory()
+    try:
+        stats = import_patient_file(db, data, "ndjson", chunk_size)
+    finally:
+        db.close()
+
+    assert stats["imported_rows"] == rows, stats
+
+    return stats["rows_per_second"]
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else IMPORT_CHUNK_SIZE
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(insert(Region), [{"id_region": i, "region_name": name} for i, name in enumerate(["southwest", "southeast", "northwest", "northeast"])])
+            connection.execute(insert(Smoker), [{"id_smoker": 0, "is_smoker": "yes"}, {"id_smoker": 1, "is_smoker": "no"}])
+            connection.execute(insert(Sex), [{"id_sex": 0, "sex_label": "female"}, {"id_sex": 1, "sex_label": "male"}])
+
+        session_factory = sessionmaker(bind=engine, autoflush=False)
+        lookup_cache.session_factory = session_factory
+        lookup_cache.load()
+
+        print(f"{'import':<36} {'rows':>8} {'rows/s':>10} {'500k rows':>10}")
+        single_rows = min(rows, 2000)
+        for name, count, run in [
+            ("one create_patient per row", single_rows, lambda: run_single(session_factory, single_rows)),
+            (f"bulk import (chunks of {chunk_size})", rows, lambda: run_bulk(session_factory, rows, chunk_size))
+        ]:
+            rate = run()
+            print(f"{name:<36} {count:>8} {rate:>10.0f} {500000 / rate / 60:>8.1f} min")
+
+        engine.dispose()
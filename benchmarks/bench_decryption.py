@@ -0,0 +1,50 @@
+"""
+Benchmark of the decryption stage: throughput versus the number of rows and the number of workers
+
+Usage (from the repository root, with FERNET_KEY set):
+    DECRYPTION_EXECUTOR=thread python -m benchmarks.bench_decryption
+    DECRYPTION_EXECUTOR=process python -m benchmarks.bench_decryption
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from modules import encryption
+import multiprocessing
+import time
+
+ROW_COUNTS = [100, 1000, 10000, 50000]
+WORKER_COUNTS = [1, 2, 4, 8]
+
+# Each patient row has 3 encrypted fields
+FIELDS = ["last_name", "first_name", "patient_email"]
+
+def make_rows(count):
+    """
+    Builds rows of encrypted fields, stored like the patient table's
+    """
+    return [
+        {field: str(encryption.fernet.encrypt(f"{field}-{i}@example.com".encode())) for field in FIELDS}
+        for i in range(count)
+    ]
+
+if __name__ == "__main__":
+    print(f"executor: {encryption.DECRYPTION_EXECUTOR}, chunk size: {encryption.DECRYPTION_CHUNK_SIZE}")
+    print(f"{'rows':>8} {'workers':>8} {'seconds':>10} {'rows/s':>12}")
+
+    for row_count in ROW_COUNTS:
+        rows = make_rows(row_count)
+
+        for workers in WORKER_COUNTS:
+            # Replacing the module's pool with one of the benchmarked size
+            encryption.DECRYPTION_WORKERS = workers
+            encryption.DECRYPTION_MIN_PARALLEL_VALUES = 0
+            if encryption.DECRYPTION_EXECUTOR == "process":
+                encryption._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                encryption._executor = ThreadPoolExecutor(max_workers=workers)
+            encryption.decrypt_values(value for row in rows[:100] for value in row.values())  # Warming up the pool
+
+            start = time.perf_counter()
+            encryption.decrypt_fields([dict(row) for row in rows], FIELDS)
+            duration = time.perf_counter() - start
+
+            encryption._executor.shutdown()
+            print(f"{row_count:>8} {workers:>8} {duration:>10.3f} {row_count / duration:>12.0f}")
@@ -0,0 +1,89 @@
+"""
+Microbenchmark of the single-prediction hot path: the former pandas pipeline
+versus the FeatureEncoder, both followed by the model's prediction
+
+Usage (from the repository root):
+    python -m benchmarks.bench_feature_encoder [iterations]
+"""
+from models.patient import PatientBaseAI
+from modules.feature_encoding import FeatureEncoder
+import joblib
+import numpy as np
+import pandas as pd
+import sys
+import time
+import warnings
+
+warnings.filterwarnings("ignore", message="X does not have valid feature names", category=UserWarning)
+
+PATIENT = {"age": "35", "sex": "female", "bmi": "18.2", "children": "0", "smoker": "no", "region": "southwest"}
+
+def pandas_encoding(item_dict):
+    """
+    The former encoding of charges_prediction (one-row dataframe)
+    """
+    df = pd.DataFrame([item_dict])
+
+    df['age'] = int(df['age'].iloc[0])
+    df['bmi'] = float(df['bmi'].iloc[0])
+    df['children'] = int(df['children'].iloc[0])
+
+    df['smoker'] = df['smoker'].map({'no': 0, 'yes': 1})
+    df['sex'] = df['sex'].map({'male': 0, 'female': 1})
+
+    df['region_northeast'] = 0
+    df['region_northwest'] = 0
+    df['region_southeast'] = 0
+    df['region_southwest'] = 0
+
+    if df['region'][0] == 'northwest':
+        df.loc[0, "region_northwest"] = 1
+    elif df['region'][0] == 'northeast':
+        df.loc[0, "region_northeast"] = 1
+    elif df['region'][0] == 'southwest':
+        df.loc[0, "region_southwest"] = 1
+    elif df['region'][0] == 'southeast':
+        df.loc[0, "region_southeast"] = 1
+
+    df.drop(labels='region', axis=1, inplace=True)
+
+    df['age'] = df['age'] / 100
+    df['bmi'] = df['bmi'] / 100
+    df['children'] = df['children'] / 100
+
+    return df
+
+def timeit(function, iterations):
+    """
+    Times a function
+
+    Return:
+        - the mean duration of a call, in microseconds
+    """
+    function()  # Warming up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+
+    return (time.perf_counter() - start) / iterations * 1e6
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    model = joblib.load("data/gradient_boosting_model.joblib")
+    encoder = FeatureEncoder.from_model(model)
+    patient = PatientBaseAI(**PATIENT)
+    buffer = np.empty((1, encoder.n_features), dtype=np.float64)
+
+    # Both paths must give the same prediction
+    assert np.allclose(model.predict(pandas_encoding(PATIENT)), model.predict(encoder.encode(patient)))
+
+    results = {
+        "pandas encoding": timeit(lambda: pandas_encoding(PATIENT), iterations),
+        "FeatureEncoder.encode": timeit(lambda: encoder.encode(patient, out=buffer), iterations),
+        "pandas encoding + predict": timeit(lambda: model.predict(pandas_encoding(PATIENT)), iterations),
+        "FeatureEncoder.encode + predict": timeit(lambda: model.predict(encoder.encode(patient, out=buffer)), iterations),
+    }
+
+    for name, duration in results.items():
+        print(f"{name:<35} {duration:10.1f} us/call")
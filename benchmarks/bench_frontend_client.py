@@ -0,0 +1,49 @@
+"""
+Benchmark of the API calls made by a render of the patient list page: a new connection per request
+(the former requests.get calls) versus the pooled keep-alive session of the frontend
+
+Usage (from the repository root, with the API running, e.g. uvicorn main:app):
+    API_BASE_URL=http://127.0.0.1:8000 python -m benchmarks.bench_frontend_client [renders]
+"""
+from modules.frontend_methods import API_BASE_URL, API_TIMEOUT, create_http_session
+import requests
+import statistics
+import sys
+import time
+
+# Requests of one render of the patient list page
+PAGE_REQUESTS = [
+    ("/patients/regions/", None),
+    ("/patients/smokers/", None),
+    ("/patients/sexes/", None),
+    ("/patients/patients/", {"limit": 100})
+]
+
+def render(get):
+    """
+    Sends the requests of one render of the patient list page
+
+    Return:
+        - the duration of the render, in milliseconds
+    """
+    start = time.perf_counter()
+    for path, params in PAGE_REQUESTS:
+        response = get(f"{API_BASE_URL}{path}", params=params, timeout=API_TIMEOUT)
+        response.raise_for_status()
+
+    return (time.perf_counter() - start) * 1000
+
+if __name__ == "__main__":
+    renders = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    session = create_http_session()
+    clients = {
+        "new connection per request": requests.get,
+        "pooled keep-alive session": session.get
+    }
+
+    print(f"{'client':<28} {'median (ms)':>12} {'p95 (ms)':>10}")
+    for name, get in clients.items():
+        render(get)  # Warming up
+        durations = sorted(render(get) for _ in range(renders))
+        print(f"{name:<28} {statistics.median(durations):>12.1f} {durations[int(len(durations) * 0.95) - 1]:>10.1f}")
@@ -0,0 +1,113 @@
+"""
+Benchmark of the login latency versus the number of users: the indexed lookup of one user and the check
+of its PBKDF2 hash, versus the former full scan decrypting every user's password
+
+Usage (from the repository root, with FERNET_KEY set):
+    python -m benchmarks.bench_login [user counts...]
+"""
+from sqlalchemy import create_engine, insert, update
+from sqlalchemy.orm import sessionmaker
+from models.app_user import AppUser, get_app_user_by_username
+from models.user_role import UserRole
+from modules.encryption import decrypt_value, fernet
+from modules.passwords import hash_password, verify_password
+import hashlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+USER_COUNTS = [10, 10000, 1000000]
+
+# The full scan decrypts every password: above this number of users it is not measured
+LEGACY_MAX_USERS = 10000
+
+RUNS = 5
+
+PASSWORD = hashlib.sha256("benchmark".encode()).hexdigest()
+
+def make_database(path, user_count):
+    """
+    Creates a database of user_count users sharing the same password hash
+    """
+    engine = create_engine(f"sqlite:///{path}")
+    UserRole.__table__.create(engine)
+    AppUser.__table__.create(engine)
+
+    password_hash = hash_password(PASSWORD)
+
+    with engine.begin() as connection:
+        for start in range(0, user_count, 100000):
+            connection.execute(insert(AppUser), [
+                {"id_user": i, "username": f"user{i}", "password": password_hash, "user_email": f"user{i}@example.com", "id_role": 1}
+                for i in range(start, min(start + 100000, user_count))
+            ])
+
+    return engine
+
+def lookup(db, username):
+    """
+    The indexed lookup alone (without the hash check)
+    """
+    return get_app_user_by_username(db, username) is not None
+
+def indexed_login(db, username):
+    """
+    The current authentication: one indexed lookup and one hash check
+    """
+    app_user = get_app_user_by_username(db, username)
+
+    return app_user is not None and verify_password(PASSWORD, app_user.password)
+
+def full_scan_login(db, username):
+    """
+    The former authentication: decrypting every user's password
+    """
+    for app_user in db.query(AppUser).all():
+        if app_user.username == username and decrypt_value(app_user.password) == PASSWORD:
+            return True
+
+    return False
+
+def median_duration(function, *args):
+    """
+    Times a function
+
+    Return:
+        - the median duration of a call, in milliseconds
+    """
+    durations = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        assert function(*args)
+        durations.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(durations)
+
+if __name__ == "__main__":
+    user_counts = [int(count) for count in sys.argv[1:]] or USER_COUNTS
+
+    print(f"{'users':>10} {'lookup (ms)':>12} {'indexed login (ms)':>19} {'full scan login (ms)':>21}")
+
+    for user_count in user_counts:
+        with tempfile.TemporaryDirectory() as directory:
+            engine = make_database(os.path.join(directory, "bench.db"), user_count)
+            db = sessionmaker(bind=engine)()
+
+            # Looking up the last user (the worst case of the full scan)
+            username = f"user{user_count - 1}"
+            lookup_only = median_duration(lookup, db, username)
+            indexed = median_duration(indexed_login, db, username)
+
+            full_scan = None
+            if user_count <= LEGACY_MAX_USERS:
+                db.execute(update(AppUser).values(password=fernet.encrypt(PASSWORD.encode())))
+                db.commit()
+                full_scan = median_duration(full_scan_login, db, username)
+
+            db.close()
+            engine.dispose()
+
+        full_scan = f"{full_scan:.1f}" if full_scan is not None else "skipped"
+        print(f"{user_count:>10} {lookup_only:>12.2f} {indexed:>19.1f} {full_scan:>21}")
@@ -0,0 +1,108 @@
+"""
+Benchmark of the single patient inserts: the former foreign key checks (one SELECT per lookup table
+and related objects assigned) versus the IDs checked against the in-memory lookup tables
+
+Usage (from the repository root, with FERNET_KEY set):
+    python -m benchmarks.bench_patient_insert [inserts]
+"""
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker
+from models import app_user  # noqa: F401 (registers the users, related to the roles)
+from models.base import Base
+from models.patient import Patient, PatientCreate, create_patient
+from models.region import Region
+from models.sex import Sex
+from models.smoker import Smoker
+from modules.lookup_cache import lookup_cache
+import os
+import sys
+import tempfile
+import time
+
+def make_item(i):
+    """
+    Builds the data of a new patient
+    """
+    return PatientCreate(
+        last_name=f"Last{i}",
+        first_name=f"First{i}",
+        age=30,
+        bmi=25.0,
+        patient_email=f"patient{i}@example.com",
+        children=1,
+        charges=5000.0,
+        region=str(i % 4),
+        smoker=str(i % 2),
+        sex=str(i % 2)
+    )
+
+def former_create_patient(db, item):
+    """
+    The former create_patient: one SELECT per lookup table, the related objects assigned,
+    and the new patient read back
+    """
+    db_patient = Patient(
+        last_name=item.last_name,
+        first_name=item.first_name,
+        age=int(item.age),
+        bmi=float(item.bmi),
+        patient_email=item.patient_email,
+        children=int(item.children),
+        charges=float(item.charges)
+    )
+    db_patient.region = db.query(Region).filter(Region.id_region == int(item.region)).first()
+    db_patient.smoker = db.query(Smoker).filter(Smoker.id_smoker == int(item.smoker)).first()
+    db_patient.sex = db.query(Sex).filter(Sex.id_sex == int(item.sex)).first()
+
+    db.add(db_patient)
+    db.commit()
+    db.refresh(db_patient)
+
+    return db_patient
+
+def run(create, session_factory, engine, inserts, offset):
+    """
+    Inserts patients one by one (one session and one commit per insert, as the API does)
+
+    Return:
+        - the number of inserts per second
+        - the number of SQL statements per insert
+    """
+    statements = []
+    listener = lambda *args: statements.append(1)
+    event.listen(engine, "before_cursor_execute", listener)
+
+    start = time.perf_counter()
+    for i in range(offset, offset + inserts):
+        db = session_factory()
+        try:
+            create(db, make_item(i))
+        finally:
+            db.close()
+    duration = time.perf_counter() - start
+
+    event.remove(engine, "before_cursor_execute", listener)
+
+    return inserts / duration, len(statements) / inserts
+
+if __name__ == "__main__":
+    inserts = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(insert(Region), [{"id_region": i, "region_name": name} for i, name in enumerate(["southwest", "southeast", "northwest", "northeast"])])
+            connection.execute(insert(Smoker), [{"id_smoker": 0, "is_smoker": "yes"}, {"id_smoker": 1, "is_smoker": "no"}])
+            connection.execute(insert(Sex), [{"id_sex": 0, "sex_label": "female"}, {"id_sex": 1, "sex_label": "male"}])
+
+        session_factory = sessionmaker(bind=engine, autoflush=False)
+        lookup_cache.session_factory = session_factory
+        lookup_cache.load()
+
+        print(f"{'create_patient':<32} {'inserts/s':>10} {'statements/insert':>18}")
+        for offset, (name, create) in enumerate([("former (SELECT per lookup table)", former_create_patient), ("in-memory lookup IDs", create_patient)]):
+            rate, statements = run(create, session_factory, engine, inserts, offset * inserts)
+            print(f"{name:<32} {rate:>10.0f} {statements:>18.1f}")
+
+        engine.dispose()
@@ -0,0 +1,129 @@
+"""
+Benchmark of concurrent reads and writes on SQLite: the former engine (rollback journal, where a writer
+blocks every reader) versus the tuned engine of modules.database (WAL, synchronous=NORMAL, memory-mapped I/O,
+larger cache, busy timeout, sized pool)
+
+Usage (from the repository root, with FERNET_KEY set):
+    python -m benchmarks.bench_sqlite_concurrency [readers] [writers] [seconds]
+"""
+from sqlalchemy import insert, text
+from models import app_user  # noqa: F401 (registers the users, related to the roles)
+from models.base import Base
+from models.patient import Patient
+from modules.database import create_db_engine, sqlite_pragmas
+from modules.encryption import raw_token_param
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+# Patients stored before the benchmark
+INITIAL_PATIENTS = 20000
+
+# Insert of the patients, their personal data written as dummy tokens (not encrypted)
+INSERT_PATIENT = insert(Patient.__table__).values({column: raw_token_param(column) for column in ["last_name", "first_name", "patient_email"]})
+
+READ_QUERY = text("SELECT id_patient, age, bmi, charges FROM patient WHERE age BETWEEN :min_age AND :min_age + 5 ORDER BY id_patient LIMIT 100")
+
+def make_patient(i):
+    """
+    Builds the values of a stored patient (the personal data as dummy tokens)
+    """
+    return {
+        "last_name": f"Last{i}".encode(),
+        "first_name": f"First{i}".encode(),
+        "age": 18 + i % 47,
+        "bmi": 20.0 + i % 15,
+        "patient_email": f"patient{i}@example.com".encode(),
+        "children": i % 4,
+        "charges": 1000.0 + i,
+        "id_region": i % 4,
+        "id_smoker": i % 2,
+        "id_sex": i % 2
+    }
+
+def run(engine, readers, writers, seconds):
+    """
+    Runs reader threads (a filtered page of patients per query) and writer threads (one insert and commit
+    per transaction) against the same database
+
+    Return:
+        - a dictionary with the reads and writes per second, the 95th percentile read latency and the lock errors
+    """
+    stop = threading.Event()
+    lock = threading.Lock()
+    read_latencies = []
+    counters = {"writes": 0, "errors": 0}
+
+    def read():
+        latencies = []
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                with engine.connect() as connection:
+                    connection.execute(READ_QUERY, {"min_age": random.randint(18, 60)}).all()
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                with lock:
+                    counters["errors"] += 1
+        with lock:
+            read_latencies.extend(latencies)
+
+    def write(offset):
+        i = offset
+        while not stop.is_set():
+            try:
+                with engine.begin() as connection:
+                    connection.execute(INSERT_PATIENT, [make_patient(i)])
+                with lock:
+                    counters["writes"] += 1
+            except Exception:
+                with lock:
+                    counters["errors"] += 1
+            i += writers
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    threads += [threading.Thread(target=write, args=(INITIAL_PATIENTS + i,)) for i in range(writers)]
+
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    read_latencies.sort()
+
+    return {
+        "reads_per_second": len(read_latencies) / seconds,
+        "writes_per_second": counters["writes"] / seconds,
+        "p95_read_ms": read_latencies[int(len(read_latencies) * 0.95)] * 1000 if read_latencies else None,
+        "errors": counters["errors"]
+    }
+
+if __name__ == "__main__":
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    configurations = [
+        ("rollback journal (former engine)", sqlite_pragmas(journal_mode="DELETE", synchronous="FULL", mmap_size=0, cache_size=-2000)),
+        ("WAL + pragmas (create_db_engine)", None)
+    ]
+
+    print(f"{readers} readers, {writers} writers, {seconds:.0f}s")
+    print(f"{'engine':<34} {'reads/s':>9} {'writes/s':>9} {'p95 read':>10} {'errors':>7}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, pragmas in configurations:
+            engine = create_db_engine(f"sqlite:///{os.path.join(directory, f'bench_{len(name)}.db')}", pool_size=readers + writers, pragmas=pragmas)
+            Base.metadata.create_all(engine)
+            with engine.begin() as connection:
+                connection.execute(INSERT_PATIENT, [make_patient(i) for i in range(INITIAL_PATIENTS)])
+
+            stats = run(engine, readers, writers, seconds)
+            print(f"{name:<34} {stats['reads_per_second']:>9.0f} {stats['writes_per_second']:>9.0f} {stats['p95_read_ms']:>8.1f}ms {stats['errors']:>7}")
+
+            engine.dispose()
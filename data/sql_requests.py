@@ -21,11 +21,11 @@ CREATE TABLE user_role(
 
 CREATE TABLE patient(
    id_patient INTEGER PRIMARY KEY AUTOINCREMENT,
-   last_name TEXT NOT NULL,
-   first_name TEXT NOT NULL,
+   last_name BLOB NOT NULL,
+   first_name BLOB NOT NULL,
    age INTEGER NOT NULL,
    bmi REAL NOT NULL,
-   patient_email TEXT NOT NULL UNIQUE,
+   patient_email BLOB NOT NULL UNIQUE,
    children INTEGER NOT NULL,
    charges REAL NOT NULL,
    id_smoker INTEGER NOT NULL,
@@ -36,6 +36,22 @@ CREATE TABLE patient(
    FOREIGN KEY(id_region) REFERENCES region(id_region)
 );
 
+CREATE INDEX ix_patient_region_smoker_sex ON patient(id_region, id_smoker, id_sex);
+CREATE INDEX ix_patient_smoker_age ON patient(id_smoker, age);
+CREATE INDEX ix_patient_sex_age ON patient(id_sex, age);
+CREATE INDEX ix_patient_age_id ON patient(age, id_patient);
+CREATE INDEX ix_patient_bmi_id ON patient(bmi, id_patient);
+CREATE INDEX ix_patient_charges_id ON patient(charges, id_patient);
+
+CREATE TABLE patient_prediction(
+   id_patient INTEGER PRIMARY KEY,
+   predicted_charges REAL NOT NULL,
+   residual REAL,
+   model_version TEXT NOT NULL,
+   predicted_at REAL NOT NULL,
+   FOREIGN KEY(id_patient) REFERENCES patient(id_patient) ON DELETE CASCADE
+);
+
 CREATE TABLE app_user(
    id_user INTEGER PRIMARY KEY AUTOINCREMENT,
    username TEXT NOT NULL UNIQUE,
@@ -44,4 +60,67 @@ CREATE TABLE app_user(
    id_role INTEGER NOT NULL,
    FOREIGN KEY(id_role) REFERENCES user_role(id_role)
 );
+
+CREATE INDEX ix_app_user_id_role ON app_user(id_role);
 """
+
+# Replacements turning the SQLite definitions of CREATE_TABLE_QUERY into the other databases' ones
+DDL_DIALECT_REPLACEMENTS = {
+    "sqlite": [],
+    "postgresql": [
+        ("INTEGER PRIMARY KEY AUTOINCREMENT", "SERIAL PRIMARY KEY"),
+        ("BLOB", "BYTEA"),
+        ("REAL", "DOUBLE PRECISION")
+    ]
+}
+
+def get_create_table_query(dialect: str = "sqlite"):
+    """
+    Gets the tables creation query for a database
+
+    Parameters:
+        dialect: the name of the database's dialect ("sqlite" or "postgresql")
+
+    Return:
+        the tables creation query
+    """
+    if dialect not in DDL_DIALECT_REPLACEMENTS:
+        raise ValueError(f"Unsupported dialect: {dialect} (expected one of {list(DDL_DIALECT_REPLACEMENTS)})")
+
+    query = CREATE_TABLE_QUERY
+    for sqlite_definition, definition in DDL_DIALECT_REPLACEMENTS[dialect]:
+        query = query.replace(sqlite_definition, definition)
+
+    return query
+
+# Tables whose primary key is generated (SERIAL on PostgreSQL), with their primary key column
+SERIAL_PRIMARY_KEYS = [
+    ("region", "id_region"),
+    ("sex", "id_sex"),
+    ("smoker", "id_smoker"),
+    ("user_role", "id_role"),
+    ("patient", "id_patient"),
+    ("app_user", "id_user")
+]
+
+# Moves the sequence of a generated primary key past the ids already stored (inserted with explicit ids)
+RESET_SEQUENCE_QUERY = "SELECT setval(pg_get_serial_sequence('{table}', '{column}'), COALESCE(MAX({column}), 0) + 1, false) FROM {table};"
+
+def get_reset_sequences_query(dialect: str = "sqlite"):
+    """
+    Gets the query moving the primary key sequences past the stored ids, to run after seeding the tables
+    with explicit ids (SQLite's AUTOINCREMENT already follows the largest id)
+
+    Parameters:
+        dialect: the name of the database's dialect ("sqlite" or "postgresql")
+
+    Return:
+        the sequences reset query (empty when the database needs none)
+    """
+    if dialect not in DDL_DIALECT_REPLACEMENTS:
+        raise ValueError(f"Unsupported dialect: {dialect} (expected one of {list(DDL_DIALECT_REPLACEMENTS)})")
+
+    if dialect != "postgresql":
+        return ""
+
+    return "\n".join(RESET_SEQUENCE_QUERY.format(table=table, column=column) for table, column in SERIAL_PRIMARY_KEYS)
@@ -1,11 +1,60 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, Request
 from modules import routes, routes_user, routes_ai
+from modules.database import async_engine, async_replica_engines, record_client_write, replica_router
+from modules.inference import prediction_batcher, prediction_executor
+from modules.lookup_cache import lookup_cache
+from modules.model_registry import model_registry
+from modules.session_tokens import require_session
+import asyncio
 import logging
 
 logging.basicConfig(filename='medical_expenses_manager.log', level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Loads the resources shared across requests when the application starts,
+    and releases them when it stops
+    """
+    # Loading the prediction model once per worker
+    model_registry.load()
 
-app.include_router(routes_user.router, prefix="/users", tags=["Users"])
-app.include_router(routes.router, prefix="/patients", tags=["Patients"])
-app.include_router(routes_ai.router, prefix="/AI", tags=["AI"])
+    # Loading the lookup tables (regions, smoker statuses, sexes, roles)
+    lookup_cache.load()
+
+    # Starting the inference pool (each process preloads the model)
+    await asyncio.to_thread(prediction_executor.start)
+
+    yield
+
+    # Stopping the prediction micro-batcher and the inference pool
+    await prediction_batcher.stop()
+    await asyncio.to_thread(prediction_executor.shutdown)
+
+    # Closing the connections of the async database engines
+    await async_engine.dispose()
+    for replica_engine in async_replica_engines:
+        await replica_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def track_client_writes(request: Request, call_next):
+    """
+    Sends the time of their writes to the clients, so that their next reads skip the read replicas
+    while these may lag behind (see get_async_read_db); only the routes depending on mark_client_write
+    count as writes (not the logins nor the predictions)
+    """
+    response = await call_next(request)
+
+    if replica_router.replicas and replica_router.max_lag_seconds > 0 and getattr(request.state, "client_write", False) and response.status_code < 400:
+        record_client_write(response, replica_router.max_lag_seconds)
+
+    return response
+
+# The session routes come first (/users/me/ must not be taken for a user ID)
+app.include_router(routes_user.auth_router, prefix="/users", tags=["Users"])
+app.include_router(routes_user.router, prefix="/users", tags=["Users"], dependencies=[Depends(require_session)])
+app.include_router(routes.router, prefix="/patients", tags=["Patients"], dependencies=[Depends(require_session)])
+app.include_router(routes_ai.router, prefix="/AI", tags=["AI"], dependencies=[Depends(require_session)])
@@ -1,9 +1,13 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
-from sqlalchemy.orm import relationship, Session
+from sqlalchemy import Column, Integer, String, ForeignKey, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import relationship, Session, joinedload
 from pydantic import BaseModel
 from typing import Optional
 from models.base import Base
-from models.user_role import UserRole
+from models.user_role import UserRole  # noqa: F401 (registers the model for the relationship)
+from modules.lookup_cache import lookup_cache
+from modules.passwords import to_password_hash
+import asyncio
 import logging
 
 #####################
@@ -12,10 +16,10 @@ import logging
 class AppUser(Base):
     __tablename__ = 'app_user'
     id_user = Column(Integer, primary_key=True)
-    username = Column(String(50), nullable=False)
-    password = Column(String(50), nullable=False)
+    username = Column(String(50), nullable=False, unique=True, index=True)
+    password = Column(String(255), nullable=False)
     user_email = Column(String(50), nullable=False)
-    id_role = Column(Integer, ForeignKey("user_role.id_role"))
+    id_role = Column(Integer, ForeignKey("user_role.id_role"), index=True)
 
     user_role = relationship("UserRole", back_populates="app_user")
 
@@ -32,7 +36,7 @@ class AppUserCreate(AppUserBase):
 
 class AppUserUpdate(AppUserBase):
     username: Optional[str]
-    password: Optional[str]
+    password: Optional[str] = None
     user_email: Optional[str]
     user_role: Optional[int]
 
@@ -61,6 +65,20 @@ def get_app_users(db: Session):
     """
     return db.query(AppUser).all()
 
+async def get_app_users_async(db: AsyncSession):
+    """
+    Gets a list of all of the application users, with their role (async version of get_app_users)
+
+    Parameters:
+        - db: the async database session in which to work
+
+    Return:
+        a list of all of the app users
+    """
+    result = await db.execute(select(AppUser).options(joinedload(AppUser.user_role)))
+
+    return result.scalars().all()
+
 def get_app_user(db: Session, user_id: int):
     """
     Gets the data of the specified user
@@ -74,6 +92,51 @@ def get_app_user(db: Session, user_id: int):
     """
     return db.query(AppUser).filter(AppUser.id_user == user_id).first()
 
+async def get_app_user_async(db: AsyncSession, user_id: int):
+    """
+    Gets the data of the specified user (async version of get_app_user)
+
+    Parameters:
+        - db: the async database session in which to work
+        - user_id: the id of the user
+
+    Return:
+        the specified user's data (or None if there is no such user)
+    """
+    result = await db.execute(select(AppUser).where(AppUser.id_user == user_id))
+
+    return result.scalars().first()
+
+def get_app_user_by_username(db: Session, username: str):
+    """
+    Gets the data of a user from their username (a lookup on the unique username index)
+
+    Parameters:
+        - db: the database in which to work
+        - username: the username of the user
+    
+    Return:
+        the specified user's data (or None if there is no such user)
+    """
+    return db.query(AppUser).filter(AppUser.username == username).first()
+
+def _resolve_role(user_role):
+    """
+    Checks a role ID against the in-memory lookup tables (no query)
+
+    Parameters:
+        - user_role: the role ID
+
+    Return:
+        - the role ID as an integer
+    """
+    id_role = lookup_cache.resolve_id("roles", user_role)
+    if id_role is None:
+        logging.error("Invalid role ID")
+        raise Exception("Invalid role ID")
+
+    return id_role
+
 def create_app_user(db: Session, item: AppUserCreate):
     """
     Creates a new application user
@@ -87,21 +150,42 @@ def create_app_user(db: Session, item: AppUserCreate):
     """
     db_app_user = AppUser(
         username = item.username,
-        password = item.password,
+        password = to_password_hash(item.password),
         user_email = item.user_email
     )
 
-    # Fetch and assign relationship fields
+    # Validate and assign the foreign key (checked against the in-memory lookup tables, no query)
     if item.user_role is not None:
-        role = db.query(UserRole).filter(UserRole.id_role == int(item.user_role)).first()
-        if not role:
-            logging.error("Invalid role ID")
-            raise Exception("Invalid role ID")
-        db_app_user.user_role = role  # Assign related object
+        db_app_user.id_role = _resolve_role(item.user_role)
 
+    # A single INSERT (the new user is not read back)
     db.add(db_app_user)
     db.commit()
-    db.refresh(db_app_user)
+
+    return db_app_user
+
+async def create_app_user_async(db: AsyncSession, item: AppUserCreate):
+    """
+    Creates a new application user (async version of create_app_user; the password is hashed in a thread)
+
+    Parameters:
+        - db: the async database session in which to work
+        - item: the new user's data
+
+    Return:
+        - db_app_user: the new app user object
+    """
+    db_app_user = AppUser(
+        username = item.username,
+        password = await asyncio.to_thread(to_password_hash, item.password),
+        user_email = item.user_email
+    )
+
+    if item.user_role is not None:
+        db_app_user.id_role = _resolve_role(item.user_role)
+
+    db.add(db_app_user)
+    await db.commit()
 
     return db_app_user
 
@@ -125,16 +209,13 @@ def update_app_user(db: Session, user_id: int, app_user_data: AppUserCreate):
     try:
         # Update basic fields
         db_app_user.username = app_user_data.username
-        db_app_user.password = app_user_data.password
+        if app_user_data.password:
+            db_app_user.password = to_password_hash(app_user_data.password)
         db_app_user.user_email = app_user_data.user_email
 
-        # Fetch and assign relationship fields
+        # Validate and assign the foreign key (checked against the in-memory lookup tables, no query)
         if app_user_data.user_role is not None:
-            role = db.query(UserRole).filter(UserRole.id_role == int(app_user_data.user_role)).first()
-            if not role:
-                logging.error("Invalid role ID")
-                raise Exception("Invalid role ID")
-            db_app_user.user_role = role  # Assign related object
+            db_app_user.id_role = _resolve_role(app_user_data.user_role)
 
         db.commit()
         db.refresh(db_app_user)
@@ -144,6 +225,35 @@ def update_app_user(db: Session, user_id: int, app_user_data: AppUserCreate):
         logging.error(f"Invalid input data: {str(e)}")
         raise Exception(f"Invalid input data: {str(e)}")
 
+async def update_app_user_async(db: AsyncSession, user_id: int, app_user_data: AppUserUpdate):
+    """
+    Updates the information of an application user (async version of update_app_user)
+
+    Parameters:
+        - db: the async database session in which to work
+        - user_id: the user's id
+        - app_user_data: the new user's information
+
+    Return:
+        - db_app_user: the app user object
+    """
+    db_app_user = await get_app_user_async(db, user_id)
+    if not db_app_user:
+        logging.error("User not found")
+        raise Exception("User not found")
+
+    db_app_user.username = app_user_data.username
+    if app_user_data.password:
+        db_app_user.password = await asyncio.to_thread(to_password_hash, app_user_data.password)
+    db_app_user.user_email = app_user_data.user_email
+
+    if app_user_data.user_role is not None:
+        db_app_user.id_role = _resolve_role(app_user_data.user_role)
+
+    await db.commit()
+
+    return db_app_user
+
 def delete_app_user(db: Session, user_id: int):
     """
     Deletes an application user
@@ -165,3 +275,25 @@ def delete_app_user(db: Session, user_id: int):
     db.commit()
     
     return db_app_user
+
+async def delete_app_user_async(db: AsyncSession, user_id: int):
+    """
+    Deletes an application user (async version of delete_app_user)
+
+    Parameters:
+        - db: the async database session in which to work
+        - user_id: the user's id
+
+    Return:
+        - db_app_user: the app user object
+    """
+    db_app_user = await get_app_user_async(db, user_id)
+
+    if not db_app_user:
+        logging.error("User not found")
+        raise Exception("User not found")
+
+    await db.delete(db_app_user)
+    await db.commit()
+
+    return db_app_user
@@ -1,11 +1,18 @@
-from sqlalchemy import Column, Integer, String, Numeric, ForeignKey
-from sqlalchemy.orm import relationship, Session
+from sqlalchemy import Column, Float, Index, Integer, Numeric, ForeignKey, and_, or_, delete, select, type_coerce, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import relationship, Session, Query
 from pydantic import BaseModel
-from typing import Optional
-from models.region import Region
-from models.smoker import Smoker
-from models.sex import Sex
+from typing import Literal, Optional
+import base64
+import json
+import math
+from models.region import Region  # noqa: F401 (registers the model for the relationship)
+from models.smoker import Smoker  # noqa: F401 (registers the model for the relationship)
+from models.sex import Sex  # noqa: F401 (registers the model for the relationship)
 from models.base import Base
+from models.patient_prediction import PatientPrediction
+from modules.encryption import EncryptedToken
+from modules.lookup_cache import lookup_cache
 import logging
 
 #####################
@@ -14,11 +21,11 @@ import logging
 class Patient(Base):
     __tablename__ = 'patient'
     id_patient = Column(Integer, primary_key=True, autoincrement=True)
-    last_name = Column(String(150), nullable=False)
-    first_name = Column(String(150), nullable=False)
+    last_name = Column(EncryptedToken, nullable=False)
+    first_name = Column(EncryptedToken, nullable=False)
     age = Column(Integer, nullable=False)
     bmi = Column(Numeric(6, 3))
-    patient_email = Column(String(150), nullable=False)
+    patient_email = Column(EncryptedToken, nullable=False)
     children = Column(Integer, nullable=False)
     charges = Column(Numeric(15, 5))
     id_region = Column(Integer, ForeignKey("region.id_region"))
@@ -29,6 +36,17 @@ class Patient(Base):
     smoker = relationship("Smoker", back_populates="patient")
     sex = relationship("Sex", back_populates="patient")
 
+    # Indexes of the patient list's filters and sort orders (the sort indexes end with
+    # id_patient, the tie-breaker of the keyset pagination)
+    __table_args__ = (
+        Index("ix_patient_region_smoker_sex", "id_region", "id_smoker", "id_sex"),
+        Index("ix_patient_smoker_age", "id_smoker", "age"),
+        Index("ix_patient_sex_age", "id_sex", "age"),
+        Index("ix_patient_age_id", "age", "id_patient"),
+        Index("ix_patient_bmi_id", "bmi", "id_patient"),
+        Index("ix_patient_charges_id", "charges", "id_patient")
+    )
+
 #####################
 # Pydantic schemas
 #####################
@@ -79,6 +97,45 @@ class PatientResponseAI(PatientBaseAI):
     class Config:
         orm_mode = True
 
+class PatientFilter(BaseModel):
+    min_age: Optional[int] = None
+    max_age: Optional[int] = None
+    min_bmi: Optional[float] = None
+    max_bmi: Optional[float] = None
+    min_charges: Optional[float] = None
+    max_charges: Optional[float] = None
+    region: Optional[int] = None
+    smoker: Optional[int] = None
+    sex: Optional[int] = None
+
+class PatientSelection(BaseModel):
+    ids: Optional[list[int]] = None
+    filters: Optional[PatientFilter] = None
+
+class PatientBulkValues(BaseModel):
+    last_name: Optional[str] = None
+    first_name: Optional[str] = None
+    age: Optional[int] = None
+    bmi: Optional[float] = None
+    patient_email: Optional[str] = None
+    children: Optional[int] = None
+    charges: Optional[float] = None
+    region: Optional[int] = None
+    smoker: Optional[int] = None
+    sex: Optional[int] = None
+
+class PatientBulkUpdate(PatientSelection):
+    values: PatientBulkValues
+
+# Columns the patients can be sorted by
+PatientSortColumn = Literal["id_patient", "age", "bmi", "charges"]
+
+# Maximum number of IDs per statement of the bulk updates and deletes (below SQLite's limit of bound parameters)
+BULK_ID_CHUNK_SIZE = 10000
+
+# Foreign keys of the patients, with their lookup table
+PATIENT_LOOKUP_COLUMNS = {"region": ("regions", "id_region"), "smoker": ("smokers", "id_smoker"), "sex": ("sexes", "id_sex")}
+
 #################
 # CRUD methods
 #################
@@ -94,6 +151,135 @@ def get_patients(db: Session):
     """
     return db.query(Patient).all()
 
+def filter_patients(query: Query, filters: PatientFilter):
+    """
+    Applies filters to a query on the patients
+
+    Parameters:
+        - query: the query on the patients
+        - filters: the filters to apply (the None ones are ignored)
+
+    Return:
+        the filtered query
+    """
+    conditions = []
+
+    if filters.min_age is not None:
+        conditions.append(Patient.age >= filters.min_age)
+    if filters.max_age is not None:
+        conditions.append(Patient.age <= filters.max_age)
+    if filters.min_bmi is not None:
+        conditions.append(Patient.bmi >= filters.min_bmi)
+    if filters.max_bmi is not None:
+        conditions.append(Patient.bmi <= filters.max_bmi)
+    if filters.min_charges is not None:
+        conditions.append(Patient.charges >= filters.min_charges)
+    if filters.max_charges is not None:
+        conditions.append(Patient.charges <= filters.max_charges)
+    if filters.region is not None:
+        conditions.append(Patient.id_region == filters.region)
+    if filters.smoker is not None:
+        conditions.append(Patient.id_smoker == filters.smoker)
+    if filters.sex is not None:
+        conditions.append(Patient.id_sex == filters.sex)
+
+    return query.filter(*conditions) if conditions else query
+
+# Label of the stored sort value selected with each patient of a page (the cursors are built from it)
+CURSOR_VALUE_LABEL = "cursor_value"
+
+def _sort_column(sort_by: str):
+    """
+    Gets the column the patients are sorted by, as stored (the Numeric columns are read as the stored
+    floats, not rounded to their scale, so that a cursor compares equal to its own row)
+
+    Parameters:
+        - sort_by: the column the patients are sorted by
+
+    Return:
+        the column expression
+    """
+    sort_column = getattr(Patient, sort_by)
+
+    return type_coerce(sort_column, Float) if isinstance(sort_column.type, Numeric) else sort_column
+
+def encode_patient_cursor(patient, sort_by: str):
+    """
+    Builds the cursor pointing right after a patient (the patient's stored sort value and id)
+
+    Parameters:
+        - patient: the last row of a page (from a query paginated by paginate_patients)
+        - sort_by: the column the patients are sorted by
+
+    Return:
+        the opaque cursor
+    """
+    value = patient.id_patient if sort_by == "id_patient" else getattr(patient, CURSOR_VALUE_LABEL)
+
+    return base64.urlsafe_b64encode(json.dumps([value, patient.id_patient]).encode()).decode()
+
+def _is_number(value):
+    """
+    Tells whether a decoded cursor value is a finite number
+    """
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def decode_patient_cursor(cursor: str):
+    """
+    Decodes a cursor built by encode_patient_cursor
+
+    Parameters:
+        - cursor: the opaque cursor
+
+    Return:
+        the sort value and the id of the last patient of the previous page
+    """
+    try:
+        value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+    if not _is_number(value) or not _is_number(last_id) or not isinstance(last_id, int):
+        raise ValueError("Invalid cursor")
+
+    return value, last_id
+
+def paginate_patients(query: Query, sort_by: str = "id_patient", order: str = "asc", cursor: Optional[str] = None, limit: int = 100):
+    """
+    Sorts a query on the patients and keeps one page of it (keyset pagination on the sort column and id_patient);
+    unless sorted by id_patient, the stored sort value is selected too, as CURSOR_VALUE_LABEL
+
+    Parameters:
+        - query: the query on the patients
+        - sort_by: the column the patients are sorted by
+        - order: "asc" or "desc"
+        - cursor: the cursor returned with the previous page (None for the first page)
+        - limit: the maximum number of patients of the page
+
+    Return:
+        the paginated query
+    """
+    sort_column = _sort_column(sort_by)
+    descending = order == "desc"
+
+    if cursor:
+        value, last_id = decode_patient_cursor(cursor)
+
+        if sort_by == "id_patient":
+            query = query.filter(Patient.id_patient < last_id if descending else Patient.id_patient > last_id)
+        elif descending:
+            query = query.filter(or_(sort_column < value, and_(sort_column == value, Patient.id_patient < last_id)))
+        else:
+            query = query.filter(or_(sort_column > value, and_(sort_column == value, Patient.id_patient > last_id)))
+
+    if sort_by == "id_patient":
+        order_by = [Patient.id_patient.desc() if descending else Patient.id_patient.asc()]
+    else:
+        query = query.add_columns(sort_column.label(CURSOR_VALUE_LABEL))
+        order_by = [sort_column.desc(), Patient.id_patient.desc()] if descending else [sort_column.asc(), Patient.id_patient.asc()]
+
+    return query.order_by(*order_by).limit(limit)
+
 def get_patient(db: Session, patient_id: int):
     """
     Gets the data of the specified patient
@@ -107,16 +293,30 @@ def get_patient(db: Session, patient_id: int):
     """
     return db.query(Patient).filter(Patient.id_patient == patient_id).first()
 
-def create_patient(db: Session, item: PatientCreate):
+async def get_patient_async(db: AsyncSession, patient_id: int):
     """
-    Creates a new patient
+    Gets the data of the specified patient (async version of get_patient)
+
+    Parameters:
+        - db: the async database session in which to work
+        - patient_id: the id of the patient
+
+    Return:
+        the specified patient's data (or None if there is no such patient)
+    """
+    result = await db.execute(select(Patient).where(Patient.id_patient == patient_id))
+
+    return result.scalars().first()
+
+def _new_patient(item: PatientCreate):
+    """
+    Builds a new patient object, checking its region, smoker and sex IDs
 
     Parameters:
-        - db: the database in which to work
         - item: the new patient's data
 
     Return:
-        - db_patient: the new patient object
+        - db_patient: the new patient object (not added to a session yet)
     """
     db_patient = Patient(
         last_name = item.last_name,
@@ -128,32 +328,47 @@ def create_patient(db: Session, item: PatientCreate):
         charges = float(item.charges)
     )
 
-    # Fetch and assign relationship fields
+    # Validate and assign the foreign keys (checked against the in-memory lookup tables, no query)
     if item.region is not None:
-        region = db.query(Region).filter(Region.id_region == item.region).first()
-        if not region:
+        id_region = lookup_cache.resolve_id("regions", item.region)
+        if id_region is None:
             logging.error("Invalid region ID")
             raise Exception("Invalid region ID")
-        db_patient.region = region  # Assign related object
+        db_patient.id_region = id_region
 
     if item.smoker is not None:
-        smoker = db.query(Smoker).filter(Smoker.id_smoker == item.smoker).first()
-        if not smoker:
+        id_smoker = lookup_cache.resolve_id("smokers", item.smoker)
+        if id_smoker is None:
             logging.error("Invalid smoker ID")
             raise Exception("Invalid smoker ID")
-        db_patient.smoker = smoker  # Assign related object
+        db_patient.id_smoker = id_smoker
 
     if item.sex is not None:
-        sex = db.query(Sex).filter(Sex.id_sex == item.sex).first()
-        if not sex:
+        id_sex = lookup_cache.resolve_id("sexes", item.sex)
+        if id_sex is None:
             logging.error("Invalid sex ID")
             raise Exception("Invalid sex ID")
-        db_patient.sex = sex  # Assign related object
+        db_patient.id_sex = id_sex
+
+    return db_patient
+
+def create_patient(db: Session, item: PatientCreate):
+    """
+    Creates a new patient
+
+    Parameters:
+        - db: the database in which to work
+        - item: the new patient's data
 
+    Return:
+        - db_patient: the new patient object
+    """
+    db_patient = _new_patient(item)
+
+    # A single INSERT (the new patient is not read back)
     try:
         db.add(db_patient)
         db.commit()
-        db.refresh(db_patient)
 
     except Exception as e:
         logging.error("Error adding and committing")
@@ -161,9 +376,261 @@ def create_patient(db: Session, item: PatientCreate):
     
     return db_patient
 
+async def create_patient_async(db: AsyncSession, item: PatientCreate):
+    """
+    Creates a new patient (async version of create_patient)
+
+    Parameters:
+        - db: the async database session in which to work
+        - item: the new patient's data
+
+    Return:
+        - db_patient: the new patient object
+    """
+    db_patient = _new_patient(item)
+
+    # A single INSERT (the new patient is not read back)
+    try:
+        db.add(db_patient)
+        await db.commit()
+
+    except Exception as e:
+        logging.error(f"Error adding and committing: {str(e)}")
+        await db.rollback()
+        raise
+
+    return db_patient
+
+def _patient_values(values: dict):
+    """
+    Converts patient data into the values of the patient table columns, checking the region, smoker
+    and sex IDs against the in-memory lookup tables (no query)
+
+    Parameters:
+        - values: the patient's data (the region, smoker and sex as IDs)
+
+    Return:
+        - the column values
+    """
+    column_values = {}
+
+    for field, value in values.items():
+        if field in PATIENT_LOOKUP_COLUMNS:
+            name, id_column = PATIENT_LOOKUP_COLUMNS[field]
+            lookup_id = lookup_cache.resolve_id(name, value)
+            if lookup_id is None:
+                logging.error(f"Invalid {field} ID")
+                raise ValueError(f"Invalid {field} ID")
+            column_values[id_column] = lookup_id
+        else:
+            column_values[field] = value
+
+    return column_values
+
+def _selection_conditions(selection: PatientSelection):
+    """
+    Builds the WHERE clauses selecting patients by IDs and/or filters (one clause per chunk of IDs)
+
+    Parameters:
+        - selection: the IDs and/or the filters of the patients
+
+    Return:
+        - the list of WHERE clauses
+    """
+    ids = sorted(set(selection.ids or []))
+    has_filters = selection.filters is not None and any(value is not None for value in selection.filters.model_dump().values())
+
+    if not ids and not has_filters:
+        logging.error("No patient selected")
+        raise ValueError("No patient selected (expected IDs and/or filters)")
+
+    filters = selection.filters or PatientFilter()
+
+    if not ids:
+        return [filter_patients(select(Patient.id_patient), filters).whereclause]
+
+    return [
+        filter_patients(select(Patient.id_patient).where(Patient.id_patient.in_(ids[i:i + BULK_ID_CHUNK_SIZE])), filters).whereclause
+        for i in range(0, len(ids), BULK_ID_CHUNK_SIZE)
+    ]
+
+def _update_statements(selection: PatientSelection, values: PatientBulkValues):
+    """
+    Builds the UPDATE statements of a bulk update (one per chunk of IDs)
+
+    Parameters:
+        - selection: the IDs and/or the filters of the patients
+        - values: the new values (the None ones are left unchanged)
+
+    Return:
+        - the list of UPDATE statements
+    """
+    column_values = _patient_values(values.model_dump(exclude_none=True))
+    if not column_values:
+        logging.error("No value to update")
+        raise ValueError("No value to update")
+
+    return [
+        update(Patient).where(condition).values(column_values).execution_options(synchronize_session=False)
+        for condition in _selection_conditions(selection)
+    ]
+
+def _delete_statements(selection: PatientSelection):
+    """
+    Builds the DELETE statements of a bulk deletion (the predictions, then the patients, per chunk of IDs)
+
+    Parameters:
+        - selection: the IDs and/or the filters of the patients
+
+    Return:
+        - the list of (predictions DELETE, patients DELETE) statements
+    """
+    return [
+        (
+            delete(PatientPrediction)
+            .where(PatientPrediction.id_patient.in_(select(Patient.id_patient).where(condition)))
+            .execution_options(synchronize_session=False),
+            delete(Patient).where(condition).execution_options(synchronize_session=False)
+        )
+        for condition in _selection_conditions(selection)
+    ]
+
+def update_patients(db: Session, selection: PatientSelection, values: PatientBulkValues):
+    """
+    Updates the selected patients with set-based UPDATE statements (one per chunk of IDs), in a single transaction
+
+    Parameters:
+        - db: the database in which to work
+        - selection: the IDs and/or the filters of the patients
+        - values: the new values (the None ones are left unchanged)
+
+    Return:
+        - the number of updated patients
+    """
+    statements = _update_statements(selection, values)
+
+    try:
+        updated_rows = sum(db.execute(statement).rowcount for statement in statements)
+        db.commit()
+    except Exception as e:
+        logging.error(f"Error updating patients: {str(e)}")
+        db.rollback()
+        raise
+
+    return updated_rows
+
+async def update_patients_async(db: AsyncSession, selection: PatientSelection, values: PatientBulkValues):
+    """
+    Updates the selected patients (async version of update_patients)
+
+    Parameters:
+        - db: the async database session in which to work
+        - selection: the IDs and/or the filters of the patients
+        - values: the new values (the None ones are left unchanged)
+
+    Return:
+        - the number of updated patients
+    """
+    statements = _update_statements(selection, values)
+
+    try:
+        updated_rows = 0
+        for statement in statements:
+            updated_rows += (await db.execute(statement)).rowcount
+        await db.commit()
+    except Exception as e:
+        logging.error(f"Error updating patients: {str(e)}")
+        await db.rollback()
+        raise
+
+    return updated_rows
+
+def delete_patients(db: Session, selection: PatientSelection):
+    """
+    Deletes the selected patients (and their predictions) with set-based DELETE statements
+    (one per chunk of IDs), in a single transaction
+
+    Parameters:
+        - db: the database in which to work
+        - selection: the IDs and/or the filters of the patients
+
+    Return:
+        - the number of deleted patients
+    """
+    statements = _delete_statements(selection)
+
+    try:
+        deleted_rows = 0
+        for predictions_statement, patients_statement in statements:
+            db.execute(predictions_statement)
+            deleted_rows += db.execute(patients_statement).rowcount
+        db.commit()
+    except Exception as e:
+        logging.error(f"Error deleting patients: {str(e)}")
+        db.rollback()
+        raise
+
+    return deleted_rows
+
+async def delete_patients_async(db: AsyncSession, selection: PatientSelection):
+    """
+    Deletes the selected patients and their predictions (async version of delete_patients)
+
+    Parameters:
+        - db: the async database session in which to work
+        - selection: the IDs and/or the filters of the patients
+
+    Return:
+        - the number of deleted patients
+    """
+    statements = _delete_statements(selection)
+
+    try:
+        deleted_rows = 0
+        for predictions_statement, patients_statement in statements:
+            await db.execute(predictions_statement)
+            deleted_rows += (await db.execute(patients_statement)).rowcount
+        await db.commit()
+    except Exception as e:
+        logging.error(f"Error deleting patients: {str(e)}")
+        await db.rollback()
+        raise
+
+    return deleted_rows
+
+def _update_values(patient_data: PatientUpdate):
+    """
+    Gets the new values of an updated patient (the region, smoker and sex are only changed when given)
+
+    Parameters:
+        - patient_data: the new patient's information
+
+    Return:
+        - the new values
+    """
+    try:
+        values = {
+            "last_name": patient_data.last_name,
+            "first_name": patient_data.first_name,
+            "age": int(patient_data.age),
+            "bmi": float(patient_data.bmi),
+            "patient_email": patient_data.patient_email,
+            "children": int(patient_data.children),
+            "charges": float(patient_data.charges)
+        }
+    except (TypeError, ValueError) as e:
+        logging.error(f"Invalid input data: {str(e)}")
+        raise ValueError(f"Invalid input data: {str(e)}")
+
+    for field in PATIENT_LOOKUP_COLUMNS:
+        if getattr(patient_data, field) is not None:
+            values[field] = getattr(patient_data, field)
+
+    return PatientBulkValues(**values)
+
 def update_patient(db: Session, patient_id: int, patient_data: PatientUpdate):
     """
-    Updates the information of a patient
+    Updates the information of a patient (a single UPDATE, the patient is not read beforehand)
 
     Parameters:
         - db: the database in which to work
@@ -171,72 +638,62 @@ def update_patient(db: Session, patient_id: int, patient_data: PatientUpdate):
         - patient_data: the new patient's information
 
     Return:
-        - db_patient: the patient object
+        - the number of updated patients (0 if the patient does not exist)
     """
-    db_patient = db.query(Patient).filter(Patient.id_patient == patient_id).first()
-    if not db_patient:
+    updated_rows = update_patients(db, PatientSelection(ids=[patient_id]), _update_values(patient_data))
+    if not updated_rows:
         logging.error("Patient not found")
-        raise Exception("Patient not found")
-    
-    try:
-        # Update basic fields
-        db_patient.last_name = patient_data.last_name
-        db_patient.first_name = patient_data.first_name
-        db_patient.age = int(patient_data.age)
-        db_patient.bmi = float(patient_data.bmi)
-        db_patient.patient_email = patient_data.patient_email
-        db_patient.children = int(patient_data.children)
-        db_patient.charges = float(patient_data.charges)
-
-        # Fetch and assign relationship fields
-        if patient_data.region is not None:
-            region = db.query(Region).filter(Region.id_region == int(patient_data.region)).first()
-            if not region:
-                logging.error("Invalid region ID")
-                raise Exception("Invalid region ID")
-            db_patient.region = region  # Assign related object
-
-        if patient_data.smoker is not None:
-            smoker = db.query(Smoker).filter(Smoker.id_smoker == int(patient_data.smoker)).first()
-            if not smoker:
-                logging.error("Invalid smoker ID")
-                raise Exception("Invalid smoker ID")
-            db_patient.smoker = smoker  # Assign related object
-
-        if patient_data.sex is not None:
-            sex = db.query(Sex).filter(Sex.id_sex == int(patient_data.sex)).first()
-            if not sex:
-                logging.error("Invalid sex ID")
-                raise Exception("Invalid sex ID")
-            db_patient.sex = sex  # Assign related object
-
-        # Commit the transaction
-        db.commit()
-        db.refresh(db_patient)
 
-        return db_patient
-    except ValueError as e:
-        logging.error(f"Invalid input data: {str(e)}")
-        raise Exception(f"Invalid input data: {str(e)}")
+    return updated_rows
+
+async def update_patient_async(db: AsyncSession, patient_id: int, patient_data: PatientUpdate):
+    """
+    Updates the information of a patient (async version of update_patient)
+
+    Parameters:
+        - db: the async database session in which to work
+        - patient_id: the patient's id
+        - patient_data: the new patient's information
+
+    Return:
+        - the number of updated patients (0 if the patient does not exist)
+    """
+    updated_rows = await update_patients_async(db, PatientSelection(ids=[patient_id]), _update_values(patient_data))
+    if not updated_rows:
+        logging.error("Patient not found")
+
+    return updated_rows
 
 def delete_patient(db: Session, patient_id: int):
     """
-    Deletes a patient from the database
+    Deletes a patient from the database (a single DELETE, the patient is not read beforehand)
 
     Parameters:
         - db: the database in which to work
         - patient_id: the patient's id
     
     Return:
-        - db_patient: the patient object
+        - the number of deleted patients (0 if the patient does not exist)
     """
-    db_patient = db.query(Patient).filter(Patient.id_patient == patient_id).first()
+    deleted_rows = delete_patients(db, PatientSelection(ids=[patient_id]))
+    if not deleted_rows:
+        logging.error("Patient not found")
 
-    if db_patient:
-        db.delete(db_patient)
-        db.commit()
-    else:
+    return deleted_rows
+
+async def delete_patient_async(db: AsyncSession, patient_id: int):
+    """
+    Deletes a patient from the database (async version of delete_patient)
+
+    Parameters:
+        - db: the async database session in which to work
+        - patient_id: the patient's id
+
+    Return:
+        - the number of deleted patients (0 if the patient does not exist)
+    """
+    deleted_rows = await delete_patients_async(db, PatientSelection(ids=[patient_id]))
+    if not deleted_rows:
         logging.error("Patient not found")
-        raise Exception("Patient not found")
-    
-    return db_patient
+
+    return deleted_rows
@@ -0,0 +1,45 @@
+from sqlalchemy import Column, Integer, String, Numeric, Float, ForeignKey
+from sqlalchemy.orm import Session
+from pydantic import BaseModel
+from typing import Optional
+from models.base import Base
+
+#####################
+# The Object class
+#####################
+class PatientPrediction(Base):
+    __tablename__ = 'patient_prediction'
+    id_patient = Column(Integer, ForeignKey("patient.id_patient", ondelete="CASCADE"), primary_key=True)
+    predicted_charges = Column(Numeric(15, 5), nullable=False)
+    residual = Column(Numeric(15, 5))
+    model_version = Column(String(64), nullable=False)
+    predicted_at = Column(Float, nullable=False)
+
+#####################
+# Pydantic schemas
+#####################
+class PatientPredictionResponse(BaseModel):
+    id_patient: int
+    predicted_charges: float
+    residual: Optional[float] = None
+    model_version: str
+    predicted_at: float
+
+    class Config:
+        orm_mode = True
+
+############
+# Getters
+############
+def get_patient_prediction(db: Session, patient_id: int):
+    """
+    Gets the last stored prediction of the specified patient
+
+    Parameters:
+        - db: the database in which to work
+        - patient_id: the id of the patient
+
+    Return:
+        the specified patient's prediction
+    """
+    return db.query(PatientPrediction).filter(PatientPrediction.id_patient == patient_id).first()
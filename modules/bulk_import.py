@@ -0,0 +1,318 @@
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from pydantic import ValidationError
+from models.patient import Patient, PatientCreate
+from modules.encryption import encrypt_values, raw_token_param
+from modules.lookup_cache import LOOKUP_TABLES, lookup_cache
+import argparse
+import codecs
+import csv
+import json
+import logging
+import os
+import time
+
+# Number of patients inserted (and committed) per chunk
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+
+# Maximum number of row errors returned in the import report (the failed rows are all counted)
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+# Accepted formats of the imported files
+IMPORT_FORMATS = ("json", "ndjson", "csv")
+
+# Encrypted columns of the patients (encrypted in one batch per chunk)
+ENCRYPTED_FIELDS = ["last_name", "first_name", "patient_email"]
+
+# Fields optional in PatientCreate but required by the patient table
+REQUIRED_FIELDS = ["charges", "region", "smoker", "sex"]
+
+# Foreign keys of the patients, with their lookup table
+LOOKUP_FIELDS = {"region": ("regions", "id_region"), "smoker": ("smokers", "id_smoker"), "sex": ("sexes", "id_sex")}
+
+def iter_json_rows(file):
+    """
+    Reads the patients of a JSON array
+
+    Parameters:
+        - file: the binary file holding the array
+
+    Return:
+        - a generator of (row number, row, error) tuples
+    """
+    try:
+        rows = json.load(codecs.getreader("utf-8-sig")(file))
+    except ValueError as e:
+        raise ValueError(f"Invalid JSON file: {str(e)}")
+
+    if not isinstance(rows, list):
+        raise ValueError("Invalid JSON file: expected an array of patients")
+
+    for row_number, row in enumerate(rows, start=1):
+        if isinstance(row, dict):
+            yield row_number, row, None
+        else:
+            yield row_number, None, "expected a JSON object"
+
+def iter_ndjson_rows(file):
+    """
+    Reads the patients of an NDJSON stream (one JSON object per line, the blank lines being skipped)
+
+    Parameters:
+        - file: the binary file holding the stream
+
+    Return:
+        - a generator of (row number, row, error) tuples (the row number is the line number)
+    """
+    for row_number, line in enumerate(codecs.getreader("utf-8-sig")(file), start=1):
+        if not line.strip():
+            continue
+
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield row_number, None, f"invalid JSON: {str(e)}"
+            continue
+
+        if isinstance(row, dict):
+            yield row_number, row, None
+        else:
+            yield row_number, None, "expected a JSON object"
+
+def iter_csv_rows(file):
+    """
+    Reads the patients of a CSV file (with a header line, empty cells being read as missing values)
+
+    Parameters:
+        - file: the binary file holding the CSV data
+
+    Return:
+        - a generator of (row number, row, error) tuples (the row number does not count the header)
+    """
+    reader = csv.DictReader(codecs.getreader("utf-8-sig")(file))
+
+    try:
+        for row_number, row in enumerate(reader, start=1):
+            if None in row:
+                yield row_number, None, "too many values"
+                continue
+
+            yield row_number, {column: (value if value != "" else None) for column, value in row.items()}, None
+    except csv.Error as e:
+        raise ValueError(f"Invalid CSV file (line {reader.line_num}): {str(e)}")
+
+# Row readers by format
+ROW_READERS = {"json": iter_json_rows, "ndjson": iter_ndjson_rows, "csv": iter_csv_rows}
+
+def _lookup_ids():
+    """
+    Builds the maps of the accepted region, smoker and sex values (their IDs and their labels)
+    from the in-memory lookup tables
+
+    Return:
+        - a dictionary of {value: ID} maps, by patient field
+    """
+    lookup_ids = {}
+
+    for field, (name, _) in LOOKUP_FIELDS.items():
+        id_column, label_column = LOOKUP_TABLES[name][2]
+        rows, _ = lookup_cache.get(name)
+
+        lookup_ids[field] = {}
+        for row in rows:
+            lookup_ids[field][str(row[id_column])] = row[id_column]
+            lookup_ids[field][str(row[label_column]).lower()] = row[id_column]
+
+    return lookup_ids
+
+def _validate_row(row: dict, lookup_ids: dict):
+    """
+    Validates an imported patient and converts it into the values of the new patient table row
+
+    Parameters:
+        - row: the imported patient's data
+        - lookup_ids: the maps of the accepted region, smoker and sex values (see _lookup_ids)
+
+    Return:
+        - the values of the new row (the personal data not encrypted yet)
+    """
+    try:
+        item = PatientCreate(**{key: (str(value) if key in LOOKUP_FIELDS and value is not None else value) for key, value in row.items()})
+    except ValidationError as e:
+        raise ValueError("; ".join(f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}" for error in e.errors()))
+
+    missing_fields = [field for field in REQUIRED_FIELDS if getattr(item, field) is None]
+    if missing_fields:
+        raise ValueError("; ".join(f"{field}: Field required" for field in missing_fields))
+
+    record = {
+        "last_name": item.last_name,
+        "first_name": item.first_name,
+        "age": item.age,
+        "bmi": item.bmi,
+        "patient_email": item.patient_email,
+        "children": item.children,
+        "charges": item.charges
+    }
+
+    for field, (_, id_column) in LOOKUP_FIELDS.items():
+        value = getattr(item, field)
+        lookup_id = lookup_ids[field].get(value.strip().lower())
+        if lookup_id is None:
+            raise ValueError(f"{field}: invalid value {value!r}")
+        record[id_column] = lookup_id
+
+    return record
+
+def _insert_chunk(db: Session, chunk: list, report):
+    """
+    Encrypts and inserts a chunk of validated patients in a single transaction (an executemany INSERT);
+    if it fails, the chunk's patients are inserted one by one to find the failing ones
+
+    Parameters:
+        - db: the database in which to work
+        - chunk: the list of (row number, values) tuples
+        - report: the function recording a row error (row number, message)
+
+    Return:
+        - the number of inserted patients
+    """
+    records = [record for _, record in chunk]
+
+    # Encrypting the personal data of the whole chunk in one batch
+    tokens = encrypt_values(record[field] for record in records for field in ENCRYPTED_FIELDS)
+    for i, record in enumerate(records):
+        for j, field in enumerate(ENCRYPTED_FIELDS):
+            record[field] = tokens[i * len(ENCRYPTED_FIELDS) + j]
+
+    # The tokens are written as they are (the encrypted columns would encrypt them again)
+    statement = insert(Patient.__table__).values({field: raw_token_param(field) for field in ENCRYPTED_FIELDS})
+
+    try:
+        db.execute(statement, records)
+        db.commit()
+
+        return len(records)
+    except Exception as e:
+        logging.error(f"Error inserting a chunk of patients, retrying them one by one: {str(e)}")
+        db.rollback()
+
+    inserted_rows = 0
+    for row_number, record in chunk:
+        try:
+            db.execute(statement, [record])
+            db.commit()
+            inserted_rows += 1
+        except Exception as e:
+            db.rollback()
+            report(row_number, str(e.orig) if hasattr(e, "orig") else str(e))
+
+    return inserted_rows
+
+def import_patients(db: Session, rows, chunk_size: int = IMPORT_CHUNK_SIZE, max_errors: int = IMPORT_MAX_ERRORS):
+    """
+    Imports patients chunk by chunk: each row is validated, the personal data of a chunk is encrypted
+    in one batch and the chunk is inserted with one executemany INSERT and committed; the invalid rows
+    are reported without aborting the import
+
+    Parameters:
+        - db: the database in which to work
+        - rows: the imported rows, as (row number, row, error) tuples (see ROW_READERS)
+        - chunk_size: the number of patients inserted (and committed) at a time
+        - max_errors: the maximum number of row errors kept in the report
+
+    Return:
+        - a dictionary of statistics about the import, with the row errors
+    """
+    start = time.perf_counter()
+    lookup_ids = _lookup_ids()
+    received_rows = 0
+    imported_rows = 0
+    failed_rows = 0
+    chunks = 0
+    errors = []
+    chunk = []
+
+    def report(row_number, message):
+        nonlocal failed_rows
+        failed_rows += 1
+        if len(errors) < max_errors:
+            errors.append({"row": row_number, "error": message})
+
+    for row_number, row, error in rows:
+        received_rows += 1
+
+        if error is None:
+            try:
+                chunk.append((row_number, _validate_row(row, lookup_ids)))
+            except ValueError as e:
+                error = str(e)
+
+        if error is not None:
+            report(row_number, error)
+
+        if len(chunk) >= chunk_size:
+            imported_rows += _insert_chunk(db, chunk, report)
+            chunks += 1
+            chunk = []
+
+    if chunk:
+        imported_rows += _insert_chunk(db, chunk, report)
+        chunks += 1
+
+    duration = time.perf_counter() - start
+
+    stats = {
+        "received_rows": received_rows,
+        "imported_rows": imported_rows,
+        "failed_rows": failed_rows,
+        "chunks": chunks,
+        "duration_seconds": duration,
+        "rows_per_second": imported_rows / duration if duration > 0 else None,
+        "errors": errors
+    }
+
+    logging.info(f"Patient import done: {({key: value for key, value in stats.items() if key != 'errors'})}")
+
+    return stats
+
+def import_patient_file(db: Session, file, import_format: str, chunk_size: int = IMPORT_CHUNK_SIZE):
+    """
+    Imports the patients of a JSON array, NDJSON or CSV file
+
+    Parameters:
+        - db: the database in which to work
+        - file: the binary file
+        - import_format: "json", "ndjson" or "csv"
+        - chunk_size: the number of patients inserted (and committed) at a time
+
+    Return:
+        - a dictionary of statistics about the import, with the row errors
+    """
+    if import_format not in ROW_READERS:
+        raise ValueError(f"Invalid import format: {import_format} (expected one of {list(IMPORT_FORMATS)})")
+
+    return import_patients(db, ROW_READERS[import_format](file), chunk_size)
+
+if __name__ == "__main__":
+    from modules.database import session_local
+
+    parser = argparse.ArgumentParser(description="Imports patients from a JSON array, NDJSON or CSV file")
+    parser.add_argument("path", help="the file to import")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, help="the format of the file (guessed from its extension by default)")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE, help="number of patients inserted at a time")
+    args = parser.parse_args()
+
+    import_format = args.format or os.path.splitext(args.path)[1].lstrip(".").lower()
+
+    db = session_local()
+    try:
+        with open(args.path, "rb") as file:
+            stats = import_patient_file(db, file, import_format, args.chunk_size)
+    finally:
+        db.close()
+
+    print(f"{stats['imported_rows']} patients imported ({stats['failed_rows']} failed) "
+          f"in {stats['duration_seconds']:.2f}s: {stats['rows_per_second']:.0f} rows/s")
+    for error in stats["errors"]:
+        print(f"row {error['row']}: {error['error']}")
@@ -0,0 +1,159 @@
+from sqlalchemy import select, insert, delete
+from sqlalchemy.orm import Session
+from models.patient import Patient
+from models.patient_prediction import PatientPrediction
+from models.region import Region
+from models.smoker import Smoker
+from models.sex import Sex
+from modules.feature_encoding import encode_features, REGIONS, SEX_ENCODING, SMOKER_ENCODING
+from modules.model_registry import model_registry
+import pandas as pd
+import argparse
+import logging
+import os
+import time
+
+# Number of patients predicted and written back per chunk
+BULK_PREDICTION_CHUNK_SIZE = int(os.getenv("BULK_PREDICTION_CHUNK_SIZE", "5000"))
+
+def _fetch_chunk(db: Session, last_id, chunk_size: int):
+    """
+    Fetches the next chunk of patients (keyset on id_patient) with their region, smoker status and sex
+    (None when the patient's lookup ID is unknown)
+
+    Parameters:
+        - db: the database in which to work
+        - last_id: the id of the last patient of the previous chunk (None for the first chunk)
+        - chunk_size: the maximum number of patients to fetch
+
+    Return:
+        - a dataframe of the patients' data
+    """
+    query = (
+        select(
+            Patient.id_patient,
+            Patient.age,
+            Patient.bmi,
+            Patient.children,
+            Patient.charges,
+            Region.region_name.label("region"),
+            Smoker.is_smoker.label("smoker"),
+            Sex.sex_label.label("sex")
+        )
+        .outerjoin(Region, Patient.id_region == Region.id_region)
+        .outerjoin(Smoker, Patient.id_smoker == Smoker.id_smoker)
+        .outerjoin(Sex, Patient.id_sex == Sex.id_sex)
+        .order_by(Patient.id_patient)
+        .limit(chunk_size)
+    )
+
+    if last_id is not None:
+        query = query.where(Patient.id_patient > last_id)
+
+    rows = db.execute(query).all()
+
+    return pd.DataFrame(rows, columns=["id_patient", "age", "bmi", "children", "charges", "region", "smoker", "sex"])
+
+def predict_all_patients(db: Session, chunk_size: int = BULK_PREDICTION_CHUNK_SIZE):
+    """
+    Predicts the charges of every stored patient, chunk by chunk, and writes the predicted
+    charges and the residuals (stored charges - predicted charges) into the patient_prediction table
+
+    Parameters:
+        - db: the database in which to work
+        - chunk_size: the number of patients processed (and committed) at a time
+
+    Return:
+        - a dictionary of statistics about the job
+    """
+    loaded_model = model_registry.get_model()
+    model_version = model_registry.version
+
+    start = time.perf_counter()
+    last_id = None
+    predicted_rows = 0
+    skipped_rows = 0
+    chunks = 0
+
+    while True:
+        df = _fetch_chunk(db, last_id, chunk_size)
+        if df.empty:
+            break
+
+        last_id = int(df['id_patient'].iloc[-1])
+        chunk_ids = [int(id_patient) for id_patient in df['id_patient']]
+        chunks += 1
+
+        # Skipping patients whose labels cannot be encoded
+        valid_rows = (
+            df['region'].isin(REGIONS)
+            & df['smoker'].isin(SMOKER_ENCODING.keys())
+            & df['sex'].isin(SEX_ENCODING.keys())
+        )
+        skipped_rows += int((~valid_rows).sum())
+        df = df[valid_rows]
+
+        records = []
+        if not df.empty:
+            # Prediction (a single call per chunk)
+            y_pred = loaded_model.predict(encode_features(df))
+
+            charges = pd.to_numeric(df['charges'], errors='coerce').astype('float64')
+            residuals = charges - y_pred
+            predicted_at = time.time()
+
+            records = [
+                {
+                    "id_patient": int(id_patient),
+                    "predicted_charges": float(prediction),
+                    "residual": None if pd.isna(residual) else float(residual),
+                    "model_version": model_version,
+                    "predicted_at": predicted_at
+                }
+                for id_patient, prediction, residual in zip(df['id_patient'], y_pred, residuals)
+            ]
+
+        # Writing the chunk back in bulk, replacing the previous predictions of every patient of the chunk
+        # (the skipped patients keep no prediction made by an earlier model)
+        try:
+            db.execute(delete(PatientPrediction).where(PatientPrediction.id_patient.in_(chunk_ids)))
+            if records:
+                db.execute(insert(PatientPrediction), records)
+            db.commit()
+        except Exception as e:
+            logging.error(f"Error writing predictions: {str(e)}")
+            db.rollback()
+            raise
+
+        predicted_rows += len(records)
+
+    duration = time.perf_counter() - start
+
+    stats = {
+        "predicted_rows": predicted_rows,
+        "skipped_rows": skipped_rows,
+        "chunks": chunks,
+        "duration_seconds": duration,
+        "rows_per_second": predicted_rows / duration if duration > 0 else None,
+        "model_version": model_version
+    }
+
+    logging.info(f"Bulk prediction done: {stats}")
+
+    return stats
+
+if __name__ == "__main__":
+    from modules.database import session_local
+
+    parser = argparse.ArgumentParser(description="Predicts the charges of every stored patient")
+    parser.add_argument("--chunk-size", type=int, default=BULK_PREDICTION_CHUNK_SIZE, help="number of patients processed at a time")
+    args = parser.parse_args()
+
+    db = session_local()
+    try:
+        stats = predict_all_patients(db, args.chunk_size)
+    finally:
+        db.close()
+
+    print(f"{stats['predicted_rows']} patients predicted ({stats['skipped_rows']} skipped) "
+          f"in {stats['duration_seconds']:.2f}s: {stats['rows_per_second']:.0f} rows/s")
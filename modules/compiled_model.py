@@ -0,0 +1,171 @@
+import argparse
+import numpy as np
+
+class CompiledGradientBoosting:
+    """
+    A gradient boosting regressor flattened into NumPy arrays (one row per tree, one column per node),
+    evaluated with NumPy only (no scikit-learn import)
+    """
+
+    def __init__(self, feature, threshold, children_left, children_right, value, baseline, learning_rate, feature_names, max_depth):
+        """
+        Parameters:
+            - feature: the feature index tested by each node (0 for the leaves)
+            - threshold: the threshold of each node (going left when feature <= threshold)
+            - children_left: the left child of each node (the node itself for the leaves)
+            - children_right: the right child of each node (the node itself for the leaves)
+            - value: the value of each node (used for the leaves)
+            - baseline: the initial prediction of the ensemble
+            - learning_rate: the learning rate applied to each tree
+            - feature_names: the names of the features, in the model's order
+            - max_depth: the maximum depth of the trees
+        """
+        self.feature = feature
+        self.threshold = threshold
+        self.children_left = children_left
+        self.children_right = children_right
+        self.value = value
+        self.baseline = float(baseline)
+        self.learning_rate = float(learning_rate)
+        self.feature_names_in_ = np.asarray(feature_names, dtype=object)
+        self.max_depth = int(max_depth)
+        self.n_estimators_ = feature.shape[0]
+
+    def predict(self, X):
+        """
+        Predicts the charges of a matrix of encoded features
+
+        Parameters:
+            - X: a 2D array (or dataframe) of encoded features, in the model's column order
+
+        Return:
+            - the array of predictions
+        """
+        # Like scikit-learn's trees, the features are compared as float32
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != len(self.feature_names_in_):
+            raise ValueError(f"Expected a 2D array with {len(self.feature_names_in_)} features, got shape {X.shape}")
+
+        # A NaN would go down a branch like any number: the rows are rejected, as scikit-learn does
+        invalid_rows = ~np.isfinite(X).all(axis=1)
+        if invalid_rows.any():
+            raise ValueError(f"Input contains NaN or infinity in rows: {np.flatnonzero(invalid_rows).tolist()[:20]}")
+
+        rows = np.arange(X.shape[0])[:, None]
+        trees = np.arange(self.n_estimators_)[None, :]
+        nodes = np.zeros((X.shape[0], self.n_estimators_), dtype=np.intp)
+
+        # Walking down every tree for every row at once (the leaves loop on themselves)
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[trees, nodes]] <= self.threshold[trees, nodes]
+            nodes = np.where(go_left, self.children_left[trees, nodes], self.children_right[trees, nodes])
+
+        return self.baseline + self.learning_rate * self.value[trees, nodes].sum(axis=1)
+
+    def save(self, path: str):
+        """
+        Saves the compiled model into a .npz file
+
+        Parameters:
+            - path: the path of the file
+        """
+        np.savez(
+            path,
+            feature=self.feature,
+            threshold=self.threshold,
+            children_left=self.children_left,
+            children_right=self.children_right,
+            value=self.value,
+            baseline=np.float64(self.baseline),
+            learning_rate=np.float64(self.learning_rate),
+            feature_names=np.asarray(self.feature_names_in_, dtype=str),
+            max_depth=np.int64(self.max_depth)
+        )
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Loads a compiled model from a .npz file
+
+        Parameters:
+            - path: the path of the file
+
+        Return:
+            - the compiled model
+        """
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(
+                arrays["feature"],
+                arrays["threshold"],
+                arrays["children_left"],
+                arrays["children_right"],
+                arrays["value"],
+                arrays["baseline"],
+                arrays["learning_rate"],
+                arrays["feature_names"].tolist(),
+                arrays["max_depth"]
+            )
+
+def compile_model(model):
+    """
+    Flattens a trained scikit-learn GradientBoostingRegressor (squared error loss) into NumPy arrays
+
+    Parameters:
+        - model: the trained GradientBoostingRegressor
+
+    Return:
+        - the compiled model
+    """
+    if getattr(model, "loss", None) != "squared_error":
+        raise ValueError(f"Only the squared_error loss can be compiled (got {getattr(model, 'loss', None)})")
+
+    trees = [estimator.tree_ for estimator in model.estimators_[:, 0]]
+    n_trees = len(trees)
+    n_nodes = max(tree.node_count for tree in trees)
+
+    feature = np.zeros((n_trees, n_nodes), dtype=np.intp)
+    threshold = np.zeros((n_trees, n_nodes), dtype=np.float64)
+    children_left = np.tile(np.arange(n_nodes, dtype=np.intp), (n_trees, 1))
+    children_right = children_left.copy()
+    value = np.zeros((n_trees, n_nodes), dtype=np.float64)
+
+    for i, tree in enumerate(trees):
+        count = tree.node_count
+        internal = tree.children_left != -1
+
+        feature[i, :count] = np.where(internal, tree.feature, 0)
+        threshold[i, :count] = np.where(internal, tree.threshold, 0.0)
+        children_left[i, :count] = np.where(internal, tree.children_left, np.arange(count))
+        children_right[i, :count] = np.where(internal, tree.children_right, np.arange(count))
+        value[i, :count] = tree.value[:, 0, 0]
+
+    if model.init_ == "zero":
+        baseline = 0.0
+    else:
+        baseline = float(np.ravel(model.init_.constant_)[0])
+
+    return CompiledGradientBoosting(
+        feature,
+        threshold,
+        children_left,
+        children_right,
+        value,
+        baseline,
+        model.learning_rate,
+        getattr(model, "feature_names_in_", [f"x{i}" for i in range(model.n_features_in_)]),
+        max(tree.max_depth for tree in trees)
+    )
+
+if __name__ == "__main__":
+    import joblib
+
+    parser = argparse.ArgumentParser(description="Compiles a joblib gradient boosting model into a NumPy .npz file")
+    parser.add_argument("source", nargs="?", default="data/gradient_boosting_model.joblib", help="the joblib model file")
+    parser.add_argument("target", nargs="?", default="data/gradient_boosting_model.npz", help="the compiled model file")
+    args = parser.parse_args()
+
+    model = joblib.load(args.source)
+    compiled_model = compile_model(model)
+    compiled_model.save(args.target)
+
+    print(f"{compiled_model.n_estimators_} trees compiled into {args.target}")
@@ -0,0 +1,260 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from cryptography.fernet import Fernet
+from dotenv import load_dotenv
+from sqlalchemy import LargeBinary, bindparam, type_coerce
+from sqlalchemy.types import TypeDecorator
+import logging
+import multiprocessing
+import os
+import re
+import threading
+
+# Loading .env file (only works locally)
+load_dotenv()
+
+# Retrieving the fernet key from the envrionment variable
+key = os.getenv("FERNET_KEY")
+fernet = Fernet(key)
+if not fernet:
+    logging.error("Error fetching FERNET_KEY")
+    raise ValueError("FERNET_KEY environment variable is not set.")
+
+# Decryption pool settings, also used by the bulk encryption ("thread" or "process"; below DECRYPTION_MIN_PARALLEL_VALUES values, it stays serial)
+DECRYPTION_EXECUTOR = os.getenv("DECRYPTION_EXECUTOR", "thread")
+DECRYPTION_WORKERS = int(os.getenv("DECRYPTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+DECRYPTION_CHUNK_SIZE = int(os.getenv("DECRYPTION_CHUNK_SIZE", "500"))
+DECRYPTION_MIN_PARALLEL_VALUES = int(os.getenv("DECRYPTION_MIN_PARALLEL_VALUES", "1000"))
+
+# Legacy format of the encrypted values: a stringified Python bytes literal ("b'gAAAA...'")
+LEGACY_TOKEN_PATTERN = re.compile(r"^b'gAAAA[A-Za-z0-9_\-]+=*'$")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def parse_token(value):
+    """
+    Gets the raw Fernet token of a stored encrypted value
+
+    Parameters:
+        - value: the stored value (raw token bytes, or a legacy "b'gAAAA...'" text literal)
+
+    Return:
+        - the token bytes
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+
+    # Legacy literal: the token is the text between b' and '
+    if value.startswith("b'") and value.endswith("'"):
+        return value[2:-1].encode()
+
+    return value.encode()
+
+def to_token(value):
+    """
+    Encrypts a value to store: the written values are always plain text, encrypted here (a value looking
+    like a token is encrypted too, so a client can never store a token it made up)
+
+    Parameters:
+        - value: the plain text
+
+    Return:
+        - the token bytes
+    """
+    if not isinstance(value, str):
+        raise TypeError(f"Encrypted columns take plain text, not {type(value).__name__} (write raw tokens with raw_token_param)")
+
+    return fernet.encrypt(value.encode())
+
+def decrypt_value(value):
+    """
+    Decrypts a stored encrypted value
+
+    Parameters:
+        - value: the stored value (raw token bytes, or a legacy "b'gAAAA...'" text literal)
+
+    Return:
+        - the decrypted text (or None if the value is None)
+    """
+    if value is None:
+        return None
+
+    return fernet.decrypt(parse_token(value)).decode()
+
+def _decrypt_chunk(values):
+    """
+    Decrypts a chunk of stored encrypted values (run by the pool's workers)
+
+    Parameters:
+        - values: the list of stored values
+
+    Return:
+        - the list of decrypted texts
+    """
+    return [decrypt_value(value) for value in values]
+
+def _get_executor():
+    """
+    Gets the decryption pool, creating it on first use
+
+    Return:
+        - the pool executor
+    """
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                if DECRYPTION_EXECUTOR == "process":
+                    _executor = ProcessPoolExecutor(max_workers=DECRYPTION_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+                else:
+                    _executor = ThreadPoolExecutor(max_workers=DECRYPTION_WORKERS, thread_name_prefix="decryption")
+
+    return _executor
+
+def _map_chunks(function, values, chunk_size: int):
+    """
+    Applies a chunk function to a list of values, in chunks spread across the pool
+    (serially when there are only a few values)
+
+    Parameters:
+        - function: the function converting a chunk of values (_decrypt_chunk or _encrypt_chunk)
+        - values: the list of values
+        - chunk_size: the number of values per task
+
+    Return:
+        - the list of converted values, in the same order
+    """
+    values = list(values)
+
+    if DECRYPTION_WORKERS <= 1 or len(values) < DECRYPTION_MIN_PARALLEL_VALUES:
+        return function(values)
+
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    converted = []
+    for converted_chunk in _get_executor().map(function, chunks):
+        converted.extend(converted_chunk)
+
+    return converted
+
+def decrypt_values(values, chunk_size: int = DECRYPTION_CHUNK_SIZE):
+    """
+    Decrypts a list of stored encrypted values, in chunks spread across the decryption pool
+    (serially when there are only a few values)
+
+    Parameters:
+        - values: the list of stored values
+        - chunk_size: the number of values decrypted per task
+
+    Return:
+        - the list of decrypted texts, in the same order
+    """
+    return _map_chunks(_decrypt_chunk, values, chunk_size)
+
+def decrypt_fields(rows: list[dict], fields):
+    """
+    Decrypts some fields of a list of rows in place (all values are decrypted in one batch)
+
+    Parameters:
+        - rows: the list of rows (dictionaries)
+        - fields: the names of the encrypted fields
+
+    Return:
+        - rows: the same rows, with the fields decrypted
+    """
+    fields = list(fields)
+    decrypted = decrypt_values(row[field] for row in rows for field in fields)
+
+    for i, row in enumerate(rows):
+        for j, field in enumerate(fields):
+            row[field] = decrypted[i * len(fields) + j]
+
+    return rows
+
+def _encrypt_chunk(values):
+    """
+    Encrypts a chunk of texts (run by the pool's workers)
+
+    Parameters:
+        - values: the list of texts
+
+    Return:
+        - the list of Fernet tokens
+    """
+    return [fernet.encrypt(value.encode()) for value in values]
+
+def encrypt_values(values, chunk_size: int = DECRYPTION_CHUNK_SIZE):
+    """
+    Encrypts a list of texts, in chunks spread across the same pool as the decryption
+    (serially when there are only a few values)
+
+    Parameters:
+        - values: the list of texts
+        - chunk_size: the number of values encrypted per task
+
+    Return:
+        - the list of Fernet tokens (raw bytes), in the same order
+    """
+    return _map_chunks(_encrypt_chunk, values, chunk_size)
+
+class EncryptedToken(TypeDecorator):
+    """
+    A column holding Fernet tokens as raw bytes (BLOB): plain text is encrypted when written
+    and tokens are decrypted when read (legacy text literals are still read)
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, decrypt: bool = True):
+        """
+        Parameters:
+            - decrypt: whether the read values are decrypted (False to get the raw tokens)
+        """
+        super().__init__()
+        self.decrypt = decrypt
+
+    def process_bind_param(self, value, dialect):
+        """
+        Encrypts a plain text into the token to store
+        """
+        if value is None:
+            return None
+
+        return to_token(value)
+
+    def process_result_value(self, value, dialect):
+        """
+        Converts a stored token into the decrypted text (or the raw token)
+        """
+        if value is None:
+            return None
+
+        if self.decrypt:
+            return decrypt_value(value)
+
+        return parse_token(value)
+
+def raw_token(column):
+    """
+    Selects an encrypted column as raw tokens, to decrypt them later in one batch (see decrypt_values)
+
+    Parameters:
+        - column: the encrypted column
+
+    Return:
+        - the column expression returning the token bytes
+    """
+    return type_coerce(column, EncryptedToken(decrypt=False))
+
+def raw_token_param(name: str):
+    """
+    Binds already encrypted tokens, written as they are (by the bulk import and the migrations,
+    which encrypt or check the tokens themselves)
+
+    Parameters:
+        - name: the name of the bound parameter
+
+    Return:
+        - the bound parameter taking token bytes
+    """
+    return bindparam(name, type_=LargeBinary)
@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+
+# Encodings used when training the model
+SMOKER_ENCODING = {'no': 0, 'yes': 1}
+SEX_ENCODING = {'male': 0, 'female': 1}
+REGIONS = ['northeast', 'northwest', 'southeast', 'southwest']
+
+# Columns expected by the model, in the training order
+FEATURE_COLUMNS = ['age', 'sex', 'bmi', 'children', 'smoker'] + [f"region_{region}" for region in REGIONS]
+
+# Columns required in the patients' data
+INPUT_COLUMNS = ['age', 'sex', 'bmi', 'children', 'smoker', 'region']
+
+def encode_features(df: pd.DataFrame):
+    """
+    Encodes patients' data into the model's features, in a single vectorized pass
+
+    Parameters:
+        - df: a dataframe with the age, sex, bmi, children, smoker and region columns
+
+    Return:
+        - features: a dataframe of the encoded features, in the model's column order
+    """
+    missing_columns = [column for column in INPUT_COLUMNS if column not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Missing columns: {', '.join(missing_columns)}")
+
+    features = pd.DataFrame(index=df.index)
+
+    # Rejecting rows with missing or infinite numbers (the model would still predict a value for them)
+    numbers = {column: pd.to_numeric(df[column], errors='raise').astype('float64') for column in ['age', 'bmi', 'children']}
+    invalid_rows = ~np.isfinite(pd.DataFrame(numbers)).all(axis=1)
+    if invalid_rows.any():
+        raise ValueError(f"Missing or invalid age, bmi or children value in rows: {df.index[invalid_rows].tolist()[:20]}")
+
+    # Normalizing data
+    # Simply dividing by 100 works well, while using MinMaxScaler() results in prediction bias
+    features['age'] = numbers['age'].astype('int64') / 100
+    features['sex'] = df['sex'].map(SEX_ENCODING)
+    features['bmi'] = numbers['bmi'] / 100
+    features['children'] = numbers['children'].astype('int64') / 100
+    features['smoker'] = df['smoker'].map(SMOKER_ENCODING)
+
+    # One-hot encoding the region
+    for region in REGIONS:
+        features[f"region_{region}"] = (df['region'] == region).astype('int64')
+
+    # Rejecting rows with unknown labels
+    invalid_rows = (
+        features['sex'].isna()
+        | features['smoker'].isna()
+        | ~df['region'].isin(REGIONS)
+    )
+    if invalid_rows.any():
+        raise ValueError(f"Invalid sex, smoker or region value in rows: {df.index[invalid_rows].tolist()[:20]}")
+
+    features['sex'] = features['sex'].astype('int64')
+    features['smoker'] = features['smoker'].astype('int64')
+
+    return features[FEATURE_COLUMNS]
+
+class FeatureEncoder:
+    """
+    Encodes validated patients' data straight into NumPy rows, in the model's feature order
+    (no dataframe allocation, for the single-prediction hot path)
+    """
+
+    def __init__(self, feature_names):
+        """
+        Parameters:
+            - feature_names: the names of the model's features, in the model's order
+        """
+        self.feature_names = [str(name) for name in feature_names]
+        self.n_features = len(self.feature_names)
+
+        index = {name: i for i, name in enumerate(self.feature_names)}
+        missing_features = [name for name in FEATURE_COLUMNS if name not in index]
+        if missing_features or self.n_features != len(FEATURE_COLUMNS):
+            raise ValueError(f"Unexpected model features: {self.feature_names}")
+
+        self._age = index['age']
+        self._sex = index['sex']
+        self._bmi = index['bmi']
+        self._children = index['children']
+        self._smoker = index['smoker']
+        self._regions = {region: index[f"region_{region}"] for region in REGIONS}
+
+    @classmethod
+    def from_model(cls, model):
+        """
+        Builds an encoder from the feature order the model has been trained with
+
+        Parameters:
+            - model: the trained model
+
+        Return:
+            - the feature encoder
+        """
+        return cls(getattr(model, 'feature_names_in_', FEATURE_COLUMNS))
+
+    def _fill(self, row, patient):
+        """
+        Fills a row of features with a patient's encoded data
+
+        Parameters:
+            - row: the 1D array to fill
+            - patient: the patient's data (a PatientBaseAI or any object with the same attributes)
+        """
+        sex = SEX_ENCODING.get(patient.sex)
+        smoker = SMOKER_ENCODING.get(patient.smoker)
+        region = self._regions.get(patient.region)
+
+        if sex is None or smoker is None or region is None:
+            raise ValueError(f"Invalid sex, smoker or region value: {patient.sex}, {patient.smoker}, {patient.region}")
+
+        if not np.isfinite([patient.age, patient.bmi, patient.children]).all():
+            raise ValueError(f"Invalid age, bmi or children value: {patient.age}, {patient.bmi}, {patient.children}")
+
+        row[:] = 0.0
+
+        # Normalizing data
+        # Simply dividing by 100 works well, while using MinMaxScaler() results in prediction bias
+        row[self._age] = int(patient.age) / 100
+        row[self._sex] = sex
+        row[self._bmi] = float(patient.bmi) / 100
+        row[self._children] = int(patient.children) / 100
+        row[self._smoker] = smoker
+        row[region] = 1.0
+
+    def encode(self, patient, out=None):
+        """
+        Encodes a single patient
+
+        Parameters:
+            - patient: the patient's data (a PatientBaseAI or any object with the same attributes)
+            - out: an optional (1, n_features) float64 buffer to fill
+
+        Return:
+            - a contiguous (1, n_features) float64 array
+        """
+        if out is None:
+            out = np.empty((1, self.n_features), dtype=np.float64)
+
+        self._fill(out[0], patient)
+
+        return out
+
+    def encode_many(self, patients, out=None):
+        """
+        Encodes a batch of patients
+
+        Parameters:
+            - patients: a sequence of patients' data
+            - out: an optional preallocated float64 buffer with at least len(patients) rows
+
+        Return:
+            - a contiguous (len(patients), n_features) float64 array
+        """
+        if out is None:
+            out = np.empty((len(patients), self.n_features), dtype=np.float64)
+        elif out.shape[0] < len(patients) or out.shape[1] != self.n_features:
+            raise ValueError(f"Buffer of shape {out.shape} too small for {len(patients)} patients")
+
+        for i, patient in enumerate(patients):
+            self._fill(out[i], patient)
+
+        return out[:len(patients)]
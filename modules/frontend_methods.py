@@ -1,18 +1,109 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
+import os
+
+# Base URL of the FastAPI backend
+API_BASE_URL = os.getenv("API_BASE_URL", "http://127.0.0.1:8000").rstrip("/")
+
+# Timeout (in seconds) of the requests to FastAPI
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", "10"))
+
+# Retries of the failed idempotent requests (with an exponential backoff) and size of the connection pool
+API_RETRIES = int(os.getenv("API_RETRIES", "3"))
+API_RETRY_BACKOFF = float(os.getenv("API_RETRY_BACKOFF", "0.3"))
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", "10"))
+
+# Number of seconds the lookup tables (regions, smoker statuses, sexes, roles) are kept across reruns
+LOOKUP_CACHE_TTL = int(os.getenv("LOOKUP_CACHE_TTL", "600"))
+
+def create_http_session():
+    """
+    Creates an HTTP session keeping its connections to FastAPI alive, and retrying the
+    idempotent requests on connection errors and 502/503/504 responses
+
+    Return:
+        - the HTTP session
+    """
+    retry = Retry(
+        total=API_RETRIES,
+        backoff_factor=API_RETRY_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=API_POOL_SIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+@st.cache_resource
+def get_http_session():
+    """
+    Gets the HTTP session shared by every rerun and every user of the frontend
+    (the session token is sent per request, never stored in the shared session)
+
+    Return:
+        - the HTTP session
+    """
+    return create_http_session()
+
+def auth_headers():
+    """
+    Gets the headers authenticating a request with the logged-in user's session token
+
+    Return:
+        - the Authorization header (or no header if nobody is logged in)
+    """
+    access_token = st.session_state.get("access_token")
+
+    return {"Authorization": f"Bearer {access_token}"} if access_token else {}
+
+def api_request(method: str, path: str, **kwargs):
+    """
+    Sends a request to FastAPI through the shared HTTP session, with the logged-in user's session token
+
+    Parameters:
+        - method: the HTTP method
+        - path: the path of the route (e.g. "/patients/regions/")
+        - kwargs: the other arguments of requests (json, params, ...)
+
+    Return:
+        - the response
+    """
+    kwargs.setdefault("timeout", API_TIMEOUT)
+    headers = {**auth_headers(), **kwargs.pop("headers", {})}
+
+    return get_http_session().request(method, f"{API_BASE_URL}{path}", headers=headers, **kwargs)
+
+@st.cache_data(ttl=LOOKUP_CACHE_TTL, show_spinner=False)
+def fetch_lookups():
+    """
+    Fetches every lookup table from FastAPI in one request, cached across reruns and sessions
+    (the failed requests raise, so they are not cached)
+
+    Return:
+        - the lookup tables by name ("regions", "smokers", "sexes", "roles"), and their "version"
+    """
+    response = api_request("GET", "/patients/lookups/")
+    response.raise_for_status()
+
+    return response.json()
 
 def get_regions():
     """
-    Fetches all regions from FastAPI
+    Gets all regions (from the lookup tables fetched in one request, cached for LOOKUP_CACHE_TTL seconds)
 
     Return:
         - the list of regions (or nothing if the request fails)
     """
     try:
-        response = requests.get("http://127.0.0.1:8000/patients/regions/")
-        response.raise_for_status()
-        return response.json()
+        return fetch_lookups()["regions"]
     except requests.exceptions.RequestException as e:
         logging.error(f"Error fetching region data: {e}")
         st.error(f"Error fetching region data: {e}")
@@ -20,15 +111,13 @@ def get_regions():
 
 def get_smokers():
     """
-    Fetches all smoker statuses from FastAPI
+    Gets all smoker statuses (from the lookup tables fetched in one request, cached for LOOKUP_CACHE_TTL seconds)
 
     Return:
         - the list of smoker statuses (or nothing if the request fails)
     """
     try:
-        response = requests.get("http://127.0.0.1:8000/patients/smokers/")
-        response.raise_for_status()
-        return response.json()
+        return fetch_lookups()["smokers"]
     except requests.exceptions.RequestException as e:
         logging.error(f"Error fetching smoker data: {e}")
         st.error(f"Error fetching smoker data: {e}")
@@ -36,35 +125,42 @@ def get_smokers():
     
 def get_sexes():
     """
-    Fetches all sexes from FastAPI
+    Gets all sexes (from the lookup tables fetched in one request, cached for LOOKUP_CACHE_TTL seconds)
 
     Return:
         - the list of sexes (or nothing if the request fails)
     """
     try:
-        response = requests.get("http://127.0.0.1:8000/patients/sexes/")
-        response.raise_for_status()
-        return response.json()
+        return fetch_lookups()["sexes"]
     except requests.exceptions.RequestException as e:
         logging.error(f"Error fetching sex data: {e}")
         st.error(f"Error fetching sex data: {e}")
         return []
     
-def get_patients():
+def get_patients(params=None, cursor=None):
     """
-    Fetches all patients from FastAPI
+    Fetches one page of patients from FastAPI
+
+    Parameters:
+        - params: the filters, sort options and page size (query parameters of the route)
+        - cursor: the cursor of the page (None for the first page)
 
     Return:
-        - the list of patients (or nothing if the request fails)
+        - the list of patients of the page (or nothing if the request fails)
+        - the cursor of the next page (or None if this is the last page)
     """
+    query_params = dict(params or {})
+    if cursor:
+        query_params["cursor"] = cursor
+
     try:
-        response = requests.get("http://127.0.0.1:8000/patients/patients/")
+        response = api_request("GET", "/patients/patients/", params=query_params)
         response.raise_for_status()
-        return response.json()
+        return response.json(), response.headers.get("X-Next-Cursor")
     except requests.exceptions.RequestException as e:
         logging.error(f"Error fetching patient data: {e}")
         st.error(f"Error fetching patient data: {e}")
-        return []
+        return [], None
     
 def get_patient(id_patient):
     """
@@ -77,7 +173,7 @@ def get_patient(id_patient):
         - the patient's data in JSON format (or None if the request fails)
     """
     try:
-        response = requests.get(f"http://127.0.0.1:8000/patients/{id_patient}/")
+        response = api_request("GET", f"/patients/{id_patient}/")
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -87,15 +183,13 @@ def get_patient(id_patient):
     
 def get_roles():
     """
-    Fetches all roles from FastAPI
+    Gets all roles (from the lookup tables fetched in one request, cached for LOOKUP_CACHE_TTL seconds)
 
     Return:
         - the list of roles (or nothing if the request fails)
     """
     try:
-        response = requests.get("http://127.0.0.1:8000/users/roles/")
-        response.raise_for_status()
-        return response.json()
+        return fetch_lookups()["roles"]
     except requests.exceptions.RequestException as e:
         logging.error(f"Error fetching role data: {e}")
         st.error(f"Error fetching role data: {e}")
@@ -110,7 +204,7 @@ def get_users():
     """
     try:
         # Fetching all users from FastAPI
-        response = requests.get("http://127.0.0.1:8000/users/users/")
+        response = api_request("GET", "/users/users/")
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -129,7 +223,7 @@ def get_user(id_user):
         - the user's data in JSON format (or None if the request fails)
     """
     try:
-        response = requests.get(f"http://127.0.0.1:8000/users/{id_user}/")
+        response = api_request("GET", f"/users/{id_user}/")
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
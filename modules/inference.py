@@ -0,0 +1,207 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from modules.compiled_model import CompiledGradientBoosting
+from modules.micro_batcher import MicroBatcher
+from modules.model_registry import model_registry
+from modules.prediction_cache import PredictionCache
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+# Inference executor settings ("process" to use all cores, "thread" as a fallback)
+PREDICTION_EXECUTOR = os.getenv("PREDICTION_EXECUTOR", "process")
+PREDICTION_WORKERS = int(os.getenv("PREDICTION_WORKERS", str(os.cpu_count() or 1)))
+
+# Micro-batching settings (the window is the time waited for other requests after the first one)
+PREDICTION_BATCH_WINDOW_MS = float(os.getenv("PREDICTION_BATCH_WINDOW_MS", "2"))
+PREDICTION_MAX_BATCH_SIZE = int(os.getenv("PREDICTION_MAX_BATCH_SIZE", "64"))
+PREDICTION_MAX_QUEUE_SIZE = int(os.getenv("PREDICTION_MAX_QUEUE_SIZE", "1000"))
+
+# Prediction cache settings (a size of 0 disables the cache)
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "3600"))
+
+def _model_input(model, features):
+    """
+    Prepares the encoded features for a model: a scikit-learn model fitted on named columns gets the array
+    as a dataframe with these names (the array is already in its column order, see FeatureEncoder)
+
+    Parameters:
+        - model: the model making the predictions
+        - features: a 2D array (or dataframe) of encoded features, in the model's column order
+
+    Return:
+        - the features to pass to the model's predict
+    """
+    if isinstance(features, np.ndarray) and not isinstance(model, CompiledGradientBoosting) and hasattr(model, "feature_names_in_"):
+        return pd.DataFrame(features, columns=model.feature_names_in_, copy=False)
+
+    return features
+
+def predict_features(features):
+    """
+    Predicts the charges of a matrix of encoded features with the resident model
+
+    Parameters:
+        - features: a 2D array (or dataframe) of encoded features, in the model's column order
+
+    Return:
+        - the array of predicted charges
+    """
+    loaded_model = model_registry.get_model()
+
+    return loaded_model.predict(_model_input(loaded_model, features))
+
+def predict_features_versioned(features):
+    """
+    Predicts the charges of a matrix of encoded features with the resident model, and tells which
+    model made them (the workers reload the model on their own schedule)
+
+    Parameters:
+        - features: a 2D array (or dataframe) of encoded features, in the model's column order
+
+    Return:
+        - the array of predicted charges
+        - the version of the model that predicted them
+    """
+    loaded_model, version = model_registry.get_versioned_model()
+
+    return loaded_model.predict(_model_input(loaded_model, features)), version
+
+def _init_worker():
+    """
+    Initializer of the inference processes: loads the model once per process
+    """
+    model_registry.get_model()
+
+def _worker_model_status():
+    """
+    Gets the status of the resident model of the worker running the call
+
+    Return:
+        - a dictionary describing the worker's resident model (see ModelRegistry.status)
+    """
+    return model_registry.status()
+
+class InferenceExecutor:
+    """
+    Runs the CPU-bound predictions outside of the event loop, in a pool of processes
+    (each one preloading the model) or, as a fallback, in a pool of threads
+    """
+
+    def __init__(self, mode: str = PREDICTION_EXECUTOR, workers: int = PREDICTION_WORKERS):
+        """
+        Parameters:
+            - mode: "process" or "thread"
+            - workers: the number of processes or threads of the pool
+        """
+        if mode not in ("process", "thread"):
+            raise ValueError(f"Invalid prediction executor: {mode} (expected \"process\" or \"thread\")")
+
+        self.mode = mode
+        self.workers = max(1, workers)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """
+        Gets the pool, creating it on first use
+
+        Return:
+            - the pool executor
+        """
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.mode == "process":
+                        # "spawn" avoids forking the threads (and locks) of the API process
+                        self._executor = ProcessPoolExecutor(
+                            max_workers=self.workers,
+                            mp_context=multiprocessing.get_context("spawn"),
+                            initializer=_init_worker
+                        )
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+
+                    logging.info(f"Inference executor started ({self.mode} mode, {self.workers} workers)")
+
+        return self._executor
+
+    def start(self):
+        """
+        Starts the pool and makes every worker load the model
+        """
+        executor = self._get_executor()
+
+        if self.mode == "process":
+            for future in [executor.submit(_init_worker) for _ in range(self.workers)]:
+                future.result()
+
+    async def predict(self, features):
+        """
+        Predicts a matrix of encoded features in the pool, without blocking the event loop
+
+        Parameters:
+            - features: a 2D array (or dataframe) of encoded features, in the model's column order
+
+        Return:
+            - the array of predicted charges
+        """
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(self._get_executor(), predict_features, features)
+
+    async def predict_versioned(self, features):
+        """
+        Predicts a matrix of encoded features in the pool (see predict), with the version of the worker's model
+
+        Parameters:
+            - features: a 2D array of encoded features, in the model's column order
+
+        Return:
+            - a list of (predicted charges, model version) pairs, one per row
+        """
+        loop = asyncio.get_running_loop()
+        predictions, version = await loop.run_in_executor(self._get_executor(), predict_features_versioned, features)
+
+        return [(float(prediction), version) for prediction in predictions]
+
+    def shutdown(self):
+        """
+        Stops the pool
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+    def status(self):
+        """
+        Gets the settings of the pool
+
+        Return:
+            - a dictionary with the mode, the number of workers and whether the pool is running
+        """
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "running": self._executor is not None
+        }
+
+# Pool shared by every prediction of the API process
+prediction_executor = InferenceExecutor()
+
+# Micro-batcher shared by the concurrent single-patient predictions (each one with its model version)
+prediction_batcher = MicroBatcher(
+    prediction_executor.predict_versioned,
+    max_batch_size=PREDICTION_MAX_BATCH_SIZE,
+    max_wait_ms=PREDICTION_BATCH_WINDOW_MS,
+    max_queue_size=PREDICTION_MAX_QUEUE_SIZE,
+    max_in_flight=prediction_executor.workers
+)
+
+# Cache of the single-patient predictions
+prediction_cache = PredictionCache(max_size=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL)
@@ -0,0 +1,260 @@
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models.region import Region, get_regions
+from models.sex import Sex, get_sexes
+from models.smoker import Smoker, get_smoker_statuses
+from models.user_role import UserRole, get_user_roles
+import hashlib
+import json
+import logging
+import os
+import threading
+
+# Number of seconds the clients may reuse a lookup table without asking again (Cache-Control max-age)
+LOOKUP_CACHE_MAX_AGE = int(os.getenv("LOOKUP_CACHE_MAX_AGE", "300"))
+
+# Lookup tables: their mapped class, their getter and their columns
+LOOKUP_TABLES = {
+    "regions": (Region, get_regions, ["id_region", "region_name"]),
+    "smokers": (Smoker, get_smoker_statuses, ["id_smoker", "is_smoker"]),
+    "sexes": (Sex, get_sexes, ["id_sex", "sex_label"]),
+    "roles": (UserRole, get_user_roles, ["id_role", "role_name"])
+}
+
+class LookupCache:
+    """
+    In-process copy of the lookup tables (regions, smoker statuses, sexes, roles), each with an ETag,
+    loaded once and reloaded only after a committed write to the table
+    """
+
+    def __init__(self, session_factory=None):
+        """
+        Parameters:
+            - session_factory: the factory of the database sessions used to (re)load the tables
+              (the application's session_local by default)
+        """
+        self.session_factory = session_factory
+        self._tables = {}
+        self._ids = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.invalidations = 0
+
+    def load(self, names=None):
+        """
+        Loads (or reloads) lookup tables from the database, in a single session
+
+        Parameters:
+            - names: the names of the tables to load (all of them by default)
+
+        Return:
+            - the loaded tables, by name: their rows, their ETag and their set of IDs (as stored, so that
+              the caller does not read them back while another thread may invalidate them)
+        """
+        names = list(names or LOOKUP_TABLES)
+        loaded = {}
+
+        if self.session_factory is None:
+            # Imported here: the models import this module, and the database module imports the models
+            from modules.database import session_local
+            self.session_factory = session_local
+
+        db = self.session_factory()
+
+        try:
+            for name in names:
+                _, getter, columns = LOOKUP_TABLES[name]
+                rows = [{column: getattr(row, column) for column in columns} for row in getter(db)]
+                etag = '"' + hashlib.sha256(json.dumps(rows, sort_keys=True).encode()).hexdigest()[:32] + '"'
+
+                ids = frozenset(row[columns[0]] for row in rows)
+                loaded[name] = (rows, etag, ids)
+
+                with self._lock:
+                    self._tables[name] = (rows, etag)
+                    self._ids[name] = ids
+                    self.loads += 1
+        finally:
+            db.close()
+
+        logging.info(f"Lookup tables loaded: {names}")
+
+        return loaded
+
+    def get(self, name: str):
+        """
+        Gets a lookup table, loading it if needed
+
+        Parameters:
+            - name: the name of the table ("regions", "smokers", "sexes" or "roles")
+
+        Return:
+            - the table's rows (dictionaries)
+            - the table's ETag
+        """
+        entry = self._tables.get(name)
+        if entry is None:
+            rows, etag, _ = self.load([name])[name]
+            entry = (rows, etag)
+
+        return entry
+
+    def resolve_id(self, name: str, value):
+        """
+        Checks an ID of a lookup table against the in-memory copy (reloading the table once
+        if the ID is unknown, in case another process added it)
+
+        Parameters:
+            - name: the name of the table ("regions", "smokers", "sexes" or "roles")
+            - value: the ID (an integer or its string)
+
+        Return:
+            - the ID as an integer (or None if the table has no such ID)
+        """
+        try:
+            lookup_id = int(value)
+        except (TypeError, ValueError):
+            return None
+
+        ids = self._ids.get(name)
+        if ids is None or lookup_id not in ids:
+            _, _, ids = self.load([name])[name]
+            if lookup_id not in ids:
+                return None
+
+        return lookup_id
+
+    def get_all(self):
+        """
+        Gets every lookup table, with a version identifying their current content
+
+        Return:
+            - a dictionary of the tables' rows, by table name
+            - the version (a hash of the tables' ETags)
+        """
+        tables = {}
+        etags = []
+        for name in LOOKUP_TABLES:
+            tables[name], etag = self.get(name)
+            etags.append(etag)
+
+        version = hashlib.sha256("".join(etags).encode()).hexdigest()[:32]
+
+        return tables, version
+
+    def invalidate(self, names=None):
+        """
+        Forgets lookup tables (they are reloaded on their next use)
+
+        Parameters:
+            - names: the names of the tables to forget (all of them by default)
+        """
+        with self._lock:
+            for name in list(names or LOOKUP_TABLES):
+                self._ids.pop(name, None)
+                if self._tables.pop(name, None) is not None:
+                    self.invalidations += 1
+
+    def status(self):
+        """
+        Gets the loaded tables and the counters of the cache
+
+        Return:
+            - a dictionary with the loaded tables, their ETags, and the numbers of loads and invalidations
+        """
+        with self._lock:
+            tables = dict(self._tables)
+
+        return {
+            "tables": {name: {"rows": len(rows), "etag": etag} for name, (rows, etag) in tables.items()},
+            "loads": self.loads,
+            "invalidations": self.invalidations
+        }
+
+# Lookup tables of the API process
+lookup_cache = LookupCache()
+
+def lookup_response(request: Request, name: str):
+    """
+    Builds the response of a lookup route: the table with its ETag and Cache-Control headers,
+    or an empty 304 response when the client's copy (If-None-Match) is still current
+
+    Parameters:
+        - request: the request
+        - name: the name of the lookup table
+
+    Return:
+        - the response
+    """
+    rows, etag = lookup_cache.get(name)
+
+    return _cached_response(request, rows, etag)
+
+def lookups_response(request: Request):
+    """
+    Builds the response of the route returning every lookup table at once (with their version),
+    or an empty 304 response when the client's copy (If-None-Match) is still current
+
+    Parameters:
+        - request: the request
+
+    Return:
+        - the response
+    """
+    tables, version = lookup_cache.get_all()
+
+    return _cached_response(request, {**tables, "version": version}, f'"{version}"')
+
+def _cached_response(request: Request, content, etag: str):
+    """
+    Builds a JSON response with its ETag and Cache-Control headers (an empty 304 response
+    when the request's If-None-Match header holds the ETag)
+
+    Parameters:
+        - request: the request
+        - content: the content of the response
+        - etag: the ETag of the content
+
+    Return:
+        - the response
+    """
+    headers = {"ETag": etag, "Cache-Control": f"max-age={LOOKUP_CACHE_MAX_AGE}"}
+
+    if etag in [value.strip() for value in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    return JSONResponse(content=content, headers=headers)
+
+#######################
+# Invalidation events
+#######################
+def _record_write(mapper, connection, target):
+    """
+    Records that a lookup table has been written to by the current session (flush)
+    """
+    session = Session.object_session(target)
+    if session is not None:
+        name = next(name for name, (model, _, _) in LOOKUP_TABLES.items() if isinstance(target, model))
+        session.info.setdefault("lookup_tables_written", set()).add(name)
+
+for model, _, _ in LOOKUP_TABLES.values():
+    for event_name in ("after_insert", "after_update", "after_delete"):
+        event.listen(model, event_name, _record_write)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_written_tables(session):
+    """
+    Invalidates the lookup tables written to once the transaction is committed
+    """
+    names = session.info.pop("lookup_tables_written", None)
+    if names:
+        lookup_cache.invalidate(names)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_written_tables(session):
+    """
+    Forgets the writes to the lookup tables of a rolled back transaction
+    """
+    session.info.pop("lookup_tables_written", None)
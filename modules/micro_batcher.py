@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import time
+import numpy as np
+
+class QueueFullError(Exception):
+    """
+    Raised when the micro-batcher's queue has reached its maximum depth
+    """
+
+class Histogram:
+    """
+    A cumulative histogram with fixed upper bounds (Prometheus-like)
+    """
+
+    def __init__(self, bounds):
+        """
+        Parameters:
+            - bounds: the upper bounds of the buckets, in increasing order
+        """
+        self.bounds = sorted(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        """
+        Records a value in the histogram
+
+        Parameters:
+            - value: the observed value
+        """
+        index = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                index = i
+                break
+
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self):
+        """
+        Gets the content of the histogram
+
+        Return:
+            - a dictionary with the cumulative count of each bucket, the total count, the sum and the mean
+        """
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            buckets[f"le_{bound:g}"] = cumulative
+        buckets["le_inf"] = self.count
+
+        return {
+            "buckets": buckets,
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else None
+        }
+
+class MicroBatcher:
+    """
+    Collects the rows submitted concurrently within a short window and predicts them as one matrix
+    """
+
+    def __init__(self, predict_batch, max_batch_size: int = 64, max_wait_ms: float = 2.0, max_queue_size: int = 1000, max_in_flight: int = 1):
+        """
+        Parameters:
+            - predict_batch: a coroutine function taking a 2D array of features and returning one result per row
+            - max_batch_size: the maximum number of rows predicted at once
+            - max_wait_ms: the maximum time (in milliseconds) to wait for other rows after the first one
+            - max_queue_size: the maximum number of rows waiting to be predicted
+            - max_in_flight: the maximum number of batches predicted at the same time
+        """
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue_size = max_queue_size
+        self.max_in_flight = max_in_flight
+        self.batch_size_histogram = Histogram([1, 2, 4, 8, 16, 32, 64, 128, 256])
+        self.queue_wait_histogram = Histogram([0.5, 1, 2, 5, 10, 25, 50, 100, 250])
+        self.rejected = 0
+        self._queue = None
+        self._task = None
+        self._loop = None
+        self._in_flight = None
+        self._pending = set()
+
+    def _ensure_started(self):
+        """
+        Starts the batching task on the running event loop (restarting it if the loop changed)
+        """
+        loop = asyncio.get_running_loop()
+
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+            self._task = loop.create_task(self._run())
+
+    async def submit(self, row):
+        """
+        Submits a row of features and waits for its prediction
+
+        Parameters:
+            - row: a 1D array of encoded features
+
+        Return:
+            - the result of predict_batch for this row
+        """
+        self._ensure_started()
+
+        future = self._loop.create_future()
+        try:
+            self._queue.put_nowait((row, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(f"Prediction queue is full ({self.max_queue_size} waiting rows)")
+
+        return await future
+
+    async def _collect(self):
+        """
+        Waits for a first row, then collects the rows arriving within the window (or until the batch is full)
+
+        Return:
+            - the list of collected (row, future, submission time) items
+        """
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - self._loop.time()
+
+            try:
+                if timeout <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+
+        return batch
+
+    async def _predict(self, batch):
+        """
+        Predicts a batch as one matrix and fans the results back to the awaiting requests
+
+        Parameters:
+            - batch: the list of collected (row, future, submission time) items
+        """
+        try:
+            predictions = await self.predict_batch(np.vstack([row for row, _, _ in batch]))
+        except Exception as e:
+            logging.error(f"Error predicting batch: {str(e)}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._in_flight.release()
+
+        for (_, future, _), prediction in zip(batch, predictions):
+            # The request may have been cancelled in the meantime
+            if not future.done():
+                future.set_result(prediction)
+
+    async def _run(self):
+        """
+        Batching loop: collects rows and dispatches them as batches (at most max_in_flight at a time)
+        """
+        while True:
+            await self._in_flight.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._in_flight.release()
+                raise
+
+            started = time.perf_counter()
+            for _, _, submitted in batch:
+                self.queue_wait_histogram.observe((started - submitted) * 1000)
+            self.batch_size_histogram.observe(len(batch))
+
+            task = self._loop.create_task(self._predict(batch))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def stop(self):
+        """
+        Stops the batching task
+        """
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+            # The task can only be awaited from its own event loop
+            if self._loop is asyncio.get_running_loop():
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+
+        self._task = None
+
+    def status(self):
+        """
+        Gets the settings and the metrics of the micro-batcher
+
+        Return:
+            - a dictionary with the settings, the queue depth and the batch size and queue wait (ms) histograms
+        """
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_queue_size": self.max_queue_size,
+            "max_in_flight": self.max_in_flight,
+            "batches_in_flight": len(self._pending),
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "rejected": self.rejected,
+            "batch_size": self.batch_size_histogram.snapshot(),
+            "queue_wait_ms": self.queue_wait_histogram.snapshot()
+        }
@@ -0,0 +1,289 @@
+from sqlalchemy import Index, String, bindparam, func, inspect, or_, select, type_coerce, update
+from sqlalchemy.orm import Session
+from models.app_user import AppUser
+from models.patient import Patient
+from cryptography.fernet import InvalidToken
+from data.sql_requests import get_reset_sequences_query
+from modules.encryption import decrypt_value, fernet, parse_token, raw_token_param
+from modules.passwords import hash_password, is_legacy_password
+import argparse
+import logging
+import os
+import time
+
+# Number of rows rewritten (and committed) per batch by the migrations
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "1000"))
+
+# Encrypted columns of each table
+ENCRYPTED_COLUMNS = {
+    Patient: ["last_name", "first_name", "patient_email"]
+}
+
+def _checked_token(value):
+    """
+    Gets the raw token of a stored legacy value, once checked that it decrypts with the key
+
+    Parameters:
+        - value: the stored value (a "b'gAAAA...'" literal, or None)
+
+    Return:
+        - the token bytes (or None)
+    """
+    if value is None:
+        return None
+
+    token = parse_token(value)
+    fernet.decrypt(token)
+
+    return token
+
+def migrate_encrypted_table(db: Session, model, columns: list[str], batch_size: int = MIGRATION_BATCH_SIZE):
+    """
+    Rewrites the legacy "b'gAAAA...'" text literals of a table's encrypted columns as raw token bytes,
+    batch by batch (keyset on the primary key, one commit per batch, so the API can keep serving
+    both formats in the meantime); a row is only rewritten when all its literals decrypt with the key
+
+    Parameters:
+        - db: the database in which to work
+        - model: the mapped class of the table
+        - columns: the names of the encrypted columns
+        - batch_size: the number of rows rewritten at a time
+
+    Return:
+        - the number of rewritten rows
+    """
+    # Only SQLite's loosely typed columns may hold text in a BLOB column
+    if db.get_bind().dialect.name != "sqlite":
+        return 0
+
+    table = model.__table__
+    primary_key = table.primary_key.columns.values()[0]
+
+    # The stored values are read as they are (no decryption, no conversion)
+    query = (
+        select(primary_key, *[type_coerce(table.c[column], String).label(column) for column in columns])
+        .where(or_(*[func.typeof(table.c[column]) == "text" for column in columns]))
+        .order_by(primary_key)
+        .limit(batch_size)
+    )
+    statement = (
+        update(table)
+        .where(primary_key == bindparam("_id"))
+        .values({column: raw_token_param(f"_{column}") for column in columns})
+    )
+
+    last_id = None
+    migrated_rows = 0
+
+    while True:
+        batch_query = query if last_id is None else query.where(primary_key > last_id)
+        rows = db.execute(batch_query).all()
+        if not rows:
+            break
+
+        last_id = rows[-1][0]
+        parameters = []
+        for row in rows:
+            try:
+                parameters.append({"_id": row[0], **{f"_{column}": _checked_token(value) for column, value in zip(columns, row[1:])}})
+            except InvalidToken:
+                logging.error(f"Error migrating {table.name} row {row[0]}: a value is not a token of the current key, left as it is")
+
+        if not parameters:
+            continue
+
+        try:
+            db.execute(statement, parameters)
+            db.commit()
+        except Exception as e:
+            logging.error(f"Error migrating {table.name}: {str(e)}")
+            db.rollback()
+            raise
+
+        migrated_rows += len(parameters)
+
+    return migrated_rows
+
+def migrate_encrypted_columns(db: Session, batch_size: int = MIGRATION_BATCH_SIZE):
+    """
+    Rewrites every legacy encrypted value of the database as raw token bytes
+
+    Parameters:
+        - db: the database in which to work
+        - batch_size: the number of rows rewritten at a time
+
+    Return:
+        - a dictionary of statistics about the migration
+    """
+    start = time.perf_counter()
+
+    migrated_rows = {
+        model.__tablename__: migrate_encrypted_table(db, model, columns, batch_size)
+        for model, columns in ENCRYPTED_COLUMNS.items()
+    }
+
+    stats = {
+        "migrated_rows": migrated_rows,
+        "duration_seconds": time.perf_counter() - start
+    }
+
+    logging.info(f"Encrypted columns migration done: {stats}")
+
+    return stats
+
+def migrate_password_hashes(db: Session, batch_size: int = MIGRATION_BATCH_SIZE):
+    """
+    Replaces the legacy Fernet-encrypted passwords by PBKDF2 hashes, batch by batch (the users who log in
+    in the meantime are upgraded by the authentication route)
+
+    Parameters:
+        - db: the database in which to work
+        - batch_size: the number of users rewritten at a time
+
+    Return:
+        - the number of rewritten users
+    """
+    password = type_coerce(AppUser.password, String)
+
+    # The encrypted passwords stored as raw bytes can only be found on SQLite (the other databases keep them as text)
+    is_legacy = password.like("b'gAAAA%")
+    if db.get_bind().dialect.name == "sqlite":
+        is_legacy = or_(func.typeof(AppUser.password) == "blob", is_legacy)
+
+    query = (
+        select(AppUser.id_user, password)
+        .where(is_legacy)
+        .order_by(AppUser.id_user)
+        .limit(batch_size)
+    )
+    statement = update(AppUser.__table__).where(AppUser.id_user == bindparam("_id")).values(password=bindparam("_password"))
+
+    last_id = None
+    migrated_rows = 0
+
+    while True:
+        batch_query = query if last_id is None else query.where(AppUser.id_user > last_id)
+        rows = db.execute(batch_query).all()
+        if not rows:
+            break
+
+        last_id = rows[-1][0]
+        parameters = [
+            {"_id": id_user, "_password": hash_password(decrypt_value(stored))}
+            for id_user, stored in rows
+            if is_legacy_password(stored)
+        ]
+
+        try:
+            if parameters:
+                db.execute(statement, parameters)
+            db.commit()
+        except Exception as e:
+            logging.error(f"Error migrating passwords: {str(e)}")
+            db.rollback()
+            raise
+
+        migrated_rows += len(parameters)
+
+    return migrated_rows
+
+def create_username_index(db: Session):
+    """
+    Creates the unique index on app_user.username, unless the username is already unique-indexed
+
+    Parameters:
+        - db: the database in which to work
+
+    Return:
+        - True if the index has been created
+    """
+    inspector = inspect(db.get_bind())
+
+    unique_columns = [index["column_names"] for index in inspector.get_indexes("app_user") if index["unique"]]
+    unique_columns += [constraint["column_names"] for constraint in inspector.get_unique_constraints("app_user")]
+    if ["username"] in unique_columns:
+        return False
+
+    Index("ix_app_user_username", AppUser.username, unique=True).create(db.get_bind(), checkfirst=True)
+    db.commit()
+
+    return True
+
+def create_missing_indexes(db: Session, models=(Patient, AppUser)):
+    """
+    Creates the indexes declared on the models that an existing database does not have yet (create_all only
+    creates the missing tables); an index is skipped when the database already indexes the same columns
+
+    Parameters:
+        - db: the database in which to work
+        - models: the mapped classes whose indexes are created
+
+    Return:
+        - the names of the created indexes
+    """
+    bind = db.get_bind()
+    inspector = inspect(bind)
+    created_indexes = []
+
+    for model in models:
+        indexed_columns = [index["column_names"] for index in inspector.get_indexes(model.__tablename__)]
+        indexed_columns += [constraint["column_names"] for constraint in inspector.get_unique_constraints(model.__tablename__)]
+
+        for index in sorted(model.__table__.indexes, key=lambda index: index.name):
+            if [column.name for column in index.columns] not in indexed_columns:
+                index.create(bind, checkfirst=True)
+                created_indexes.append(index.name)
+
+    db.commit()
+
+    if created_indexes:
+        logging.info(f"Indexes created: {created_indexes}")
+
+    return created_indexes
+
+def reset_sequences(db: Session):
+    """
+    Moves the primary key sequences past the stored ids (after rows were seeded with explicit ids,
+    the next generated ids would otherwise collide with them; nothing to do on SQLite)
+
+    Parameters:
+        - db: the database in which to work
+
+    Return:
+        - True if the sequences have been reset, False if the database has none
+    """
+    query = get_reset_sequences_query(db.get_bind().dialect.name)
+
+    if not query:
+        return False
+
+    db.connection().exec_driver_sql(query)
+    db.commit()
+
+    logging.info("Primary key sequences reset")
+
+    return True
+
+if __name__ == "__main__":
+    from modules.database import session_local
+
+    parser = argparse.ArgumentParser(description="Migrates the legacy encrypted values and passwords, creates the missing indexes and resets the primary key sequences")
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE, help="number of rows rewritten at a time")
+    args = parser.parse_args()
+
+    db = session_local()
+    try:
+        stats = migrate_encrypted_columns(db, args.batch_size)
+        migrated_passwords = migrate_password_hashes(db, args.batch_size)
+        index_created = create_username_index(db)
+        created_indexes = create_missing_indexes(db)
+        sequences_reset = reset_sequences(db)
+    finally:
+        db.close()
+
+    for table_name, rows in stats["migrated_rows"].items():
+        print(f"{table_name}: {rows} rows migrated")
+    print(f"app_user: {migrated_passwords} passwords hashed")
+    print(f"app_user: username index {'created' if index_created else 'already present'}")
+    print(f"indexes created: {', '.join(created_indexes) if created_indexes else 'none'}")
+    print(f"primary key sequences: {'reset' if sequences_reset else 'none'}")
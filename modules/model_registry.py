@@ -0,0 +1,192 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from modules.compiled_model import CompiledGradientBoosting
+from modules.feature_encoding import FeatureEncoder
+
+# Path of the trained model (can be overridden with the MODEL_PATH environment variable):
+# a joblib scikit-learn model, or a compiled .npz model served without scikit-learn
+MODEL_PATH = os.getenv("MODEL_PATH", "data/gradient_boosting_model.joblib")
+
+# Minimum number of seconds between two checks of the model file on disk
+MODEL_CHECK_INTERVAL = float(os.getenv("MODEL_CHECK_INTERVAL", "5"))
+
+class ModelRegistry:
+    """
+    Keeps a single resident copy of the prediction model per worker, and reloads it
+    only when the model file changes on disk
+    """
+
+    def __init__(self, model_path: str, check_interval: float = MODEL_CHECK_INTERVAL):
+        """
+        Parameters:
+            - model_path: the path of the model file (.joblib or compiled .npz)
+            - check_interval: the minimum number of seconds between two checks of the model file
+        """
+        self.model_path = model_path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._model = None
+        self._encoder = None
+        self._version = None
+        self._mtime = None
+        self._loaded_at = None
+        self._load_duration = None
+        self._load_count = 0
+        self._last_check = 0.0
+
+    def _file_hash(self):
+        """
+        Computes the SHA-256 hash of the model file (used as the model version)
+
+        Return:
+            - the hexadecimal digest of the model file
+        """
+        sha256 = hashlib.sha256()
+
+        with open(self.model_path, "rb") as model_file:
+            for chunk in iter(lambda: model_file.read(1024 * 1024), b""):
+                sha256.update(chunk)
+
+        return sha256.hexdigest()
+
+    def load(self):
+        """
+        Loads (or reloads) the model from disk
+
+        Return:
+            - the loaded model
+        """
+        with self._lock:
+            start = time.perf_counter()
+            mtime = os.path.getmtime(self.model_path)
+            version = self._file_hash()
+
+            # The file has been touched but its content has not changed: no need to reload
+            if self._model is not None and version == self._version:
+                self._mtime = mtime
+                return self._model
+
+            if self.model_path.endswith(".npz"):
+                model = CompiledGradientBoosting.load(self.model_path)
+            else:
+                # Only imported when needed: unpickling the model imports scikit-learn
+                import joblib
+                model = joblib.load(self.model_path)
+
+            self._model = model
+            self._encoder = FeatureEncoder.from_model(model)
+            self._version = version
+            self._mtime = mtime
+            self._loaded_at = time.time()
+            self._load_duration = time.perf_counter() - start
+            self._load_count += 1
+            self._last_check = time.monotonic()
+
+            logging.info(f"Model loaded from {self.model_path} (version {version[:12]}) in {self._load_duration:.3f}s")
+
+            return model
+
+    def reload_if_changed(self):
+        """
+        Reloads the model if the file's modification time changed since the last load
+        (checked at most once every check_interval seconds)
+
+        Return:
+            - True if the model has been reloaded, False otherwise
+        """
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+
+        try:
+            mtime = os.path.getmtime(self.model_path)
+        except OSError as e:
+            logging.error(f"Error checking model file: {str(e)}")
+            return False
+
+        if mtime == self._mtime:
+            return False
+
+        previous_version = self._version
+
+        try:
+            self.load()
+        except Exception as e:
+            # The file may be half-written (non-atomic deploy): keep serving the resident model,
+            # and only retry once the file changes again
+            logging.error(f"Error reloading model, keeping version {str(previous_version)[:12]}: {str(e)}")
+            self._mtime = mtime
+            return False
+
+        return self._version != previous_version
+
+    def get_model(self):
+        """
+        Gets the resident model, loading it on first use and reloading it if the file changed
+
+        Return:
+            - the loaded model
+        """
+        if self._model is None:
+            return self.load()
+
+        self.reload_if_changed()
+
+        return self._model
+
+    def get_versioned_model(self):
+        """
+        Gets the resident model together with its version (read at once, so that a reload
+        in between cannot pair a model with another model's version)
+
+        Return:
+            - the loaded model and its version
+        """
+        self.get_model()
+
+        with self._lock:
+            return self._model, self._version
+
+    def get_encoder(self):
+        """
+        Gets the feature encoder matching the resident model's feature order
+
+        Return:
+            - the feature encoder
+        """
+        self.get_model()
+
+        return self._encoder
+
+    @property
+    def version(self):
+        """
+        The version (SHA-256 hash of the file) of the resident model
+        """
+        return self._version
+
+    def status(self):
+        """
+        Gets the status of the resident model
+
+        Return:
+            - a dictionary describing the resident model
+        """
+        return {
+            "model_path": self.model_path,
+            "loaded": self._model is not None,
+            "model_type": type(self._model).__name__ if self._model is not None else None,
+            "model_version": self._version,
+            "file_mtime": self._mtime,
+            "loaded_at": self._loaded_at,
+            "load_duration_seconds": self._load_duration,
+            "load_count": self._load_count,
+            "worker_pid": os.getpid()
+        }
+
+# Registry shared by every request of the worker
+model_registry = ModelRegistry(MODEL_PATH)
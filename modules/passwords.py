@@ -0,0 +1,114 @@
+from functools import lru_cache
+from modules.encryption import LEGACY_TOKEN_PATTERN, decrypt_value
+import base64
+import hashlib
+import hmac
+import os
+
+# Number of PBKDF2 iterations of the new password hashes (the older hashes are upgraded at login)
+PASSWORD_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", "600000"))
+
+# Prefix of the password hashes
+PASSWORD_HASH_ALGORITHM = "pbkdf2_sha256"
+
+def hash_password(password: str, iterations: int = PASSWORD_HASH_ITERATIONS):
+    """
+    Hashes a password with PBKDF2-HMAC-SHA256 and a random salt
+
+    Parameters:
+        - password: the password (as sent by the frontend: the SHA-256 hex digest of the typed password)
+        - iterations: the number of PBKDF2 iterations
+
+    Return:
+        - the hash, formatted as "pbkdf2_sha256$<iterations>$<salt>$<digest>"
+    """
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+
+    return "$".join([
+        PASSWORD_HASH_ALGORITHM,
+        str(iterations),
+        base64.b64encode(salt).decode(),
+        base64.b64encode(digest).decode()
+    ])
+
+def is_legacy_password(stored):
+    """
+    Tells whether a stored password is a legacy Fernet token (instead of a PBKDF2 hash)
+
+    Parameters:
+        - stored: the stored password
+
+    Return:
+        - True for the raw tokens and the "b'gAAAA...'" literals
+    """
+    return isinstance(stored, (bytes, bytearray, memoryview)) or bool(LEGACY_TOKEN_PATTERN.match(stored))
+
+def to_password_hash(password):
+    """
+    Gets the hash to store for a password received from a form
+
+    Parameters:
+        - password: the SHA-256 hex digest of the password (the encrypted token literals of the
+          older clients are refused)
+
+    Return:
+        - the PBKDF2 hash
+    """
+    if is_legacy_password(password):
+        raise ValueError("Invalid password: expected the SHA-256 digest of the password, not an encrypted token")
+
+    return hash_password(password)
+
+def verify_password(password: str, stored):
+    """
+    Checks a password against the stored one (in constant time)
+
+    Parameters:
+        - password: the SHA-256 hex digest of the typed password
+        - stored: the stored PBKDF2 hash (or legacy Fernet token)
+
+    Return:
+        - True if the password matches
+    """
+    if is_legacy_password(stored):
+        return hmac.compare_digest(decrypt_value(stored).encode(), password.encode())
+
+    try:
+        algorithm, iterations, salt, digest = stored.split("$")
+        if algorithm != PASSWORD_HASH_ALGORITHM:
+            return False
+
+        computed = hashlib.pbkdf2_hmac("sha256", password.encode(), base64.b64decode(salt), int(iterations))
+    except ValueError:
+        return False
+
+    return hmac.compare_digest(computed, base64.b64decode(digest))
+
+def needs_rehash(stored):
+    """
+    Tells whether a stored password should be hashed again (legacy token or fewer iterations than the current setting)
+
+    Parameters:
+        - stored: the stored password
+
+    Return:
+        - True if the password should be upgraded at the next successful login
+    """
+    if is_legacy_password(stored):
+        return True
+
+    parts = stored.split("$")
+
+    return len(parts) != 4 or parts[0] != PASSWORD_HASH_ALGORITHM or not parts[1].isdigit() or int(parts[1]) < PASSWORD_HASH_ITERATIONS
+
+@lru_cache(maxsize=1)
+def dummy_password_hash():
+    """
+    Gets the hash checked when the username does not exist (so that unknown and known usernames
+    take as long to be rejected)
+
+    Return:
+        - a PBKDF2 hash of a random password
+    """
+    return hash_password(os.urandom(32).hex())
@@ -0,0 +1,135 @@
+from collections import OrderedDict
+import threading
+import time
+
+class PredictionCache:
+    """
+    A least recently used cache of predictions, bounded in size and in time, keyed on the
+    encoded feature vector and emptied whenever the model version changes
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 3600):
+        """
+        Parameters:
+            - max_size: the maximum number of cached predictions (0 disables the cache)
+            - ttl: the number of seconds a prediction stays valid
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(features):
+        """
+        Builds the cache key of a row of encoded features
+
+        Parameters:
+            - features: the array of encoded features
+
+        Return:
+            - the key (the raw bytes of the float64 features)
+        """
+        return features.tobytes()
+
+    def _check_version(self, version):
+        """
+        Empties the cache if the model version changed (must be called with the lock held)
+
+        Parameters:
+            - version: the current model version
+        """
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key, version):
+        """
+        Gets a cached prediction
+
+        Parameters:
+            - key: the cache key
+            - version: the current model version
+
+        Return:
+            - the cached prediction, or None if it is missing or expired
+        """
+        if self.max_size <= 0:
+            return None
+
+        with self._lock:
+            self._check_version(version)
+
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            prediction, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return prediction
+
+    def set(self, key, prediction, version):
+        """
+        Caches a prediction
+
+        Parameters:
+            - key: the cache key
+            - prediction: the predicted charges
+            - version: the version of the model that made the prediction
+        """
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._check_version(version)
+
+            self._entries[key] = (prediction, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Empties the cache
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def status(self):
+        """
+        Gets the settings and the counters of the cache
+
+        Return:
+            - a dictionary with the size, hits, misses, evictions, expirations and invalidations
+        """
+        return {
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "size": len(self._entries),
+            "model_version": self._version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / (self.hits + self.misses) if self.hits + self.misses else None,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
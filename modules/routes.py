@@ -1,186 +1,444 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session, joinedload
-from models.patient import Patient, PatientResponse, PatientCreate, PatientUpdate, create_patient, get_patient, update_patient, delete_patient
-from models.region import get_regions, RegionResponse
-from models.smoker import get_smoker_statuses, SmokerResponse
-from models.sex import get_sexes, SexResponse
-from modules.database import get_db
-import os
-from cryptography.fernet import Fernet
-from dotenv import load_dotenv
-import ast
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.patient import Patient, PatientResponse, PatientCreate, PatientUpdate, PatientFilter, PatientSortColumn, PatientSelection, PatientBulkUpdate, create_patient_async, get_patient_async, update_patient_async, delete_patient_async, update_patients_async, delete_patients_async, filter_patients, paginate_patients, encode_patient_cursor
+from models.region import Region, RegionResponse
+from models.smoker import Smoker, SmokerResponse
+from models.sex import Sex, SexResponse
+from modules.bulk_import import IMPORT_CHUNK_SIZE, IMPORT_FORMATS, import_patient_file
+from modules.database import get_async_db, get_async_read_db, mark_client_write, session_local
+from modules.encryption import decrypt_fields, raw_token
+from modules.lookup_cache import lookup_response, lookups_response
+from typing import Literal, Optional
+import asyncio
+import csv
+import io
+import json
 import logging
+import os
+import tempfile
 
 router = APIRouter()
 
-# Loading .env file (only works locally)
-load_dotenv()
-
-# Retrieving the fernet key from the envrionment variable
-key = os.getenv("FERNET_KEY")
-fernet = Fernet(key)
-if not fernet:
-    logging.error("Error fetching FERNET_KEY")
-    raise ValueError("FERNET_KEY environment variable is not set.")
+# Default and maximum number of patients per page
+PATIENT_PAGE_SIZE = int(os.getenv("PATIENT_PAGE_SIZE", "100"))
+PATIENT_MAX_PAGE_SIZE = int(os.getenv("PATIENT_MAX_PAGE_SIZE", "1000"))
+
+# Number of rows fetched (and written) at a time by the patient export
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+# Maximum number of patients inserted at a time by the bulk import
+IMPORT_MAX_CHUNK_SIZE = int(os.getenv("IMPORT_MAX_CHUNK_SIZE", "50000"))
+
+# Size above which an uploaded import file is spooled to disk instead of memory
+IMPORT_SPOOL_SIZE = int(os.getenv("IMPORT_SPOOL_SIZE", str(16 * 1024 * 1024)))
+
+# Import formats by content type of the request body
+IMPORT_CONTENT_TYPES = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv"
+}
+
+# Columns of the patient list and export (the encrypted ones are read as raw tokens, decrypted in batches)
+EXPORT_COLUMNS = {
+    "id_patient": Patient.id_patient,
+    "last_name": raw_token(Patient.last_name),
+    "first_name": raw_token(Patient.first_name),
+    "age": Patient.age,
+    "bmi": Patient.bmi,
+    "patient_email": raw_token(Patient.patient_email),
+    "children": Patient.children,
+    "charges": Patient.charges,
+    "region": Region.region_name,
+    "smoker": Smoker.is_smoker,
+    "sex": Sex.sex_label
+}
+
+# Encrypted columns (only decrypted when exported)
+ENCRYPTED_COLUMNS = ["last_name", "first_name", "patient_email"]
 
 ###########
 # Routes
 ###########
 @router.get("/patients/", response_model=list[PatientResponse])
-def get_patients(db: Session = Depends(get_db)):
+async def get_patients(
+        response: Response,
+        filters: PatientFilter = Depends(),
+        limit: int = Query(PATIENT_PAGE_SIZE, ge=1, le=PATIENT_MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        sort_by: PatientSortColumn = "id_patient",
+        order: Literal["asc", "desc"] = "asc",
+        db: AsyncSession = Depends(get_async_read_db)
+    ):
     """
-    Route to get the patients list
+    Route to get one page of the patients list (the cursor of the next page is sent
+    in the X-Next-Cursor header when there are more patients)
 
     Parameters:
-        - db: the current database session
+        - response: the response (to set the X-Next-Cursor header)
+        - filters: the age, BMI and charges ranges, and the region, smoker and sex IDs to filter on
+        - limit: the maximum number of patients of the page
+        - cursor: the cursor of the page (from the X-Next-Cursor header of the previous page)
+        - sort_by: the column to sort the patients by
+        - order: the sort order ("asc" or "desc")
+        - db: the current async read-only database session (on a read replica when there are some)
     
     Return:
-        - patient_list: a list of all patients' data
+        - patient_list: a list of the page's patients' data
     """
     try:
-        patients = db.query(Patient).options(
-            joinedload(Patient.region),
-            joinedload(Patient.smoker),
-            joinedload(Patient.sex)
-        ).all()
+        query = (
+            select(*[column.label(name) for name, column in EXPORT_COLUMNS.items()])
+            .select_from(Patient)
+            .outerjoin(Region, Patient.id_region == Region.id_region)
+            .outerjoin(Smoker, Patient.id_smoker == Smoker.id_smoker)
+            .outerjoin(Sex, Patient.id_sex == Sex.id_sex)
+        )
+        query = filter_patients(query, filters)
+
+        # Fetching one more patient to know whether there is a next page
+        patients = (await db.execute(paginate_patients(query, sort_by, order, cursor, limit + 1))).all()
+
+        if len(patients) > limit:
+            patients = patients[:limit]
+            response.headers["X-Next-Cursor"] = encode_patient_cursor(patients[-1], sort_by)
 
         patient_list = [
             {
-                "id_patient": a_patient.id_patient,
-                "last_name": fernet.decrypt(ast.literal_eval(a_patient.last_name)).decode(),
-                "first_name": fernet.decrypt(ast.literal_eval(a_patient.first_name)).decode(),
-                "age": a_patient.age,
-                "bmi": a_patient.bmi,
-                "patient_email": fernet.decrypt(ast.literal_eval(a_patient.patient_email)).decode(),
-                "children": a_patient.children,
-                "charges": a_patient.charges,
-                "region": a_patient.region.region_name if a_patient.region else "Unknown",
-                "smoker": a_patient.smoker.is_smoker if a_patient.smoker else "Unknown",
-                "sex": a_patient.sex.sex_label if a_patient.sex else "Unknown"
+                **{name: getattr(a_patient, name) for name in EXPORT_COLUMNS},
+                "region": a_patient.region or "Unknown",
+                "smoker": a_patient.smoker or "Unknown",
+                "sex": a_patient.sex or "Unknown"
             }
             for a_patient in patients
         ]
 
+        # Decrypting the personal data of the whole page in one batch (outside of the event loop)
+        await asyncio.to_thread(decrypt_fields, patient_list, ENCRYPTED_COLUMNS)
+
         return patient_list
+    except ValueError as e:
+        logging.error(f"Invalid patients query: {str(e)}")
+        raise HTTPException(status_code=422, detail=f"Invalid patients query {str(e)}")
     except Exception as e:
         logging.error(f"Error fetching patients: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching patients {str(e)}")
     
-@router.get("/regions/", response_model=list[RegionResponse])
-def get_all_regions(db: Session = Depends(get_db)):
+def export_patient_rows(columns: list[str], filters: PatientFilter, export_format: str):
     """
-    Route to get the regions list
+    Streams the patients' data chunk by chunk, with a server-side cursor and its own database session
 
     Parameters:
-        - db: the current database session
+        - columns: the names of the exported columns
+        - filters: the filters to apply to the patients
+        - export_format: "ndjson" or "csv"
 
     Return:
-        - region_list: a list of all regions' data
+        - a generator of NDJSON or CSV text chunks
     """
+    db = session_local()
+
     try:
-        regions = get_regions(db)
+        query = (
+            select(*[EXPORT_COLUMNS[column].label(column) for column in columns])
+            .select_from(Patient)
+            .outerjoin(Region, Patient.id_region == Region.id_region)
+            .outerjoin(Smoker, Patient.id_smoker == Smoker.id_smoker)
+            .outerjoin(Sex, Patient.id_sex == Sex.id_sex)
+            .order_by(Patient.id_patient)
+            .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+        query = filter_patients(query, filters)
+
+        if export_format == "csv":
+            yield ",".join(columns) + "\r\n"
+
+        for partition in db.execute(query).partitions():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer) if export_format == "csv" else None
+
+            rows = [dict(zip(columns, row)) for row in partition]
+
+            # Decrypting the personal data of the whole chunk in one batch
+            encrypted_columns = [column for column in columns if column in ENCRYPTED_COLUMNS]
+            if encrypted_columns:
+                decrypt_fields(rows, encrypted_columns)
+
+            for row in rows:
+                for column in ("bmi", "charges"):
+                    if row.get(column) is not None:
+                        row[column] = float(row[column])
+
+                if writer is not None:
+                    writer.writerow(row.values())
+                else:
+                    buffer.write(json.dumps(row) + "\n")
+
+            yield buffer.getvalue()
+    except Exception as e:
+        logging.error(f"Error exporting patients: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+@router.get("/export/")
+def export_patients(
+        export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+        columns: Optional[str] = None,
+        filters: PatientFilter = Depends()
+    ):
+    """
+    Route to export the patients' data as a stream (constant memory whatever the table size)
 
-        region_list = [
-            {
-                "id_region": region.id_region,
-                "region_name": region.region_name
-            }
-            for region in regions
-        ]
+    Parameters:
+        - export_format: the format of the export ("ndjson" or "csv")
+        - columns: the comma-separated names of the exported columns (all by default;
+          leaving out last_name, first_name and patient_email skips their decryption)
+        - filters: the age, BMI and charges ranges, and the region, smoker and sex IDs to filter on
+
+    Return:
+        - the streamed NDJSON or CSV export
+    """
+    selected_columns = [column.strip() for column in columns.split(",") if column.strip()] if columns else list(EXPORT_COLUMNS)
+
+    unknown_columns = [column for column in selected_columns if column not in EXPORT_COLUMNS]
+    if unknown_columns or not selected_columns:
+        logging.error(f"Invalid export columns: {unknown_columns}")
+        raise HTTPException(status_code=422, detail=f"Invalid export columns {unknown_columns} (expected some of {list(EXPORT_COLUMNS)})")
+
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+
+    return StreamingResponse(
+        export_patient_rows(selected_columns, filters, export_format),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=patients.{export_format}"}
+    )
+
+@router.get("/regions/", response_model=list[RegionResponse])
+def get_all_regions(request: Request):
+    """
+    Route to get the regions list (from the in-process lookup cache, with ETag and Cache-Control headers)
+
+    Parameters:
+        - request: the request (to compare its If-None-Match header with the ETag)
 
-        return region_list
+    Return:
+        - a list of all regions' data (or an empty 304 response if the client's copy is current)
+    """
+    try:
+        return lookup_response(request, "regions")
     except Exception as e:
         logging.error(f"Error fetching regions: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching regions {str(e)}")
     
 @router.get("/smokers/", response_model=list[SmokerResponse])
-def get_all_smokers(db: Session = Depends(get_db)):
+def get_all_smokers(request: Request):
     """
-    Route to get the smoker statuses list
+    Route to get the smoker statuses list (from the in-process lookup cache, with ETag and Cache-Control headers)
 
     Parameters:
-        - db: the current database session
+        - request: the request (to compare its If-None-Match header with the ETag)
 
     Return:
-        - smoker_list: a list of all smoker statuses' data
+        - a list of all smoker statuses' data (or an empty 304 response if the client's copy is current)
     """
     try:
-        smokers = get_smoker_statuses(db)
-
-        smoker_list = [
-            {
-                "id_smoker": smoker.id_smoker,
-                "is_smoker": smoker.is_smoker
-            }
-            for smoker in smokers
-        ]
-
-        return smoker_list
+        return lookup_response(request, "smokers")
     except Exception as e:
         logging.error(f"Error fetching smokers: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching smokers {str(e)}")
     
 @router.get("/sexes/", response_model=list[SexResponse])
-def get_all_sexes(db: Session = Depends(get_db)):
+def get_all_sexes(request: Request):
     """
-    Route to get the sexes list
+    Route to get the sexes list (from the in-process lookup cache, with ETag and Cache-Control headers)
 
     Parameters:
-        - db: the current database session
+        - request: the request (to compare its If-None-Match header with the ETag)
 
     Return:
-        - sex_list: a list of all sexes' data
+        - a list of all sexes' data (or an empty 304 response if the client's copy is current)
     """
     try:
-        sexes = get_sexes(db)
-
-        sex_list = [
-            {
-                "id_sex": sex.id_sex,
-                "sex_label": sex.sex_label
-            }
-            for sex in sexes
-        ]
-
-        return sex_list
+        return lookup_response(request, "sexes")
     except Exception as e:
         logging.error(f"Error fetching sexes: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching sexes {str(e)}")
     
-@router.post("/add_patient/")
-def add_patient(item: PatientCreate, db: Session = Depends(get_db)):
+@router.get("/lookups/", response_model=dict)
+def get_all_lookups(request: Request):
+    """
+    Route to get every lookup table (regions, smoker statuses, sexes and roles) in one round trip,
+    with a version hash of their content (also sent as the ETag)
+
+    Parameters:
+        - request: the request (to compare its If-None-Match header with the ETag)
+
+    Return:
+        - the lookup tables by name, and their version (or an empty 304 response if the client's copy is current)
+    """
+    try:
+        return lookups_response(request)
+    except Exception as e:
+        logging.error(f"Error fetching lookups: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching lookups {str(e)}")
+
+@router.post("/add_patient/", dependencies=[Depends(mark_client_write)])
+async def add_patient(item: PatientCreate, db: AsyncSession = Depends(get_async_db)):
     """
     Route to add a new patient into the database
 
     Parameters:
         - item: the new patient's data received from a form
-        - db: the current database session
+        - db: the current async database session
 
     Return:
         - a JSON response message confirming that the new patient has been added
     """
     try:
-        new_patient = create_patient(db, item)
+        new_patient = await create_patient_async(db, item)
 
         return JSONResponse(content={"response_message": "New patient added."})
     except Exception as e:
         logging.error(f"Error fetching patient data: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching patient data {str(e)}")
 
+@router.patch("/bulk/", response_model=dict, dependencies=[Depends(mark_client_write)])
+async def edit_patients(patient_data: PatientBulkUpdate, db: AsyncSession = Depends(get_async_db)):
+    """
+    Route to edit the selected patients at once (set-based UPDATE statements in a single transaction)
+
+    Parameters:
+        - patient_data: the IDs and/or the filters of the patients, and the new values (the missing ones are left unchanged)
+        - db: the current async database session
+
+    Return:
+        - the number of updated patients
+    """
+    try:
+        updated_rows = await update_patients_async(db, patient_data, patient_data.values)
+
+        return {"response_message": "Patients updated successfully.", "updated_rows": updated_rows}
+    except ValueError as e:
+        logging.error(f"Invalid patients update: {str(e)}")
+        raise HTTPException(status_code=422, detail=f"Invalid patients update {str(e)}")
+    except Exception as e:
+        logging.error(f"Error updating patients: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error updating patients {str(e)}")
+
+@router.delete("/bulk/", response_model=dict, dependencies=[Depends(mark_client_write)])
+async def delete_some_patients(selection: PatientSelection, db: AsyncSession = Depends(get_async_db)):
+    """
+    Route to delete the selected patients at once (set-based DELETE statements in a single transaction)
+
+    Parameters:
+        - selection: the IDs and/or the filters of the patients
+        - db: the current async database session
+
+    Return:
+        - the number of deleted patients
+    """
+    try:
+        deleted_rows = await delete_patients_async(db, selection)
+
+        return {"response_message": "Patients deleted successfully.", "deleted_rows": deleted_rows}
+    except ValueError as e:
+        logging.error(f"Invalid patients deletion: {str(e)}")
+        raise HTTPException(status_code=422, detail=f"Invalid patients deletion {str(e)}")
+    except Exception as e:
+        logging.error(f"Error deleting patients: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error deleting patients {str(e)}")
+
+def run_patient_import(file, import_format: str, chunk_size: int):
+    """
+    Imports the patients of a file with its own database session (run outside of the event loop)
+
+    Parameters:
+        - file: the binary file
+        - import_format: "json", "ndjson" or "csv"
+        - chunk_size: the number of patients inserted (and committed) at a time
+
+    Return:
+        - a dictionary of statistics about the import, with the row errors
+    """
+    db = session_local()
+
+    try:
+        return import_patient_file(db, file, import_format, chunk_size)
+    finally:
+        db.close()
+        file.close()
+
+@router.post("/bulk/", response_model=dict, dependencies=[Depends(mark_client_write)])
+async def import_patients(
+        request: Request,
+        import_format: Optional[Literal["json", "ndjson", "csv"]] = Query(None, alias="format"),
+        chunk_size: int = Query(IMPORT_CHUNK_SIZE, ge=1, le=IMPORT_MAX_CHUNK_SIZE)
+    ):
+    """
+    Route to import patients in bulk, from a JSON array, an NDJSON stream or a CSV file sent as the request body
+    or as a multipart "file" upload (the format is guessed from the content type or the file extension);
+    the patients are inserted chunk by chunk and the invalid rows are reported without aborting the import
+
+    Parameters:
+        - request: the request (its body or its uploaded file)
+        - import_format: the format of the data ("json", "ndjson" or "csv"; guessed by default)
+        - chunk_size: the number of patients inserted (and committed) at a time
+
+    Return:
+        - the numbers of received, imported and failed rows, and the row errors
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+
+    if content_type == "multipart/form-data":
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            logging.error("Import file missing")
+            raise HTTPException(status_code=422, detail="Import file missing (expected a \"file\" upload)")
+
+        file = upload.file
+        import_format = import_format or os.path.splitext(upload.filename or "")[1].lstrip(".").lower()
+    else:
+        # Spooling the body (to disk when it is large) instead of holding it in memory
+        file = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE)
+        async for chunk in request.stream():
+            file.write(chunk)
+        file.seek(0)
+
+        import_format = import_format or IMPORT_CONTENT_TYPES.get(content_type)
+
+    if import_format not in IMPORT_FORMATS:
+        file.close()
+        logging.error(f"Invalid import format: {import_format}")
+        raise HTTPException(status_code=422, detail=f"Invalid import format {import_format} (expected one of {list(IMPORT_FORMATS)})")
+
+    try:
+        return await asyncio.to_thread(run_patient_import, file, import_format, chunk_size)
+    except ValueError as e:
+        logging.error(f"Invalid import file: {str(e)}")
+        raise HTTPException(status_code=422, detail=f"Invalid import file {str(e)}")
+    except Exception as e:
+        logging.error(f"Error importing patients: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error importing patients {str(e)}")
+
 @router.get("/{id_patient}/", response_model=dict)
-def get_a_patient(id_patient: int, db: Session = Depends(get_db)):
+async def get_a_patient(id_patient: int, db: AsyncSession = Depends(get_async_db)):
     """
     Route to get a specific patient's data
 
     Parameters:
         - id_patient: the patient's ID
-        - db: the current database session
+        - db: the current async database session
     
     Return:
         - the new patient's data in JSON format
     """
-    patient = get_patient(db, id_patient)
+    patient = await get_patient_async(db, id_patient)
 
     if not patient:
         logging.error("Patient not found")
@@ -188,11 +446,11 @@ def get_a_patient(id_patient: int, db: Session = Depends(get_db)):
     
     return {
         "id_patient": patient.id_patient,
-        "last_name": fernet.decrypt(ast.literal_eval(patient.last_name)).decode(),
-        "first_name": fernet.decrypt(ast.literal_eval(patient.first_name)).decode(),
+        "last_name": patient.last_name,
+        "first_name": patient.first_name,
         "age": patient.age,
         "bmi": patient.bmi,
-        "patient_email": fernet.decrypt(ast.literal_eval(patient.patient_email)).decode(),
+        "patient_email": patient.patient_email,
         "children": patient.children,
         "charges": patient.charges,
         "region": patient.id_region,
@@ -200,47 +458,48 @@ def get_a_patient(id_patient: int, db: Session = Depends(get_db)):
         "sex": patient.id_sex
     }
 
-@router.put("/{id_patient}/edit/", response_model=PatientResponse)
-def edit_patient(id_patient: int, patient_data: PatientUpdate, db: Session = Depends(get_db)):
+@router.put("/{id_patient}/edit/", response_model=PatientResponse, dependencies=[Depends(mark_client_write)])
+async def edit_patient(id_patient: int, patient_data: PatientUpdate, db: AsyncSession = Depends(get_async_db)):
     """
-    Route to edit a specific patient's data
+    Route to edit a specific patient's data (a single UPDATE, without reading the patient first)
 
     Parameters:
         - id_patient: the patient's ID
         - patient_data: the updated patient's data received from a form
-        - db: the current database session
+        - db: the current async database session
 
     Return:
         - a JSON response message confirming the success of the update process
     """
-    patient = get_patient(db, id_patient)
+    try:
+        updated_rows = await update_patient_async(db, id_patient, patient_data)
+    except ValueError as e:
+        logging.error(f"Invalid patient data: {str(e)}")
+        raise HTTPException(status_code=422, detail=f"Invalid patient data {str(e)}")
+    except Exception as e:
+        logging.error(f"Error updating patient: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error updating patient {str(e)}")
 
-    if not patient:
+    if not updated_rows:
         logging.error("Patient not found")
         raise HTTPException(status_code=404, detail="Patient not found")
-    
-    update_patient(db, id_patient, patient_data)
 
     return JSONResponse(content={"response_message": "Patient updated successfully."})
 
-@router.delete("/{id_patient}/delete/", response_model=PatientResponse)
-def delete_a_patient(id_patient: int, db: Session = Depends(get_db)):
+@router.delete("/{id_patient}/delete/", response_model=PatientResponse, dependencies=[Depends(mark_client_write)])
+async def delete_a_patient(id_patient: int, db: AsyncSession = Depends(get_async_db)):
     """
-    Route to delete a specific patient from the database
+    Route to delete a specific patient from the database (a single DELETE, without reading the patient first)
 
     Parameters:
         - id_patient: the patient's ID
-        - db: the current database session
+        - db: the current async database session
 
     Return:
         - a JSON response message confirming the success of the deletion process
     """
-    patient = get_patient(db, id_patient)
-
-    if not patient:
+    if not await delete_patient_async(db, id_patient):
         logging.error("Patient not found")
         raise HTTPException(status_code=404, detail="Patient not found")
     
-    delete_patient(db, id_patient)
-    
     return JSONResponse(content={"response_message": "Patient deleted successfully."})
@@ -1,43 +1,68 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import JSONResponse
-from models.patient import Patient, PatientResponseAI
-from sqlalchemy.orm import Session, joinedload
-from modules.database import get_db
-import joblib
+from models.patient import Patient, PatientBaseAI, PatientResponseAI
+from models.region import Region
+from models.sex import Sex
+from models.smoker import Smoker
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from modules.bulk_prediction import predict_all_patients, BULK_PREDICTION_CHUNK_SIZE
+from modules.database import get_async_read_db, get_db, mark_client_write
+from modules.feature_encoding import encode_features
+from modules.inference import prediction_batcher, prediction_cache, prediction_executor
+from modules.micro_batcher import QueueFullError
+from modules.model_registry import model_registry
+import numpy as np
 import pandas as pd
+import io
+import os
 import logging
 
 router = APIRouter()
 
+# Maximum number of patients accepted by the batch prediction route
+BATCH_PREDICTION_MAX_ROWS = int(os.getenv("BATCH_PREDICTION_MAX_ROWS", "100000"))
+
 ###########
 # Routes
 ###########
 @router.get("/patients/", response_model=list[PatientResponseAI])
-def get_patients(db: Session = Depends(get_db)):
+async def get_patients(db: AsyncSession = Depends(get_async_read_db)):
     """
-    Route to get the patients list without personal data (to work with AI)
+    Route to get the patients list without personal data (to work with AI; the personal
+    data is not even read, so nothing is decrypted)
 
     Parameters:
-        - db: the current database session
+        - db: the current async read-only database session (on a read replica when there are some)
     
     Return:
         - patient_list: a list of all patients' data except personal data
     """
     try:
-        patients = db.query(Patient).options(
-            joinedload(Patient.region),
-            joinedload(Patient.smoker),
-            joinedload(Patient.sex)
-        ).all()
+        query = (
+            select(
+                Patient.age,
+                Patient.bmi,
+                Patient.children,
+                Region.region_name,
+                Smoker.is_smoker,
+                Sex.sex_label
+            )
+            .outerjoin(Region, Patient.id_region == Region.id_region)
+            .outerjoin(Smoker, Patient.id_smoker == Smoker.id_smoker)
+            .outerjoin(Sex, Patient.id_sex == Sex.id_sex)
+        )
+        patients = (await db.execute(query)).all()
 
         patient_list = [
             {
                 "age": a_patient.age,
                 "bmi": a_patient.bmi,
                 "children": a_patient.children,
-                "region": a_patient.region.region_name if a_patient.region else "Unknown",
-                "smoker": a_patient.smoker.is_smoker if a_patient.smoker else "Unknown",
-                "sex": a_patient.sex.sex_label if a_patient.sex else "Unknown"
+                "region": a_patient.region_name or "Unknown",
+                "smoker": a_patient.is_smoker or "Unknown",
+                "sex": a_patient.sex_label or "Unknown"
             }
             for a_patient in patients
         ]
@@ -47,8 +72,29 @@ def get_patients(db: Session = Depends(get_db)):
         logging.error(f"Error fetching patients: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching patients {str(e)}")
     
+@router.post("/patients/predict_all/", dependencies=[Depends(mark_client_write)])
+def predict_all(chunk_size: int = BULK_PREDICTION_CHUNK_SIZE, db: Session = Depends(get_db)):
+    """
+    Route to predict the charges of every stored patient and store the predictions and residuals
+
+    Parameters:
+        - chunk_size: the number of patients processed at a time
+        - db: the current database session
+
+    Return:
+        - statistics about the job (number of rows, duration, rows per second)
+    """
+    if chunk_size < 1:
+        raise HTTPException(status_code=422, detail="chunk_size must be positive")
+
+    try:
+        return predict_all_patients(db, chunk_size)
+    except Exception as e:
+        logging.error(f"Error predicting patients' charges: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error predicting patients' charges {str(e)}")
+
 @router.post("/charges_prediction")
-async def charges_prediction(request: Request):
+async def charges_prediction(item: PatientBaseAI):
     """
     Route to AI predict a patient's medical charges
 
@@ -59,48 +105,113 @@ async def charges_prediction(request: Request):
         - a JSON response message displaying the predicted charges
     """
     try:
-        # Model loading
-        loaded_model = joblib.load('data/gradient_boosting_model.joblib')
+        # Encoding fetched data straight into a row of features
+        features = model_registry.get_encoder().encode(item)
 
-        # Converting fetched data into a dataframe
-        item_dict = await request.json()
-        df = pd.DataFrame([item_dict])
-
-        df['age'] = int(df['age'])
-        df['bmi'] = float(df['bmi'])
-        df['children'] = int(df['children'])
-
-        # Encoding fetched data
-        df['smoker'] = df['smoker'].map({'no': 0, 'yes': 1})
-        df['sex'] = df['sex'].map({'male': 0, 'female': 1})
-
-        df['region_northeast'] = 0
-        df['region_northwest'] = 0
-        df['region_southeast'] = 0
-        df['region_southwest'] = 0
-
-        if df['region'][0] == 'northwest':
-            df.loc[0, "region_northwest"] = 1
-        elif df['region'][0] == 'northeast':
-            df.loc[0, "region_northeast"] = 1
-        elif df['region'][0] == 'southwest':
-            df.loc[0, "region_southwest"] = 1
-        elif df['region'][0] == 'southeast':
-            df.loc[0, "region_southeast"] = 1
-
-        df.drop(labels='region', axis=1, inplace=True)
-
-        # Normalizing data
-        # Simply dividing by 100 works well, while using MinMaxScaler() results in prediction bias
-        df['age'] = df['age'] / 100
-        df['bmi'] = df['bmi'] / 100
-        df['children'] = df['children'] / 100
-
-        # Prediction
-        y_pred = loaded_model.predict(df)
+        # Prediction (from the cache, or batched with the other requests arriving at the same time)
+        cache_key = prediction_cache.make_key(features)
+        model_version = model_registry.version
+        prediction = prediction_cache.get(cache_key, model_version)
+
+        if prediction is None:
+            prediction, prediction_version = await prediction_batcher.submit(features[0])
+
+            # Cached under the version of the model that made it, and only if it is still the current one
+            # (around a model swap, a worker may still run the previous model)
+            if prediction_version == model_registry.version:
+                prediction_cache.set(cache_key, prediction, prediction_version)
+
+        y_pred = np.array([prediction])
 
         return JSONResponse(content={"response_message": f"Charges prediction: {str(y_pred)}"})
 
+    except QueueFullError as e:
+        logging.error(f"Prediction queue full: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        logging.error(f"Invalid patient's data: {str(e)}")
+        raise HTTPException(status_code=422, detail=f"Invalid patient's data {str(e)}")
     except Exception as e:
         logging.error(f"Error fetching patient's data: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching patient's data {str(e)}")
+
+@router.post("/charges_prediction/batch")
+async def charges_prediction_batch(request: Request):
+    """
+    Route to AI predict the medical charges of many patients at once
+
+    Parameters:
+        - request: a JSON array of patients' data, or a CSV file (sent as the body
+          with the text/csv content type, or uploaded as the "file" field of a form)
+
+    Return:
+        - a JSON response with the predicted charges, in the same order as the patients
+    """
+    try:
+        content_type = request.headers.get("content-type", "")
+
+        # Converting fetched data into a dataframe
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None:
+                raise ValueError("Missing \"file\" field in the uploaded form")
+            df = pd.read_csv(upload.file)
+        elif content_type.startswith("text/csv"):
+            df = pd.read_csv(io.BytesIO(await request.body()))
+        else:
+            items = await request.json()
+            if not isinstance(items, list):
+                raise ValueError("Expected a JSON array of patients")
+            df = pd.DataFrame(items)
+
+        if len(df) > BATCH_PREDICTION_MAX_ROWS:
+            raise ValueError(f"Too many patients: {len(df)} (maximum {BATCH_PREDICTION_MAX_ROWS})")
+
+        if df.empty:
+            return JSONResponse(content={"count": 0, "predictions": []})
+
+        # Encoding all patients in a single pass
+        features = encode_features(df)
+
+        # Prediction (a single call for the whole batch, run outside of the event loop)
+        y_pred = await prediction_executor.predict(features)
+
+        return JSONResponse(content={"count": len(y_pred), "predictions": y_pred.tolist()})
+
+    except ValueError as e:
+        logging.error(f"Invalid patients' data: {str(e)}")
+        raise HTTPException(status_code=422, detail=f"Invalid patients' data {str(e)}")
+    except Exception as e:
+        logging.error(f"Error predicting patients' charges: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error predicting patients' charges {str(e)}")
+
+@router.get("/model_status/")
+def model_status():
+    """
+    Route to get the status of the resident prediction model
+
+    Return:
+        - the model's path, version (file hash), load time and worker's PID, and the inference pool's settings
+    """
+    return {**model_registry.status(), "executor": prediction_executor.status()}
+
+@router.get("/batcher_status/")
+def batcher_status():
+    """
+    Route to get the settings and metrics of the prediction micro-batcher
+
+    Return:
+        - the queue depth and the batch size and queue wait histograms
+    """
+    return prediction_batcher.status()
+
+@router.get("/cache_status/")
+def cache_status():
+    """
+    Route to get the counters of the prediction cache
+
+    Return:
+        - the cache's size, hits, misses, evictions, expirations and invalidations
+    """
+    return prediction_cache.status()
@@ -1,46 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session, joinedload
-from models.app_user import AppUser, AppUserForm, AppUserResponse, AppUserCreate, AppUserUpdate, get_app_users, create_app_user, get_app_user, update_app_user, delete_app_user
-from models.user_role import UserRoleResponse, get_user_roles
-from modules.database import get_db
-import os
-from cryptography.fernet import Fernet
-from dotenv import load_dotenv
-import ast
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from models.app_user import AppUserForm, AppUserResponse, AppUserCreate, AppUserUpdate, create_app_user_async, get_app_user_async, get_app_users_async, get_app_user_by_username, update_app_user_async, delete_app_user_async
+from models.user_role import UserRoleResponse
+from modules.database import get_async_db, get_async_read_db, get_db, mark_client_write
+from modules.lookup_cache import lookup_response
+from modules.passwords import dummy_password_hash, hash_password, needs_rehash, verify_password
+from modules.session_tokens import get_current_user, issue_token, revoke_token
 import hashlib
 import logging
 
+# Routes of the users (protected by a session token when REQUIRE_AUTH is enabled)
 router = APIRouter()
 
-# Loading .env file (only works locally)
-load_dotenv()
-
-# Retrieving the fernet key from the envrionment variable
-key = os.getenv("FERNET_KEY")
-fernet = Fernet(key)
-if not fernet:
-    logging.error("Error fetching FERNET_KEY")
-    raise ValueError("FERNET_KEY environment variable is not set.")
+# Session routes (never protected: they issue and revoke the tokens)
+auth_router = APIRouter()
 
 ###########
 # Routes
 ###########
 @router.get("/users/", response_model=list[AppUserResponse])
-def get_all_app_users(db: Session = Depends(get_db)):
+async def get_all_app_users(db: AsyncSession = Depends(get_async_read_db)):
     """
     Route to get the users list
 
     Parameters:
-        - db: the current database session
+        - db: the current async read-only database session (on a read replica when there are some)
 
     Return:
         - app_user_list: the list of app users' data
     """
     try:
-        users = db.query(AppUser).options(
-            joinedload(AppUser.user_role)
-        ).all()
+        users = await get_app_users_async(db)
 
         app_user_list = [
             {
@@ -58,36 +50,27 @@ def get_all_app_users(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error fetching users {str(e)}")
 
 @router.get("/roles/", response_model=list[UserRoleResponse])
-def get_roles(db: Session = Depends(get_db)):
+def get_roles(request: Request):
     """
-    Route to get the roles list
+    Route to get the roles list (from the in-process lookup cache, with ETag and Cache-Control headers)
 
     Parameters:
-        - db: the current database session
+        - request: the request (to compare its If-None-Match header with the ETag)
 
     Return:
-        - role_list: the list of roles' data
+        - the list of roles' data (or an empty 304 response if the client's copy is current)
     """
     try:
-        roles = get_user_roles(db)
-
-        role_list = [
-            {
-                "id_role": role.id_role,
-                "role_name": role.role_name
-            }
-            for role in roles
-        ]
-
-        return role_list
+        return lookup_response(request, "roles")
     except Exception as e:
         logging.error(f"Error fetching roles: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching roles {str(e)}")
 
-@router.post("/auth/")
-async def authentication(data: AppUserForm, db: Session = Depends(get_db)):
+@auth_router.post("/auth/")
+def authentication(data: AppUserForm, db: Session = Depends(get_db)):
     """
-    Route for authentication
+    Route for authentication (a single user looked up by username, its password hash checked in constant time;
+    run in the threadpool since hashing is CPU-bound)
 
     Parameters:
         - data: the user's data received from a form
@@ -95,57 +78,108 @@ async def authentication(data: AppUserForm, db: Session = Depends(get_db)):
 
     Return:
         - a JSON response message confirming or invalidating the authentication
+          (with a signed session token when the user is authenticated)
     """
     try:
-        username = data.username
-        password = data.password
+        password = hashlib.sha256(data.password.encode()).hexdigest()
+
+        app_user = get_app_user_by_username(db, data.username)
 
-        app_users = get_app_users(db)
+        if app_user is None:
+            # Hashing anyway, so that unknown usernames cannot be told apart by the response time
+            verify_password(password, dummy_password_hash())
+            return JSONResponse(content={"response_message": "Wrong username or password."})
 
-        for app_user in app_users:
-            decrypted_password = fernet.decrypt(ast.literal_eval(app_user.password)).decode()
-            if app_user.username == username and decrypted_password == hashlib.sha256(password.encode()).hexdigest():
-                return JSONResponse(content={"response_message": "User authenticated."})
+        if not verify_password(password, app_user.password):
+            return JSONResponse(content={"response_message": "Wrong username or password."})
 
-        return JSONResponse(content={"response_message": "Wrong username or password."})
+        # Upgrading legacy (or weaker) password hashes now that the password is known
+        if needs_rehash(app_user.password):
+            app_user.password = hash_password(password)
+            db.commit()
+
+        access_token, expires_at = issue_token(app_user.id_user, app_user.username, app_user.id_role)
+
+        return JSONResponse(content={
+            "response_message": "User authenticated.",
+            "access_token": access_token,
+            "token_type": "bearer",
+            "expires_at": expires_at
+        })
 
     except Exception as e:
         logging.error(f"Error fetching users: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching users: {repr(e)}")
 
-@router.post("/add_user/")
-def add_user(item: AppUserCreate, db: Session = Depends(get_db)):
+@auth_router.post("/logout/")
+def logout(claims: dict = Depends(get_current_user)):
+    """
+    Route to log out: revokes the request's session token
+
+    Parameters:
+        - claims: the claims of the session token
+
+    Return:
+        - a JSON response message confirming the logout
+    """
+    revoke_token(claims)
+
+    return JSONResponse(content={"response_message": "User logged out."})
+
+@auth_router.get("/me/")
+def get_me(claims: dict = Depends(get_current_user)):
+    """
+    Route to get the logged-in user (read from the session token, without any database access)
+
+    Parameters:
+        - claims: the claims of the session token
+
+    Return:
+        - the user's ID, username, role ID and the token's expiration time
+    """
+    return {
+        "id_user": claims["sub"],
+        "username": claims["username"],
+        "user_role": claims["role"],
+        "expires_at": claims["exp"]
+    }
+
+@router.post("/add_user/", dependencies=[Depends(mark_client_write)])
+async def add_user(item: AppUserCreate, db: AsyncSession = Depends(get_async_db)):
     """
     Route for adding a new user to the database
 
     Parameters:
         - item: the new user's data received from a form
-        - db: the current database session
+        - db: the current async database session
     
     Return:
         - a JSON response message confirming that the new user has been added
     """
     try:
-        new_user = create_app_user(db, item)
+        new_user = await create_app_user_async(db, item)
 
         return JSONResponse(content={"response_message": "New user added."})
+    except ValueError as e:
+        logging.error(f"Invalid user data: {str(e)}")
+        raise HTTPException(status_code=422, detail=f"Invalid user data {str(e)}")
     except Exception as e:
         logging.error(f"Error fetching user data: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching user data {str(e)}")
 
 @router.get("/{id_user}/", response_model=dict)
-def get_a_user(id_user: int, db: Session = Depends(get_db)):
+async def get_a_user(id_user: int, db: AsyncSession = Depends(get_async_db)):
     """
     Route to get a specific user's data
 
     Parameters:
         - id_user: the user's id
-        - db: the current database session
+        - db: the current async database session
 
     Return:
         - the user's data in JSON format
     """
-    user = get_app_user(db, id_user)
+    user = await get_app_user_async(db, id_user)
     if not user:
         logging.error("User not found")
         raise HTTPException(status_code=404, detail="User not found")
@@ -153,50 +187,53 @@ def get_a_user(id_user: int, db: Session = Depends(get_db)):
     return {
         "id_user": user.id_user,
         "username": user.username,
-        "password": fernet.decrypt(ast.literal_eval(user.password)).decode(),
         "user_email": user.user_email,
         "user_role": user.id_role
     }
 
-@router.put("/{id_user}/edit/", response_model=AppUserResponse)
-def edit_user(id_user: int, user_data: AppUserUpdate, db: Session = Depends(get_db)):
+@router.put("/{id_user}/edit/", response_model=AppUserResponse, dependencies=[Depends(mark_client_write)])
+async def edit_user(id_user: int, user_data: AppUserUpdate, db: AsyncSession = Depends(get_async_db)):
     """
     Route to edit a specific user's data
 
     Parameters:
         - id_user: the user's id
         - user_data: the updated user's data received from a form
-        - db: the current database session
+        - db: the current async database session
 
     Return:
         - a JSON response message confirming the success of the updating process
     """
-    user = get_app_user(db, id_user)
+    user = await get_app_user_async(db, id_user)
     if not user:
         logging.error("User not found")
         raise HTTPException(status_code=404, detail="User not found")
     
-    update_app_user(db, id_user, user_data)
+    try:
+        await update_app_user_async(db, id_user, user_data)
+    except ValueError as e:
+        logging.error(f"Invalid user data: {str(e)}")
+        raise HTTPException(status_code=422, detail=f"Invalid user data {str(e)}")
 
     return JSONResponse(content={"response_message": "User updated successfully."})
 
-@router.delete("/{id_user}/delete/", response_model=AppUserResponse)
-def delete_user(id_user: int, db: Session = Depends(get_db)):
+@router.delete("/{id_user}/delete/", response_model=AppUserResponse, dependencies=[Depends(mark_client_write)])
+async def delete_user(id_user: int, db: AsyncSession = Depends(get_async_db)):
     """
     Route to delete a specific user
 
     Parameters:
         - id_user: the user's id
-        - db: the current database session
+        - db: the current async database session
 
     Return:
         - a JSON response message confirming the user deletion
     """
-    user = get_app_user(db, id_user)
+    user = await get_app_user_async(db, id_user)
     if not user:
         logging.error("User not found")
         raise HTTPException(status_code=404, detail="User not found")
     
-    delete_app_user(db, id_user)
+    await delete_app_user_async(db, id_user)
     
     return JSONResponse(content={"response_message": "User deleted successfully."})
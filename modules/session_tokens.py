@@ -0,0 +1,202 @@
+from collections import OrderedDict
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from modules.encryption import key as fernet_key
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+
+# Secret signing the session tokens (derived from the Fernet key when not set, so that every worker shares it)
+SESSION_SECRET = os.getenv("SESSION_SECRET") or hmac.new(fernet_key.encode(), b"session-tokens", hashlib.sha256).hexdigest()
+
+# Number of seconds a session token stays valid
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+
+# Maximum number of revoked tokens remembered (the ones closest to expiring are forgotten first)
+SESSION_REVOCATION_STORE_SIZE = int(os.getenv("SESSION_REVOCATION_STORE_SIZE", "100000"))
+
+# Whether the patient, AI and user management routes require a session token
+REQUIRE_AUTH = os.getenv("REQUIRE_AUTH", "false").lower() in ("1", "true", "yes")
+
+def _b64encode(data: bytes):
+    """
+    Encodes bytes as unpadded URL-safe base64
+    """
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _b64decode(text: str):
+    """
+    Decodes unpadded URL-safe base64
+    """
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _sign(payload: str):
+    """
+    Computes the HMAC-SHA256 signature of an encoded payload
+    """
+    return _b64encode(hmac.new(SESSION_SECRET.encode(), payload.encode(), hashlib.sha256).digest())
+
+class RevocationStore:
+    """
+    In-memory store of the revoked session tokens, bounded in size: a revoked token is only remembered
+    until it expires (after that, its signature check fails anyway)
+    """
+
+    def __init__(self, max_size: int = SESSION_REVOCATION_STORE_SIZE):
+        """
+        Parameters:
+            - max_size: the maximum number of remembered tokens
+        """
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _evict(self, now: float):
+        """
+        Forgets the expired tokens, then the oldest ones above max_size (must be called with the lock held)
+
+        Parameters:
+            - now: the current time
+        """
+        # All of the tokens live for SESSION_TTL, so the oldest revocations expire first
+        while self._entries:
+            token_id, expires_at = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_size:
+                break
+            self._entries.popitem(last=False)
+            if expires_at > now:
+                self.evictions += 1
+
+    def revoke(self, token_id: str, expires_at: float):
+        """
+        Revokes a token
+
+        Parameters:
+            - token_id: the token's unique ID
+            - expires_at: the token's expiration time
+        """
+        with self._lock:
+            self._entries[token_id] = expires_at
+            self._evict(time.time())
+
+    def is_revoked(self, token_id: str):
+        """
+        Tells whether a token has been revoked
+
+        Parameters:
+            - token_id: the token's unique ID
+
+        Return:
+            - True if the token has been revoked
+        """
+        with self._lock:
+            return token_id in self._entries
+
+    def status(self):
+        """
+        Gets the size and the counters of the store
+
+        Return:
+            - a dictionary with the size and the number of evictions
+        """
+        with self._lock:
+            self._evict(time.time())
+            return {"max_size": self.max_size, "size": len(self._entries), "evictions": self.evictions}
+
+# Revoked tokens of the API process
+revocation_store = RevocationStore()
+
+def issue_token(id_user: int, username: str, id_role, ttl: float = SESSION_TTL):
+    """
+    Issues a signed session token
+
+    Parameters:
+        - id_user: the user's ID
+        - username: the user's username
+        - id_role: the user's role ID
+        - ttl: the number of seconds the token stays valid
+
+    Return:
+        - the token ("<payload>.<signature>")
+        - the token's expiration time (UNIX timestamp)
+    """
+    expires_at = time.time() + ttl
+    payload = _b64encode(json.dumps({
+        "sub": id_user,
+        "username": username,
+        "role": id_role,
+        "exp": expires_at,
+        "jti": secrets.token_urlsafe(16)
+    }, separators=(",", ":")).encode())
+
+    return f"{payload}.{_sign(payload)}", expires_at
+
+def verify_token(token: str):
+    """
+    Checks a session token (signature, expiration and revocation) without any database access
+
+    Parameters:
+        - token: the session token
+
+    Return:
+        - the token's claims (or None if the token is invalid, expired or revoked)
+    """
+    try:
+        payload, signature = token.split(".")
+        if not hmac.compare_digest(signature.encode(), _sign(payload).encode()):
+            return None
+
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+    if claims.get("exp", 0) < time.time() or revocation_store.is_revoked(claims.get("jti")):
+        return None
+
+    return claims
+
+def revoke_token(claims: dict):
+    """
+    Revokes a session token (logout)
+
+    Parameters:
+        - claims: the token's claims
+    """
+    revocation_store.revoke(claims["jti"], claims["exp"])
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+    """
+    Dependency: gets the claims of the request's session token (Authorization: Bearer header),
+    answering 401 if it is missing, invalid, expired or revoked
+
+    Return:
+        - the token's claims
+    """
+    claims = verify_token(credentials.credentials) if credentials else None
+
+    if claims is None:
+        logging.error("Invalid or missing session token")
+        raise HTTPException(status_code=401, detail="Invalid or missing session token", headers={"WWW-Authenticate": "Bearer"})
+
+    return claims
+
+def require_session(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)):
+    """
+    Dependency of the protected routers: checks the session token when REQUIRE_AUTH is enabled
+
+    Return:
+        - the token's claims (or None when REQUIRE_AUTH is disabled)
+    """
+    if not REQUIRE_AUTH:
+        return None
+
+    return get_current_user(credentials)
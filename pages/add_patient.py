@@ -1,21 +1,7 @@
 import streamlit as st
-import requests
-import os
-from cryptography.fernet import Fernet
-from dotenv import load_dotenv
-from modules.frontend_methods import get_regions, get_sexes, get_smokers
+from modules.frontend_methods import get_regions, get_sexes, get_smokers, api_request
 import logging
 
-# Loading .env file (only works locally)
-load_dotenv()
-
-# Retrieving the fernet key from the envrionment variable
-key = os.getenv("FERNET_KEY")
-fernet = Fernet(key)
-if not fernet:
-    logging.error("Error fetching FERNET_KEY")
-    raise ValueError("FERNET_KEY environment variable is not set.")
-
 # Getting data for region, smoker and sex
 regions = get_regions()
 smokers = get_smokers()
@@ -52,14 +38,15 @@ if st.button("Submit"):
     id_sex = next(a_sex[0] for a_sex in sex_labels_data if a_sex[1] == sex)
 
     # Sending the new patient's data to FastAPI
-    response = requests.post(
-        "http://127.0.0.1:8000/patients/add_patient/",
+    response = api_request(
+        "POST",
+        "/patients/add_patient/",
         json={
-            "last_name": str(fernet.encrypt(last_name.encode())),
-            "first_name": str(fernet.encrypt(first_name.encode())),
+            "last_name": last_name,
+            "first_name": first_name,
             "age": age,
             "bmi": bmi,
-            "patient_email": str(fernet.encrypt(patient_email.encode())),
+            "patient_email": patient_email,
             "children": children,
             "charges": charges,
             "region": str(id_region),
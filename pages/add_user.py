@@ -1,22 +1,8 @@
 import streamlit as st
-import requests
-import os
-from cryptography.fernet import Fernet
-from dotenv import load_dotenv
-from modules.frontend_methods import get_roles
+from modules.frontend_methods import get_roles, api_request
 import hashlib
 import logging
 
-# Loading .env file (only works locally)
-load_dotenv()
-
-# Retrieving the fernet key from the envrionment variable
-key = os.getenv("FERNET_KEY")
-fernet = Fernet(key)
-if not fernet:
-    logging.error("Error fetching FERNET_KEY")
-    raise ValueError("FERNET_KEY environment variable is not set.")
-
 # Getting data for user role
 roles = get_roles()
 
@@ -39,11 +25,12 @@ if st.button("Submit"):
     id_role = next(role[0] for role in role_data if role[1] == user_role)
 
     # Sending the new user's data to FastAPI
-    response = requests.post(
-        "http://127.0.0.1:8000/users/add_user/",
+    response = api_request(
+        "POST",
+        "/users/add_user/",
         json={
             "username": username,
-            "password": str(fernet.encrypt((hashlib.sha256(password.encode()).hexdigest()).encode())),
+            "password": hashlib.sha256(password.encode()).hexdigest(),
             "user_email": user_email,
             "user_role": str(id_role)
         }
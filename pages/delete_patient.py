@@ -1,5 +1,5 @@
 import streamlit as st
-import requests
+from modules.frontend_methods import api_request
 import logging
     
 # Initializing session state to track form visibility
@@ -32,7 +32,7 @@ if st.session_state.edit_form_visible:
             if st.button("Yes, delete"):
 
                 # Sending the id of the patient to delete to FastAPI
-                response = requests.delete(f"http://127.0.0.1:8000/patients/{id_patient}/delete/")
+                response = api_request("DELETE", f"/patients/{id_patient}/delete/")
 
                 if response.status_code == 200:
                     result = response.json()
@@ -1,22 +1,8 @@
 import streamlit as st
-import requests
-import os
-from cryptography.fernet import Fernet
-from dotenv import load_dotenv
-from modules.frontend_methods import get_roles, get_user
+from modules.frontend_methods import get_roles, get_user, api_request
 import hashlib
 import logging
 
-# Loading .env file (only works locally)
-load_dotenv()
-
-# Retrieving the fernet key from the envrionment variable
-key = os.getenv("FERNET_KEY")
-fernet = Fernet(key)
-if not fernet:
-    logging.error("Error fetching FERNET_KEY")
-    raise ValueError("FERNET_KEY environment variable is not set.")
-
 # Getting data for role
 roles = get_roles()
 
@@ -57,22 +43,23 @@ if st.session_state.edit_form_visible:
 
         if password:
             # Sending the updated user's data to FastAPI
-            response = requests.put(
-                f"http://127.0.0.1:8000/users/{id_user}/edit/",
+            response = api_request(
+                "PUT",
+                f"/users/{id_user}/edit/",
                 json={
                     "username": username,
-                    "password": str(fernet.encrypt((hashlib.sha256(password.encode()).hexdigest()).encode())),
+                    "password": hashlib.sha256(password.encode()).hexdigest(),
                     "user_email": user_email,
                     "user_role": str(id_role)
                 }
             )
         else:
-            # Sending the updated user's data to FastAPI
-            response = requests.put(
-                f"http://127.0.0.1:8000/users/{id_user}/edit/",
+            # Sending the updated user's data to FastAPI (the password is left unchanged)
+            response = api_request(
+                "PUT",
+                f"/users/{id_user}/edit/",
                 json={
                     "username": username,
-                    "password": str(fernet.encrypt(user["password"].encode())),
                     "user_email": user_email,
                     "user_role": str(id_role)
                 }
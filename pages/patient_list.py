@@ -1,19 +1,75 @@
 import streamlit as st
 import pandas as pd
-from modules.frontend_methods import get_patients
+from modules.frontend_methods import get_patients, get_regions, get_smokers, get_sexes
 import logging
 
 # Title and information
 st.title("Medical Expenses Manager")
 st.write("Patient list")
 
-# Getting the list of all patients
-patients = get_patients()
+# Getting data for region, smoker and sex (for the filters)
+region_data = {region["region_name"]: region["id_region"] for region in get_regions()}
+is_smoker_data = {smoker["is_smoker"]: smoker["id_smoker"] for smoker in get_smokers()}
+sex_labels_data = {sex["sex_label"]: sex["id_sex"] for sex in get_sexes()}
 
-# Displaying a dataframe of all patients' data
+# Creating the filters and sort options
+with st.sidebar:
+    st.write("Filters")
+    min_age, max_age = st.slider("Age:", 0, 120, (0, 120))
+    min_bmi, max_bmi = st.slider("BMI:", 0.0, 100.0, (0.0, 100.0))
+    region = st.selectbox("Region:", ["All"] + list(region_data))
+    smoker = st.selectbox("Is smoker:", ["All"] + list(is_smoker_data))
+    sex = st.selectbox("Sex:", ["All"] + list(sex_labels_data))
+    sort_by = st.selectbox("Sort by:", ["id_patient", "age", "bmi", "charges"])
+    order = st.radio("Order:", ["asc", "desc"], horizontal=True)
+    page_size = st.selectbox("Patients per page:", [50, 100, 500, 1000], index=1)
+
+params = {
+    "min_age": min_age,
+    "max_age": max_age,
+    "min_bmi": min_bmi,
+    "max_bmi": max_bmi,
+    "sort_by": sort_by,
+    "order": order,
+    "limit": page_size
+}
+if region != "All":
+    params["region"] = region_data[region]
+if smoker != "All":
+    params["smoker"] = is_smoker_data[smoker]
+if sex != "All":
+    params["sex"] = sex_labels_data[sex]
+
+# Going back to the first page when the filters change
+if st.session_state.get("patient_list_params") != params:
+    st.session_state.patient_list_params = params
+    st.session_state.patient_list_cursors = [None]
+
+cursors = st.session_state.patient_list_cursors
+
+# Getting the current page of patients
+patients, next_cursor = get_patients(params, cursors[-1])
+
+# Displaying a dataframe of the page's patients' data
 if patients:
     df = pd.DataFrame(patients)
     st.dataframe(df)
 else:
     logging.error("No patient data available")
     st.write("No patient data available.")
+
+# Navigating between the pages
+col1, col2, col3 = st.columns([1, 1, 2])
+
+with col1:
+    if st.button("Previous page", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+
+with col2:
+    if st.button("Next page", disabled=next_cursor is None):
+        cursors.append(next_cursor)
+        st.rerun()
+
+with col3:
+    st.write(f"Page {len(cursors)}")
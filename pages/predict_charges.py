@@ -1,6 +1,5 @@
 import streamlit as st
-import requests
-from modules.frontend_methods import get_regions, get_sexes, get_smokers
+from modules.frontend_methods import get_regions, get_sexes, get_smokers, api_request
 import logging
 
 # Getting data for region, smoker and sex
@@ -32,8 +31,9 @@ sex = st.selectbox("Sex:", sex_labels)
 if st.button("Submit"):
 
     # Sending the new patient's data to FastAPI
-    response = requests.post(
-        "http://127.0.0.1:8000/AI/charges_prediction/",
+    response = api_request(
+        "POST",
+        "/AI/charges_prediction/",
         json={
             "age": age,
             "sex": sex,
@@ -15,3 +15,408 @@ def test_charges_prediction():
     })
 
     assert response.status_code == 200
+
+def test_model_status():
+    client.post("http://127.0.0.1:8000/AI/charges_prediction/", json={
+        "age": "35",
+        "sex": "female",
+        "bmi": "18.2",
+        "children": "0",
+        "smoker": "no",
+        "region": "southwest"
+    })
+
+    response = client.get("http://127.0.0.1:8000/AI/model_status/")
+
+    assert response.status_code == 200
+    json_response = response.json()
+
+    assert json_response["loaded"] is True
+    assert json_response["load_count"] == 1
+    assert json_response["model_version"] is not None
+
+def test_charges_prediction_batch():
+    import pandas as pd
+    from modules.feature_encoding import encode_features
+    from modules.inference import predict_features
+
+    patients = [
+        {"age": 35, "sex": "female", "bmi": 18.2, "children": 0, "smoker": "no", "region": "southwest"},
+        {"age": 60, "sex": "male", "bmi": 31.5, "children": 2, "smoker": "yes", "region": "northeast"}
+    ]
+
+    response = client.post("http://127.0.0.1:8000/AI/charges_prediction/batch", json=patients)
+
+    assert response.status_code == 200
+    json_response = response.json()
+
+    assert json_response["count"] == 2
+    assert len(json_response["predictions"]) == 2
+
+    # The batch must give the same results as an in-process prediction of the same encoded rows
+    expected = predict_features(encode_features(pd.DataFrame(patients)))
+    assert json_response["predictions"] == pytest.approx(expected.tolist())
+
+    # And the single-patient route the same result as the batch (its message prints the array of one prediction)
+    single_response = client.post("http://127.0.0.1:8000/AI/charges_prediction/", json=patients[1])
+    single_prediction = float(single_response.json()["response_message"].split("[")[1].rstrip("]"))
+    assert single_prediction == pytest.approx(expected[1], rel=1e-6)
+
+def test_charges_prediction_batch_csv():
+    csv_data = "age,sex,bmi,children,smoker,region\n35,female,18.2,0,no,southwest\n60,male,31.5,2,yes,northeast\n"
+
+    response = client.post(
+        "http://127.0.0.1:8000/AI/charges_prediction/batch",
+        files={"file": ("patients.csv", csv_data, "text/csv")}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["count"] == 2
+
+def test_charges_prediction_batch_invalid_region():
+    response = client.post("http://127.0.0.1:8000/AI/charges_prediction/batch", json=[
+        {"age": 35, "sex": "female", "bmi": 18.2, "children": 0, "smoker": "no", "region": "nowhere"}
+    ])
+
+    assert response.status_code == 422
+
+@pytest.mark.parametrize("field, value", [("bmi", None), ("age", None), ("children", None)])
+def test_charges_prediction_batch_missing_number(field, value):
+    response = client.post("http://127.0.0.1:8000/AI/charges_prediction/batch", json=[
+        {"age": 35, "sex": "female", "bmi": 18.2, "children": 0, "smoker": "no", "region": "southwest", field: value}
+    ])
+
+    assert response.status_code == 422
+
+def test_predict_all():
+    response = client.post("http://127.0.0.1:8000/AI/patients/predict_all/?chunk_size=500")
+
+    assert response.status_code == 200
+    json_response = response.json()
+
+    assert json_response["predicted_rows"] > 0
+    assert json_response["chunks"] >= 3
+    assert json_response["rows_per_second"] > 0
+
+def test_predict_all_clears_skipped_rows():
+    from sqlalchemy import insert, select, update
+    from models.patient import Patient
+    from models.patient_prediction import PatientPrediction
+    from modules.bulk_prediction import predict_all_patients
+    from modules.database import session_local
+
+    db = session_local()
+    id_region = db.execute(select(Patient.id_region).where(Patient.id_patient == 2)).scalar()
+
+    try:
+        # A patient with a stale prediction, and a region that can no longer be encoded
+        db.execute(update(Patient).where(Patient.id_patient == 2).values(id_region=99))
+        db.execute(insert(PatientPrediction).prefix_with("OR REPLACE"), [{
+            "id_patient": 2, "predicted_charges": 1.0, "residual": 0.0, "model_version": "previous-model-version", "predicted_at": 0.0
+        }])
+        db.commit()
+
+        stats = predict_all_patients(db, chunk_size=500)
+
+        assert stats["skipped_rows"] >= 1
+        assert db.execute(select(PatientPrediction).where(PatientPrediction.id_patient == 2)).first() is None
+        assert db.execute(select(PatientPrediction.model_version).where(PatientPrediction.model_version != stats["model_version"])).first() is None
+    finally:
+        db.execute(update(Patient).where(Patient.id_patient == 2).values(id_region=id_region))
+        db.commit()
+        db.close()
+
+def test_batcher_status():
+    client.post("http://127.0.0.1:8000/AI/charges_prediction/", json={
+        "age": "29",
+        "sex": "male",
+        "bmi": "24.6",
+        "children": "2",
+        "smoker": "no",
+        "region": "northeast"
+    })
+
+    response = client.get("http://127.0.0.1:8000/AI/batcher_status/")
+
+    assert response.status_code == 200
+    json_response = response.json()
+
+    assert json_response["batch_size"]["count"] > 0
+    assert json_response["queue_wait_ms"]["count"] >= json_response["batch_size"]["count"]
+
+def test_charges_prediction_invalid_region():
+    response = client.post("http://127.0.0.1:8000/AI/charges_prediction/", json={
+        "age": "35",
+        "sex": "female",
+        "bmi": "18.2",
+        "children": "0",
+        "smoker": "no",
+        "region": "nowhere"
+    })
+
+    assert response.status_code == 422
+
+def test_cache_status():
+    patient = {
+        "age": "42",
+        "sex": "male",
+        "bmi": "27.3",
+        "children": "1",
+        "smoker": "yes",
+        "region": "northwest"
+    }
+
+    first_response = client.post("http://127.0.0.1:8000/AI/charges_prediction/", json=patient)
+    hits = client.get("http://127.0.0.1:8000/AI/cache_status/").json()["hits"]
+
+    second_response = client.post("http://127.0.0.1:8000/AI/charges_prediction/", json=patient)
+    response = client.get("http://127.0.0.1:8000/AI/cache_status/")
+
+    assert response.status_code == 200
+    assert response.json()["hits"] == hits + 1
+    assert second_response.json() == first_response.json()
+
+def test_charges_prediction_from_previous_model_not_cached(monkeypatch):
+    from modules.inference import prediction_batcher
+
+    async def submit_to_previous_model(row):
+        return 1234.5, "previous-model-version"
+
+    # A worker still running the previous model (around a model swap)
+    monkeypatch.setattr(prediction_batcher, "submit", submit_to_previous_model)
+
+    patient = {"age": "51", "sex": "female", "bmi": "22.9", "children": "3", "smoker": "no", "region": "southeast"}
+
+    for _ in range(2):
+        response = client.post("http://127.0.0.1:8000/AI/charges_prediction/", json=patient)
+
+        assert response.status_code == 200
+        assert "1234.5" in response.json()["response_message"]
+
+    assert client.get("http://127.0.0.1:8000/AI/cache_status/").json()["model_version"] != "previous-model-version"
+
+def test_compiled_model():
+    import joblib
+    import numpy as np
+    import pandas as pd
+    from modules.compiled_model import CompiledGradientBoosting, compile_model
+    from modules.feature_encoding import encode_features
+
+    model = joblib.load("data/gradient_boosting_model.joblib")
+    features = encode_features(pd.read_csv("data/insurance.csv"))
+
+    expected = model.predict(features)
+
+    # The shipped compiled model must be up to date with the joblib model
+    assert np.allclose(CompiledGradientBoosting.load("data/gradient_boosting_model.npz").predict(features), expected)
+    assert np.allclose(compile_model(model).predict(features), expected)
+
+def test_compiled_model_rejects_nan():
+    import numpy as np
+    from modules.compiled_model import CompiledGradientBoosting
+
+    model = CompiledGradientBoosting.load("data/gradient_boosting_model.npz")
+    features = np.zeros((2, len(model.feature_names_in_)))
+    features[1, 2] = np.nan
+
+    with pytest.raises(ValueError):
+        model.predict(features)
+
+def test_model_registry_keeps_model_on_failed_reload(tmp_path):
+    import os
+    import shutil
+    import joblib
+    from modules.model_registry import ModelRegistry
+
+    model_path = str(tmp_path / "model.joblib")
+    shutil.copy("data/gradient_boosting_model.joblib", model_path)
+
+    registry = ModelRegistry(model_path, check_interval=0)
+    first_model = registry.get_model()
+    first_version = registry.status()["model_version"]
+
+    # A valid new model file
+    joblib.dump(first_model, model_path, compress=3)
+    os.utime(model_path, (1_000_000_000, 1_000_000_000))
+    second_model = registry.get_model()
+    second_version = registry.status()["model_version"]
+
+    assert second_version != first_version
+
+    # A half-written model file: the resident model keeps being served
+    with open(model_path, "wb") as model_file:
+        model_file.write(b"partial")
+    os.utime(model_path, (1_000_000_100, 1_000_000_100))
+
+    assert registry.get_model() is second_model
+    assert registry.status()["model_version"] == second_version
+    assert registry.reload_if_changed() is False
+
+@pytest.mark.parametrize("mode", ["process", "thread"])
+def test_inference_executor(mode):
+    import asyncio
+    import os
+    import numpy as np
+    import pandas as pd
+    from modules.feature_encoding import encode_features
+    from modules.inference import InferenceExecutor, _worker_model_status, predict_features
+    from modules.model_registry import model_registry
+
+    features = encode_features(pd.read_csv("data/insurance.csv").head(50)).to_numpy(dtype=float)
+    executor = InferenceExecutor(mode=mode, workers=2)
+
+    try:
+        executor.start()
+        assert executor.status()["running"] is True
+
+        predictions = asyncio.run(executor.predict(features))
+        versioned_predictions = asyncio.run(executor.predict_versioned(features))
+        worker_status = executor._get_executor().submit(_worker_model_status).result()
+    finally:
+        executor.shutdown()
+
+    assert executor.status()["running"] is False
+
+    expected = predict_features(features)
+    assert np.allclose(predictions, expected)
+    assert [prediction for prediction, _ in versioned_predictions] == pytest.approx(expected.tolist())
+    assert {version for _, version in versioned_predictions} == {model_registry.version}
+
+    # The workers preload the model once (no reload on the first prediction)
+    assert worker_status["loaded"] is True
+    assert worker_status["load_count"] == 1
+    assert (worker_status["worker_pid"] != os.getpid()) == (mode == "process")
+
+def test_inference_executor_invalid_mode():
+    from modules.inference import InferenceExecutor
+
+    with pytest.raises(ValueError):
+        InferenceExecutor(mode="gpu")
+
+def test_batcher_max_in_flight():
+    import asyncio
+    import numpy as np
+    from modules.micro_batcher import MicroBatcher
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def predict_batch(features):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.02)
+        in_flight -= 1
+        return features[:, 0].tolist()
+
+    async def run():
+        batcher = MicroBatcher(predict_batch, max_batch_size=1, max_wait_ms=0, max_in_flight=2)
+        try:
+            return await asyncio.gather(*[batcher.submit(np.array([float(i)])) for i in range(6)])
+        finally:
+            await batcher.stop()
+
+    assert asyncio.run(run()) == [float(i) for i in range(6)]
+    assert max_in_flight == 2
+
+def test_lifespan_starts_and_stops_inference_pool():
+    from modules.inference import prediction_executor
+
+    prediction_executor.shutdown()
+
+    with TestClient(app) as lifespan_client:
+        assert prediction_executor.status()["running"] is True
+
+        response = lifespan_client.get("http://127.0.0.1:8000/AI/model_status/")
+        assert response.json()["executor"]["running"] is True
+
+    assert prediction_executor.status()["running"] is False
+
+def test_batcher_merges_concurrent_rows():
+    import asyncio
+    import numpy as np
+    from modules.micro_batcher import MicroBatcher
+
+    batch_sizes = []
+
+    async def predict_batch(features):
+        batch_sizes.append(len(features))
+        return (features[:, 0] * 2).tolist()
+
+    async def run():
+        batcher = MicroBatcher(predict_batch, max_batch_size=64, max_wait_ms=50)
+        try:
+            return await asyncio.gather(*[batcher.submit(np.array([float(i)])) for i in range(10)])
+        finally:
+            await batcher.stop()
+
+    assert asyncio.run(run()) == [float(i * 2) for i in range(10)]
+    assert batch_sizes == [10]
+
+def test_batcher_queue_full():
+    import asyncio
+    import numpy as np
+    from modules.micro_batcher import MicroBatcher, QueueFullError
+
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def predict_batch(features):
+        started.set()
+        await release.wait()
+        return features[:, 0].tolist()
+
+    async def run():
+        batcher = MicroBatcher(predict_batch, max_batch_size=1, max_wait_ms=0, max_queue_size=2, max_in_flight=1)
+        try:
+            # The first row is being predicted: the next ones wait in the queue
+            first = asyncio.create_task(batcher.submit(np.array([0.0])))
+            await started.wait()
+            waiting = [asyncio.create_task(batcher.submit(np.array([float(i)]))) for i in (1, 2)]
+            await asyncio.sleep(0.01)
+
+            with pytest.raises(QueueFullError):
+                await batcher.submit(np.array([3.0]))
+
+            assert batcher.status()["rejected"] == 1
+            assert batcher.status()["queue_depth"] == 2
+
+            release.set()
+            return await asyncio.gather(first, *waiting)
+        finally:
+            await batcher.stop()
+
+    assert asyncio.run(run()) == [0.0, 1.0, 2.0]
+
+def test_charges_prediction_queue_full(monkeypatch):
+    from modules.inference import prediction_batcher
+    from modules.micro_batcher import QueueFullError
+
+    async def submit_to_full_queue(row):
+        raise QueueFullError("Prediction queue is full")
+
+    monkeypatch.setattr(prediction_batcher, "submit", submit_to_full_queue)
+
+    response = client.post("http://127.0.0.1:8000/AI/charges_prediction/", json={
+        "age": "63", "sex": "male", "bmi": "33.1", "children": "0", "smoker": "yes", "region": "southwest"
+    })
+
+    assert response.status_code == 503
+
+def test_predict_features_without_feature_names_warning():
+    import warnings
+    import numpy as np
+    from models.patient import PatientBaseAI
+    from modules.inference import predict_features
+    from modules.model_registry import model_registry
+
+    patient = PatientBaseAI(age="35", sex="female", bmi="18.2", children="0", smoker="no", region="southwest")
+    features = model_registry.get_encoder().encode(patient)
+
+    # No warning to silence: the array is named after the model's columns, and no filter is installed
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        prediction = predict_features(features)
+
+    assert np.allclose(prediction, model_registry.get_model().predict(features))
+    assert not any(message is not None and "valid feature names" in message.pattern for _, message, *_ in warnings.filters)
@@ -1,8 +1,16 @@
 import pytest
 from fastapi.testclient import TestClient
 from main import app
+from models.sex import Sex
+from models.patient import Patient, PatientCreate, create_patient
+from modules.database import async_engine, engine, session_local
+from modules.lookup_cache import lookup_cache
+from sqlalchemy import delete, event, func, select, text
+from modules.migrations import migrate_encrypted_columns
 from cryptography.fernet import Fernet
 from dotenv import load_dotenv
+import base64
+import json
 import logging
 import os
 
@@ -24,12 +32,151 @@ def test_get_patients():
     assert response.status_code == 200
     assert isinstance(response.json(), list)
 
+def test_get_patients_pages():
+    first_page = client.get("http://127.0.0.1:8000/patients/patients/?limit=10")
+
+    assert first_page.status_code == 200
+    assert len(first_page.json()) == 10
+    assert "X-Next-Cursor" in first_page.headers
+
+    second_page = client.get(f"http://127.0.0.1:8000/patients/patients/?limit=10&cursor={first_page.headers['X-Next-Cursor']}")
+
+    assert second_page.status_code == 200
+    assert second_page.json()[0]["id_patient"] > first_page.json()[-1]["id_patient"]
+
+def test_get_patients_filters():
+    response = client.get("http://127.0.0.1:8000/patients/patients/?min_age=30&max_age=40&smoker=0&sort_by=charges&order=desc&limit=50")
+
+    assert response.status_code == 200
+    patients = response.json()
+
+    assert all(30 <= patient["age"] <= 40 and patient["smoker"] == "yes" for patient in patients)
+    assert [patient["charges"] for patient in patients] == sorted([patient["charges"] for patient in patients], reverse=True)
+
+    next_page = client.get(f"http://127.0.0.1:8000/patients/patients/?min_age=30&max_age=40&smoker=0&sort_by=charges&order=desc&limit=50&cursor={response.headers['X-Next-Cursor']}")
+
+    assert next_page.status_code == 200
+    assert next_page.json()[0]["charges"] <= patients[-1]["charges"]
+
+def test_get_patients_large_page():
+    response = client.get("http://127.0.0.1:8000/patients/patients/?limit=1000")
+
+    assert response.status_code == 200
+    patients = response.json()
+    assert len(patients) == 1000
+
+    patient = client.get(f"http://127.0.0.1:8000/patients/{patients[-1]['id_patient']}/").json()
+
+    assert patients[-1]["last_name"] == patient["last_name"]
+    assert patients[-1]["patient_email"] == patient["patient_email"]
+
+def test_get_patients_invalid_cursor():
+    response = client.get("http://127.0.0.1:8000/patients/patients/?cursor=invalid")
+
+    assert response.status_code == 422
+
+@pytest.mark.parametrize("value", [["x", "y"], [1.5], [None, 3], [2.0, 3.5], "not a list"])
+def test_get_patients_malformed_cursor(value):
+    cursor = base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+    response = client.get(f"http://127.0.0.1:8000/patients/patients/?sort_by=charges&cursor={cursor}")
+
+    assert response.status_code == 422
+
+def test_export_patients_ndjson():
+    response = client.get("http://127.0.0.1:8000/patients/export/?format=ndjson&columns=id_patient,age,region")
+
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+
+    assert len(lines) > 1
+    assert set(json.loads(lines[0])) == {"id_patient", "age", "region"}
+
+def test_export_patients_csv():
+    response = client.get("http://127.0.0.1:8000/patients/export/?format=csv&min_age=60")
+
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+
+    assert lines[0].startswith("id_patient,last_name,first_name,age")
+    assert len(lines) > 1
+
+def test_export_patients_invalid_column():
+    response = client.get("http://127.0.0.1:8000/patients/export/?columns=password")
+
+    assert response.status_code == 422
+
 def test_get_all_regions():
     response = client.get("http://127.0.0.1:8000/patients/regions/")
 
     assert response.status_code == 200
     assert isinstance(response.json(), list)
 
+def test_get_all_regions_etag():
+    response = client.get("http://127.0.0.1:8000/patients/regions/")
+
+    assert response.status_code == 200
+    assert "max-age" in response.headers["Cache-Control"]
+
+    cached_response = client.get("http://127.0.0.1:8000/patients/regions/", headers={"If-None-Match": response.headers["ETag"]})
+
+    assert cached_response.status_code == 304
+    assert cached_response.headers["ETag"] == response.headers["ETag"]
+
+def test_lookup_cache_invalidation():
+    etag = client.get("http://127.0.0.1:8000/patients/sexes/").headers["ETag"]
+
+    db = session_local()
+    try:
+        sex = Sex(sex_label="test")
+        db.add(sex)
+        db.commit()
+
+        response = client.get("http://127.0.0.1:8000/patients/sexes/")
+
+        assert response.headers["ETag"] != etag
+        assert "test" in [sex["sex_label"] for sex in response.json()]
+
+        db.delete(sex)
+        db.commit()
+    finally:
+        db.close()
+
+    assert client.get("http://127.0.0.1:8000/patients/sexes/").headers["ETag"] == etag
+
+def test_lookup_cache_invalidated_after_load():
+    from modules.lookup_cache import LookupCache
+
+    cache = LookupCache(session_local)
+    load = cache.load
+
+    def load_then_invalidate(names=None):
+        # Another thread's commit invalidating the tables right after they are loaded
+        loaded = load(names)
+        cache.invalidate(names)
+        return loaded
+
+    cache.load = load_then_invalidate
+
+    rows, etag = cache.get("regions")
+
+    assert len(rows) > 0 and etag
+    assert cache.resolve_id("regions", rows[0]["id_region"]) == rows[0]["id_region"]
+    assert cache.resolve_id("regions", 99) is None
+
+def test_get_all_lookups():
+    response = client.get("http://127.0.0.1:8000/patients/lookups/")
+
+    assert response.status_code == 200
+    lookups = response.json()
+
+    assert set(lookups) == {"regions", "smokers", "sexes", "roles", "version"}
+    assert lookups["regions"] == client.get("http://127.0.0.1:8000/patients/regions/").json()
+    assert response.headers["ETag"] == f'"{lookups["version"]}"'
+
+    cached_response = client.get("http://127.0.0.1:8000/patients/lookups/", headers={"If-None-Match": response.headers["ETag"]})
+
+    assert cached_response.status_code == 304
+
 def test_get_all_smokers():
     response = client.get("http://127.0.0.1:8000/patients/smokers/")
 
@@ -44,11 +191,11 @@ def test_get_all_sexes():
 
 def test_add_patient():
     response = client.post("http://127.0.0.1:8000/patients/add_patient/", json={
-        "last_name": str(fernet.encrypt("Doe".encode())),
-        "first_name": str(fernet.encrypt("John".encode())),
+        "last_name": "Doe",
+        "first_name": "John",
         "age": "24",
         "bmi": "18.1",
-        "patient_email": str(fernet.encrypt("john.doe@gmail.com".encode())),
+        "patient_email": "john.doe@gmail.com",
         "children": "1",
         "charges": "3000.00",
         "region": "1",
@@ -59,6 +206,57 @@ def test_add_patient():
     assert response.status_code == 200
     assert response.json()["response_message"] == "New patient added."
 
+def test_add_patient_invalid_region():
+    response = client.post("http://127.0.0.1:8000/patients/add_patient/", json={
+        "last_name": "Doe",
+        "first_name": "John",
+        "age": "24",
+        "bmi": "18.1",
+        "patient_email": "john.doe@example.com",
+        "children": "1",
+        "charges": "3000.00",
+        "region": "99",
+        "smoker": "0",
+        "sex": "1"
+    })
+
+    assert response.status_code == 500
+    assert "Invalid region ID" in response.json()["detail"]
+
+def test_create_patient_single_insert():
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.split()[0].upper())
+
+    # The lookup tables are loaded beforehand (as at the application's startup)
+    lookup_cache.load()
+
+    db = session_local()
+    event.listen(engine, "before_cursor_execute", record_statement)
+    try:
+        patient = create_patient(db, PatientCreate(
+            last_name="Doe",
+            first_name="John",
+            age=24,
+            bmi=18.1,
+            patient_email="john.doe@example.com",
+            children=1,
+            charges=3000.0,
+            region="1",
+            smoker="0",
+            sex="1"
+        ))
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+
+    try:
+        assert statements == ["INSERT"]
+    finally:
+        db.delete(patient)
+        db.commit()
+        db.close()
+
 def test_get_patient():
     response = client.get("http://127.0.0.1:8000/patients/1346/")
 
@@ -69,11 +267,11 @@ def test_get_patient():
 
 def test_edit_patient():
     response = client.put("http://127.0.0.1:8000/patients/1346/edit/", json={
-        "last_name": str(fernet.encrypt("Doe".encode())),
-        "first_name": str(fernet.encrypt("Jane".encode())),
+        "last_name": "Doe",
+        "first_name": "Jane",
         "age": "24",
         "bmi": "18.1",
-        "patient_email": str(fernet.encrypt("jane.doe@gmail.com".encode())),
+        "patient_email": "jane.doe@gmail.com",
         "children": "1",
         "charges": "3000.00",
         "region": "1",
@@ -84,8 +282,323 @@ def test_edit_patient():
     assert response.status_code == 200
     assert response.json()["response_message"] == "Patient updated successfully."
 
+@pytest.mark.parametrize("change", [{"region": "99"}, {"charges": None}, {"bmi": None}])
+def test_edit_patient_invalid_data(change):
+    response = client.put("http://127.0.0.1:8000/patients/1346/edit/", json={
+        "last_name": "Doe",
+        "first_name": "Jane",
+        "age": "24",
+        "bmi": "18.1",
+        "patient_email": "jane.doe@gmail.com",
+        "children": "1",
+        "charges": "3000.00",
+        "region": "1",
+        "smoker": "0",
+        "sex": "0",
+        **change
+    })
+
+    assert response.status_code == 422
+
 def test_delete_a_patient():
     response = client.delete("http://127.0.0.1:8000/patients/1346/delete/")
 
     assert response.status_code == 200
     assert response.json()["response_message"] == "Patient deleted successfully."
+
+def test_migrate_encrypted_columns():
+    db = session_local()
+    try:
+        migrate_encrypted_columns(db, batch_size=500)
+        stats = migrate_encrypted_columns(db)
+    finally:
+        db.close()
+
+    assert stats["migrated_rows"] == {"patient": 0}
+
+    response = client.get("http://127.0.0.1:8000/patients/patients/?limit=10")
+
+    assert response.status_code == 200
+    assert all(not patient["last_name"].startswith("b'") for patient in response.json())
+
+def imported_patients(import_request):
+    """
+    Runs an import request and gets the patients it added (which are then deleted)
+    """
+    db = session_local()
+    try:
+        last_id = db.execute(select(func.max(Patient.id_patient))).scalar()
+        response = import_request()
+        patients = db.query(Patient).filter(Patient.id_patient > last_id).order_by(Patient.id_patient).all()
+        db.execute(delete(Patient).where(Patient.id_patient > last_id))
+        db.commit()
+    finally:
+        db.close()
+
+    return response, patients
+
+def test_import_patients_json():
+    rows = [
+        {"last_name": "Doe", "first_name": "John", "age": 24, "bmi": 18.1, "patient_email": "john.doe@example.com", "children": 1, "charges": 3000.0, "region": "southeast", "smoker": "no", "sex": "male"},
+        {"last_name": "Doe", "first_name": "Jane", "age": 25, "bmi": 19.2, "patient_email": "jane.doe@example.com", "children": 0, "charges": 2000.0, "region": "atlantis", "smoker": "no", "sex": "female"},
+        {"last_name": "Roe", "first_name": "Richard", "bmi": 22.0, "patient_email": "richard.roe@example.com", "children": 2},
+        {"last_name": "Roe", "first_name": "Jane", "age": 40, "bmi": 30.5, "patient_email": "jane.roe@example.com", "children": 3, "charges": 9000.0, "region": 2, "smoker": 0, "sex": 0}
+    ]
+
+    response, patients = imported_patients(lambda: client.post("http://127.0.0.1:8000/patients/bulk/", json=rows))
+
+    assert response.status_code == 200
+    stats = response.json()
+
+    assert (stats["received_rows"], stats["imported_rows"], stats["failed_rows"]) == (4, 2, 2)
+    assert [error["row"] for error in stats["errors"]] == [2, 3]
+    assert "region" in stats["errors"][0]["error"]
+    assert "age" in stats["errors"][1]["error"]
+    assert [(patient.first_name, patient.patient_email) for patient in patients] == [("John", "john.doe@example.com"), ("Jane", "jane.roe@example.com")]
+    assert [(patient.id_region, patient.id_smoker, patient.id_sex) for patient in patients] == [(1, 1, 1), (2, 0, 0)]
+
+def test_import_patients_csv():
+    data = (
+        "last_name,first_name,age,bmi,patient_email,children,charges,region,smoker,sex\r\n"
+        "Doe,John,24,18.1,john.doe@example.com,1,3000.0,northeast,yes,male\r\n"
+        "Doe,Jane,twenty,19.2,jane.doe@example.com,0,,1,1,0\r\n"
+        "Roe,Jane,40,30.5,jane.roe@example.com,3,9000.0,0,1,0\r\n"
+        "Roe,Richard,35,22.0,richard.roe@example.com,2,,,,\r\n"
+    )
+
+    response, patients = imported_patients(lambda: client.post(
+        "http://127.0.0.1:8000/patients/bulk/?chunk_size=1",
+        files={"file": ("patients.csv", data.encode(), "text/csv")}
+    ))
+
+    assert response.status_code == 200
+    stats = response.json()
+
+    assert (stats["imported_rows"], stats["failed_rows"], stats["chunks"]) == (2, 2, 2)
+    assert [error["row"] for error in stats["errors"]] == [2, 4]
+    assert [(patient.last_name, float(patient.charges), patient.id_region) for patient in patients] == [("Doe", 3000.0, 3), ("Roe", 9000.0, 0)]
+
+def test_import_patients_ndjson():
+    data = (
+        json.dumps({"last_name": "Doe", "first_name": "John", "age": 24, "bmi": 18.1, "patient_email": "john.doe@example.com", "children": 1, "charges": 3000.0, "region": "0", "smoker": "1", "sex": "1"}) + "\n"
+        "{not json\n"
+        "\n"
+        + json.dumps({"last_name": "Roe", "first_name": "Jane", "age": 40, "bmi": 30.5, "patient_email": "jane.roe@example.com", "children": 3, "charges": 9000.0, "region": "northwest", "smoker": "yes", "sex": "female"}) + "\n"
+    )
+
+    response, patients = imported_patients(lambda: client.post(
+        "http://127.0.0.1:8000/patients/bulk/",
+        content=data,
+        headers={"Content-Type": "application/x-ndjson"}
+    ))
+
+    assert response.status_code == 200
+    stats = response.json()
+
+    assert (stats["received_rows"], stats["imported_rows"], stats["failed_rows"]) == (3, 2, 1)
+    assert stats["errors"][0]["row"] == 2
+    assert [patient.patient_email for patient in patients] == ["john.doe@example.com", "jane.roe@example.com"]
+
+def test_import_patients_invalid_format():
+    response = client.post("http://127.0.0.1:8000/patients/bulk/", content="<patients/>", headers={"Content-Type": "application/xml"})
+
+    assert response.status_code == 422
+
+    response = client.post("http://127.0.0.1:8000/patients/bulk/", json={"last_name": "Doe"})
+
+    assert response.status_code == 422
+
+def test_edit_patients_bulk():
+    rows = [
+        {"last_name": "Bulk", "first_name": f"Patient{i}", "age": 30 + i, "bmi": 20.0, "patient_email": f"bulk{i}@example.com", "children": 0, "charges": 1000.0, "region": 0, "smoker": 1, "sex": 0}
+        for i in range(3)
+    ]
+
+    db = session_local()
+    try:
+        last_id = db.execute(select(func.max(Patient.id_patient))).scalar()
+        client.post("http://127.0.0.1:8000/patients/bulk/", json=rows)
+        ids = [id_patient for (id_patient,) in db.query(Patient.id_patient).filter(Patient.id_patient > last_id)]
+
+        response = client.patch("http://127.0.0.1:8000/patients/bulk/", json={"ids": ids[:2], "values": {"charges": 1234.5, "region": 3}})
+
+        assert response.status_code == 200
+        assert response.json()["updated_rows"] == 2
+
+        response = client.patch("http://127.0.0.1:8000/patients/bulk/", json={"ids": ids, "filters": {"min_age": 32}, "values": {"last_name": "Updated"}})
+
+        assert response.json()["updated_rows"] == 1
+
+        patients = db.query(Patient).filter(Patient.id_patient.in_(ids)).order_by(Patient.id_patient).all()
+
+        assert [(float(patient.charges), patient.id_region) for patient in patients] == [(1234.5, 3), (1234.5, 3), (1000.0, 0)]
+        assert [patient.last_name for patient in patients] == ["Bulk", "Bulk", "Updated"]
+    finally:
+        db.execute(delete(Patient).where(Patient.id_patient > last_id))
+        db.commit()
+        db.close()
+
+def test_edit_patients_bulk_invalid():
+    response = client.patch("http://127.0.0.1:8000/patients/bulk/", json={"values": {"charges": 1.0}})
+
+    assert response.status_code == 422
+
+    response = client.patch("http://127.0.0.1:8000/patients/bulk/", json={"ids": [1], "values": {"region": 99}})
+
+    assert response.status_code == 422
+
+def test_delete_patients_bulk():
+    rows = [
+        {"last_name": "Bulk", "first_name": f"Patient{i}", "age": 30, "bmi": 20.0, "patient_email": f"bulk{i}@example.com", "children": 0, "charges": 1000.0 + i, "region": 0, "smoker": 1, "sex": 0}
+        for i in range(4)
+    ]
+
+    db = session_local()
+    try:
+        last_id = db.execute(select(func.max(Patient.id_patient))).scalar()
+        client.post("http://127.0.0.1:8000/patients/bulk/", json=rows)
+        ids = [id_patient for (id_patient,) in db.query(Patient.id_patient).filter(Patient.id_patient > last_id)]
+
+        response = client.request("DELETE", "http://127.0.0.1:8000/patients/bulk/", json={"ids": ids[:2] + [ids[-1] + 1000]})
+
+        assert response.status_code == 200
+        assert response.json()["deleted_rows"] == 2
+
+        response = client.request("DELETE", "http://127.0.0.1:8000/patients/bulk/", json={"ids": ids, "filters": {"min_charges": 1003}})
+
+        assert response.json()["deleted_rows"] == 1
+        assert [id_patient for (id_patient,) in db.query(Patient.id_patient).filter(Patient.id_patient > last_id)] == [ids[2]]
+
+        response = client.request("DELETE", "http://127.0.0.1:8000/patients/bulk/", json={"filters": {}})
+
+        assert response.status_code == 422
+    finally:
+        db.execute(delete(Patient).where(Patient.id_patient > last_id))
+        db.commit()
+        db.close()
+
+def test_edit_patient_single_update():
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.split()[0].upper())
+
+    lookup_cache.load()
+
+    # The route runs on the async engine
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record_statement)
+    try:
+        response = client.put("http://127.0.0.1:8000/patients/999999/edit/", json={
+            "last_name": "Doe",
+            "first_name": "Jane",
+            "age": "24",
+            "bmi": "18.1",
+            "patient_email": "jane.doe@example.com",
+            "children": "1",
+            "charges": "3000.00",
+            "region": "1",
+            "smoker": "0",
+            "sex": "0"
+        })
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record_statement)
+
+    assert response.status_code == 404
+    assert statements == ["UPDATE"]
+
+def test_delete_a_patient_not_found():
+    response = client.delete("http://127.0.0.1:8000/patients/999999/delete/")
+
+    assert response.status_code == 404
+
+def test_add_patient_token_like_text_is_encrypted():
+    response = client.post("http://127.0.0.1:8000/patients/add_patient/", json={
+        "last_name": "b'gAAAAhello'",
+        "first_name": "John",
+        "age": "24",
+        "bmi": "18.1",
+        "patient_email": "john.doe@example.com",
+        "children": "1",
+        "charges": "3000.00",
+        "region": "1",
+        "smoker": "0",
+        "sex": "1"
+    })
+
+    assert response.status_code == 200
+
+    db = session_local()
+    try:
+        id_patient = db.execute(select(func.max(Patient.id_patient))).scalar()
+        stored = db.execute(text("SELECT last_name FROM patient WHERE id_patient = :id_patient"), {"id_patient": id_patient}).scalar()
+
+        assert fernet.decrypt(stored).decode() == "b'gAAAAhello'"
+        assert client.get("http://127.0.0.1:8000/patients/patients/?min_age=24&max_age=24&limit=1000").status_code == 200
+    finally:
+        db.execute(delete(Patient).where(Patient.id_patient == id_patient))
+        db.commit()
+        db.close()
+
+def test_migrate_encrypted_columns_skips_invalid_tokens():
+    db = session_local()
+    try:
+        id_patient = db.execute(text(
+            "INSERT INTO patient (last_name, first_name, age, bmi, patient_email, children, charges, id_region, id_smoker, id_sex) "
+            "VALUES ('b''gAAAAhello''', 'b''gAAAAhello''', 24, 18.1, 'b''gAAAAhello''', 1, 3000.0, 1, 0, 1) RETURNING id_patient"
+        )).scalar()
+        db.commit()
+
+        migrate_encrypted_columns(db)
+
+        assert db.execute(text("SELECT typeof(last_name) FROM patient WHERE id_patient = :id_patient"), {"id_patient": id_patient}).scalar() == "text"
+    finally:
+        db.execute(delete(Patient).where(Patient.id_patient == id_patient))
+        db.commit()
+        db.close()
+
+def test_get_patients_pages_tied_precise_values():
+    db = session_local()
+    try:
+        ids = [db.execute(text(
+            "INSERT INTO patient (last_name, first_name, age, bmi, patient_email, children, charges, id_region, id_smoker, id_sex) "
+            "VALUES (:token, :token, 24, 18.1, :email, 1, 0.123456789, 1, 0, 1) RETURNING id_patient"
+        ), {"token": fernet.encrypt(b"Doe"), "email": fernet.encrypt(f"tied{i}@example.com".encode())}).scalar() for i in range(3)]
+        db.commit()
+
+        seen = []
+        cursor = ""
+        for _ in range(3):
+            response = client.get(f"http://127.0.0.1:8000/patients/patients/?max_charges=0.2&sort_by=charges&limit=1{cursor}")
+            assert response.status_code == 200
+            seen += [patient["id_patient"] for patient in response.json()]
+            cursor = f"&cursor={response.headers.get('X-Next-Cursor')}"
+
+        assert seen == ids
+    finally:
+        db.execute(delete(Patient).where(Patient.id_patient.in_(ids)))
+        db.commit()
+        db.close()
+
+def test_add_patient_insert_failure(monkeypatch):
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    async def failing_commit(self):
+        raise RuntimeError("disk I/O error")
+
+    monkeypatch.setattr(AsyncSession, "commit", failing_commit)
+
+    response = client.post("http://127.0.0.1:8000/patients/add_patient/", json={
+        "last_name": "Doe",
+        "first_name": "John",
+        "age": "24",
+        "bmi": "18.1",
+        "patient_email": "john.doe@example.com",
+        "children": "1",
+        "charges": "3000.00",
+        "region": "1",
+        "smoker": "0",
+        "sex": "1"
+    })
+
+    assert response.status_code == 500
+    assert "disk I/O error" in response.json()["detail"]
@@ -1,6 +1,7 @@
 import pytest
 from fastapi.testclient import TestClient
 from main import app
+from modules import session_tokens
 from cryptography.fernet import Fernet
 from dotenv import load_dotenv
 import logging
@@ -33,11 +34,67 @@ def test_authentication():
 
     assert response.status_code == 200
     assert response.json()["response_message"] == "User authenticated."
+    assert response.json()["token_type"] == "bearer"
+
+def test_session_token():
+    token = client.post("http://127.0.0.1:8000/users/auth/", json={
+        "username": "JohnShepard2",
+        "password": "Gsd234@"
+    }).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.get("http://127.0.0.1:8000/users/me/", headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["username"] == "JohnShepard2"
+
+    response = client.post("http://127.0.0.1:8000/users/logout/", headers=headers)
+
+    assert response.status_code == 200
+    assert client.get("http://127.0.0.1:8000/users/me/", headers=headers).status_code == 401
+
+def test_invalid_session_token():
+    assert client.get("http://127.0.0.1:8000/users/me/").status_code == 401
+    assert client.get("http://127.0.0.1:8000/users/me/", headers={"Authorization": "Bearer invalid.token"}).status_code == 401
+    assert client.get("http://127.0.0.1:8000/users/me/", headers={"Authorization": "Bearer invalid.tokén".encode("latin-1")}).status_code == 401
+    assert client.get("http://127.0.0.1:8000/users/me/", headers={"Authorization": "Bearer invalidé.token".encode("latin-1")}).status_code == 401
+
+def test_require_auth(monkeypatch):
+    monkeypatch.setattr(session_tokens, "REQUIRE_AUTH", True)
+
+    assert client.get("http://127.0.0.1:8000/patients/regions/").status_code == 401
+
+    token = client.post("http://127.0.0.1:8000/users/auth/", json={
+        "username": "JohnShepard2",
+        "password": "Gsd234@"
+    }).json()["access_token"]
+
+    response = client.get("http://127.0.0.1:8000/patients/regions/", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 200
+
+def test_authentication_wrong_password():
+    response = client.post("http://127.0.0.1:8000/users/auth/", json={
+        "username": "JohnShepard2",
+        "password": "wrong"
+    })
+
+    assert response.status_code == 200
+    assert response.json()["response_message"] == "Wrong username or password."
+
+def test_authentication_unknown_user():
+    response = client.post("http://127.0.0.1:8000/users/auth/", json={
+        "username": "UnknownUser",
+        "password": "Gsd234@"
+    })
+
+    assert response.status_code == 200
+    assert response.json()["response_message"] == "Wrong username or password."
 
 def test_add_user():
     response = client.post("http://127.0.0.1:8000/users/add_user/", json={
         "username": "JohnDoe",
-        "password": str(fernet.encrypt((hashlib.sha256("test".encode()).hexdigest()).encode())),
+        "password": hashlib.sha256("test".encode()).hexdigest(),
         "user_email": "john.doe@gmail.com",
         "user_role": "2"
     })
@@ -45,6 +102,16 @@ def test_add_user():
     assert response.status_code == 200
     assert response.json()["response_message"] == "New user added."
 
+def test_add_user_token_password():
+    response = client.post("http://127.0.0.1:8000/users/add_user/", json={
+        "username": "TokenUser",
+        "password": str(fernet.encrypt((hashlib.sha256("test".encode()).hexdigest()).encode())),
+        "user_email": "token.user@gmail.com",
+        "user_role": "2"
+    })
+
+    assert response.status_code == 422
+
 def test_get_a_user():
     response = client.get("http://127.0.0.1:8000/users/13/")
 
@@ -52,11 +119,21 @@ def test_get_a_user():
     json_response = response.json()
 
     assert json_response["username"] == "JohnDoe"
+    assert "password" not in json_response
+
+def test_authentication_new_user():
+    response = client.post("http://127.0.0.1:8000/users/auth/", json={
+        "username": "JohnDoe",
+        "password": "test"
+    })
+
+    assert response.status_code == 200
+    assert response.json()["response_message"] == "User authenticated."
 
 def test_edit_user():
     response = client.put("http://127.0.0.1:8000/users/13/edit/", json={
         "username": "JaneDoe",
-        "password": str(fernet.encrypt((hashlib.sha256("test".encode()).hexdigest()).encode())),
+        "password": hashlib.sha256("test".encode()).hexdigest(),
         "user_email": "jane.doe@gmail.com",
         "user_role": "2"
     })
@@ -64,6 +141,33 @@ def test_edit_user():
     assert response.status_code == 200
     assert response.json()["response_message"] == "User updated successfully."
 
+@pytest.mark.parametrize("password", [str(fernet.encrypt(b"test")), "b'gAAAAinvalid'"])
+def test_edit_user_token_password(password):
+    response = client.put("http://127.0.0.1:8000/users/13/edit/", json={
+        "username": "JaneDoe",
+        "password": password,
+        "user_email": "jane.doe@gmail.com",
+        "user_role": "2"
+    })
+
+    assert response.status_code == 422
+
+def test_edit_user_keeps_password():
+    response = client.put("http://127.0.0.1:8000/users/13/edit/", json={
+        "username": "JaneDoe",
+        "user_email": "jane.doe@gmail.com",
+        "user_role": "2"
+    })
+
+    assert response.status_code == 200
+
+    response = client.post("http://127.0.0.1:8000/users/auth/", json={
+        "username": "JaneDoe",
+        "password": "test"
+    })
+
+    assert response.json()["response_message"] == "User authenticated."
+
 def test_delete_a_patient():
     response = client.delete("http://127.0.0.1:8000/users/13/delete/")
 